@@ -0,0 +1,115 @@
+"""
+the tool-calling loop of ask / re --tools
+
+the request offers the chosen tools (ag.tools); while the model answers
+with tool calls, they run and their results go back to it, until it
+answers in text. after <rounds> turns of calls the last request says
+tool_choice "none", so there always is an answer
+
+the calls of one turn run at once, at most <jobs> at a time, each on a
+daemon thread of its own: a call that goes over its tool's timeout is
+answered "timed out" and its slot goes to the next call, so one slow
+tool holds up neither the others nor ag's exit. every result is cut to
+its tool's max_bytes before it is sent
+"""
+from typing import Any, Callable, Dict, List
+import json, queue, threading, time
+from .tools import Tool, cut
+from .config import TOOL_JOBS, TOOL_ROUNDS
+
+POLL_S = 0.05  # timeouts are checked this often while calls are running
+
+Report = Callable[[str, Dict[str, Any], float, str], None]  # (tool, args, seconds, result)
+
+def _args(call: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        args = json.loads(call.get("function", {}).get("arguments") or "{}")
+    except ValueError:
+        return {}
+    return args if isinstance(args, dict) else {}
+
+def invoke(call: Dict[str, Any], tools: Dict[str, Tool]) -> str:
+    """the result of one tool call, errors included: the model gets to see them"""
+    fn = call.get("function") or {}
+    tool = tools.get(fn.get("name"))
+    if tool is None:
+        return f"error: there is no tool '{fn.get('name')}'"
+    try:
+        args = json.loads(fn.get("arguments") or "{}")
+    except ValueError as e:
+        return f"error: the arguments are not valid JSON: {e}"
+    if not isinstance(args, dict):
+        return "error: the arguments must be a JSON object"
+    try:
+        return cut(tool.fn(args, tool.timeout, tool.max_bytes), tool.max_bytes)
+    except Exception as e:
+        return f"error: {type(e).__name__}: {e}"
+
+def run_calls(calls: List[Dict[str, Any]], tools: Dict[str, Tool], jobs: int = TOOL_JOBS,
+              report: Report | None = None) -> List[Dict[str, str]]:
+    """run one turn's tool <calls>, return the tool messages answering them, in order"""
+    results: Dict[int, str] = {}
+    started: Dict[int, float] = {}
+    seconds: Dict[int, float] = {}
+    finished: "queue.Queue[int]" = queue.Queue()
+    slots = threading.Semaphore(jobs)
+    lock = threading.Lock()
+
+    def limit(i: int) -> float:
+        tool = tools.get(calls[i].get("function", {}).get("name"))
+        return tool.timeout if tool else float("inf")  # answered at once anyway
+
+    def work(i: int) -> None:
+        slots.acquire()
+        with lock:
+            started[i] = time.monotonic()
+        text = invoke(calls[i], tools)
+        with lock:
+            if i in results:
+                return  # timed out: its slot was handed on then
+            results[i] = text
+            seconds[i] = time.monotonic() - started[i]
+        slots.release()
+        finished.put(i)
+
+    for i in range(len(calls)):
+        threading.Thread(target=work, args=(i,), name=f"ag-tool-{i}", daemon=True).start()
+    reported = set()
+    while len(reported) < len(calls):
+        try:
+            finished.get(timeout=POLL_S)
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        with lock:
+            for i, t0 in started.items():
+                if i not in results and now - t0 > limit(i):
+                    results[i] = f"error: timed out after {limit(i):g} s"
+                    seconds[i] = now - t0
+                    slots.release()
+            done = [i for i in results if i not in reported]
+        for i in done:
+            reported.add(i)
+            if report:
+                report(calls[i].get("function", {}).get("name") or "?", _args(calls[i]), seconds[i], results[i])
+    return [{"role": "tool", "tool_call_id": call.get("id", ""), "content": results[i]}
+            for i, call in enumerate(calls)]
+
+def run(client, messages: List[Dict[str, Any]], tools: Dict[str, Tool], jobs: int = TOOL_JOBS,
+        rounds: int = TOOL_ROUNDS, timeout: float | None = None, use_cache: bool = True,
+        report: Report | None = None) -> str:
+    """
+    the model's final answer to <messages>, <tools> at hand
+    client: ag.api_client.Client; raise APIError as it does
+    """
+    messages = list(messages)
+    schemas = [t.schema() for t in tools.values()]
+    for _ in range(rounds):
+        reply = client.complete(messages, schemas, timeout=timeout, use_cache=use_cache)
+        calls = reply.get("tool_calls")
+        if not calls:
+            return reply.get("content") or ""
+        messages.append({"role": "assistant", "content": reply.get("content"), "tool_calls": calls})
+        messages.extend(run_calls(calls, tools, jobs, report))
+    reply = client.complete(messages, schemas, tool_choice="none", timeout=timeout, use_cache=use_cache)
+    return reply.get("content") or ""
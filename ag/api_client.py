@@ -1,56 +1,547 @@
 import requests
-import json
-from typing import List, Dict, Any
-from .config import API_KEY, BASE_URL, DEFAULT_MODEL
+import json, gzip, asyncio, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import urllib3.exceptions
+from typing import List, Dict, Any, Iterator
+from .config import (
+    API_KEY, BASE_URL, DEFAULT_MODEL,
+    POOL_SIZE, KEEP_ALIVE, CONNECT_TIMEOUT, READ_TIMEOUT, GZIP_MIN_BYTES, STREAM_USAGE,
+    CACHE_ENABLED, HEDGE, RETRIES, RETRY_MAX,
+)
+from .cache import ResponseCache, payload_key
+from .sinks import TerminalSink, consume
+from . import cassette, metrics, ratelimit, sse
+
+READ_SIZE = 64 * 1024  # upper bound per read of a stream, reads never wait to fill it
+
+def _prompt_tokens(payload: Dict[str, Any]) -> int:
+    from .context import estimate_tokens, message_tokens
+    if "messages" in payload:
+        tools = estimate_tokens(json.dumps(payload["tools"])) if payload.get("tools") else 0
+        return tools + sum(message_tokens(m) for m in payload["messages"])
+    texts = payload.get("input") or []
+    return sum(estimate_tokens(t) for t in ([texts] if isinstance(texts, str) else texts))
+
+def _completion_tokens(rec: Dict[str, Any], reply: str) -> int:
+    usage = rec.get("usage") or {}
+    if usage.get("completion_tokens") is not None:
+        return usage["completion_tokens"]
+    from .context import estimate_tokens
+    return estimate_tokens(reply)
+
+def _reply_text(reply: Dict[str, Any]) -> str:
+    """what an assistant message costs in completion tokens: its text and its tool calls"""
+    return (reply.get("content") or "") + (json.dumps(reply["tool_calls"]) if reply.get("tool_calls") else "")
 
 class APIError(Exception):
     """throw this when request failed"""
+    def __init__(self, message: str, status: int | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+
+_connect = threading.local()  # seconds the last connect() on this thread took
+
+class _TimedConnect:
+    def connect(self) -> None:
+        t0 = time.perf_counter()
+        super().connect()  # TCP (and TLS) handshake
+        _connect.seconds = time.perf_counter() - t0
+
+    def request(self, *args, **kwargs) -> None:
+        # let a watcher (ag.hedge) get hold of the connection so it can cut it
+        watch = getattr(_connect, "watch", None)
+        if watch:
+            watch(self)
+        super().request(*args, **kwargs)
+
+class _HTTPConnection(_TimedConnect, HTTPConnection): pass
+class _HTTPSConnection(_TimedConnect, HTTPSConnection): pass
+class _HTTPPool(HTTPConnectionPool): ConnectionCls = _HTTPConnection
+class _HTTPSPool(HTTPSConnectionPool): ConnectionCls = _HTTPSConnection
+
+class TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections report their handshake time"""
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+class Client:
+    """
+    reusable client for /v1/chat/completions
+
+    keeps a pooled requests.Session so repeated calls (repl, scripts)
+    reuse the same TCP/TLS connection instead of reconnecting each time
+    """
+    def __init__(
+            self,
+            base_url: str = BASE_URL,
+            api_key: str | None = API_KEY,
+            model: str = DEFAULT_MODEL,
+            pool_size: int = POOL_SIZE,
+            keep_alive: bool = KEEP_ALIVE,
+            connect_timeout: float = CONNECT_TIMEOUT,
+            read_timeout: float = READ_TIMEOUT,
+            gzip_min_bytes: int = GZIP_MIN_BYTES,
+            cache: ResponseCache | None = None,
+            route: str | None = None,
+            transport: BaseAdapter | None = None,
+    ) -> None:
+        """
+        route:     label for the metrics records (e.g. "primary" / "backup")
+        transport: adapter the session sends through, default the pooled
+                   one, recorded or replaced per $AG_CASSETTE (see ag.cassette)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.gzip_min_bytes = gzip_min_bytes
+        self.cache = cache
+        self.route = route
+
+        self.session = requests.Session()
+        adapter = transport or cassette.adapter(TimedAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.replay = isinstance(adapter, cassette.Player)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Connection": "keep-alive" if keep_alive else "close",
+        })
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def build_payload(self, message: List[Dict[str, str]], stream: bool = False) -> Dict[str, Any]:
+        """canonical request body"""
+        payload: Dict[str, Any] = {
+            "model": self.model,
+            "messages": message,
+        }
+        if stream:
+            payload["stream"] = True
+            if STREAM_USAGE:
+                payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def post(
+            self,
+            path: str,
+            payload: Dict[str, Any],
+            stream: bool = False,
+            timeout: float | None = None,
+            rec: Dict[str, Any] | None = None
+    ) -> requests.Response:
+        """
+        POST json to base_url + path, gzip the body if it is large enough
+        raise APIError on http error
+
+        every attempt waits for the shared rate limits (see ag.ratelimit);
+        429 / 5xx answers and connection errors are retried $AG_RETRIES
+        times, after the server's Retry-After or a jittered backoff. on
+        success the request keeps its slot: the caller ends it with
+        self.release(payload, ...) once the response is read
+        rec: metrics record, gets status, connect_ms (0 on a reused connection),
+             ttfb_ms, retries and queued_ms (time spent waiting for the limits)
+        """
+        if not self.api_key and not self.replay:
+            raise APIError("Missing API_KEY: set $API_KEY in .env")
+
+        body = json.dumps(payload).encode("utf-8")
+        header: Dict[str, str] = {}
+        if self.gzip_min_bytes and len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body)
+            header["Content-Encoding"] = "gzip"
+
+        limiter = ratelimit.limiter(self.base_url, payload["model"])
+        tokens = _prompt_tokens(payload) if limiter.tpm else 0
+        queued = 0.0
+        for attempt in range(RETRIES + 1):
+            last = attempt == RETRIES
+            queued += limiter.acquire(tokens)
+            _connect.seconds = 0.0
+            try:
+                resp = self.session.post(
+                    f"{self.base_url}{path}",
+                    data=body,
+                    headers=header,
+                    timeout=(self.connect_timeout, timeout or self.read_timeout),
+                    stream=stream,
+                )
+            except requests.ConnectionError as e:
+                limiter.release()
+                if last:
+                    raise APIError(f"Request failed: {e}") from e
+                time.sleep(ratelimit.backoff(attempt))
+                continue
+            except requests.RequestException as e:
+                limiter.release()
+                raise APIError(f"Request failed: {e}") from e
+            finally:
+                if rec is not None:
+                    rec["connect_ms"] = round(_connect.seconds * 1000, 2)
+                    if attempt:
+                        rec["retries"] = attempt
+                    if queued >= 0.001:
+                        rec["queued_ms"] = round(queued * 1000, 2)
+            if resp.status_code not in ratelimit.RETRY_STATUS:
+                break
+            hint = ratelimit.retry_after(resp.headers)
+            limiter.release(throttled=True, retry_after=hint)
+            if last or (hint or 0) > RETRY_MAX:
+                break  # to the error below, already released
+            resp.close()
+            time.sleep(ratelimit.backoff(attempt, hint))
+        if rec is not None:
+            rec["status"] = resp.status_code
+            rec["ttfb_ms"] = round(resp.elapsed.total_seconds() * 1000, 2)
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError as e:
+            if resp.status_code not in ratelimit.RETRY_STATUS:
+                limiter.release()
+            raise APIError(f"HTTP {resp.status_code} : {resp.text}", resp.status_code) from e
+        return resp
+
+    def release(self, payload: Dict[str, Any], rec: Dict[str, Any] | None = None, reply: str = "") -> None:
+        """end a request post() returned: free its slot, charge its completion tokens"""
+        limiter = ratelimit.limiter(self.base_url, payload["model"])
+        limiter.release(_completion_tokens(rec or {}, reply) if limiter.tpm else 0)
+
+    def chat(
+            self,
+            message: List[Dict[str, str]],
+            stream: bool = False,
+            timeout: float | None = None,
+            use_cache: bool = True
+    ) -> str:
+        """
+        message:   [{"role":"system"|"user"|"assistant","content": "..."}...]
+        stream:    print deltas to the terminal as they arrive
+        timeout:   read timeout, defaults to self.read_timeout
+        use_cache: look up / store the reply in self.cache (if any)
+        """
+        if stream:
+            return consume(self.stream(message, timeout, use_cache), TerminalSink())
+
+        payload = self.build_payload(message)
+        cache = self.cache if use_cache else None
+        key = payload_key(self.base_url, payload) if cache else ""
+        rec = self._metric(payload)
+        reply = ""
+        try:
+            if cache:
+                chunks = cache.get(key)
+                if chunks is not None:
+                    rec["cached"] = True
+                    reply = "".join(chunks)
+                    return reply
+
+            resp = self.post("/v1/chat/completions", payload, timeout=timeout, rec=rec)
+            try:
+                body = resp.json()
+                reply = body["choices"][0]["message"]["content"]
+                rec["model"] = body.get("model") or rec["model"]
+                rec["usage"] = body.get("usage")
+            finally:
+                self.release(payload, rec, reply)
+        except BaseException as e:
+            rec["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            self._log(rec, message, reply)
+        if cache and reply:
+            cache.put(key, [reply])
+        return reply
+
+    def complete(
+            self,
+            message: List[Dict[str, Any]],
+            tools: List[Dict[str, Any]],
+            tool_choice: str | None = None,
+            timeout: float | None = None,
+            use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """
+        the assistant message for a request offering <tools> (see ag.agent):
+        {"role", "content", "tool_calls"?}; content is None next to tool calls
+        tools:       function schemas, see ag.tools.Tool.schema
+        tool_choice: "none" asks for an answer, no more calls
+        """
+        payload = self.build_payload(message)
+        payload["tools"] = tools
+        if tool_choice:
+            payload["tool_choice"] = tool_choice
+        cache = self.cache if use_cache else None
+        key = payload_key(self.base_url, payload) if cache else ""
+        rec = self._metric(payload)
+        reply: Dict[str, Any] = {}
+        try:
+            if cache:
+                chunks = cache.get(key)
+                if chunks is not None:
+                    rec["cached"] = True
+                    reply = json.loads("".join(chunks))
+                    return reply
+
+            resp = self.post("/v1/chat/completions", payload, timeout=timeout, rec=rec)
+            try:
+                body = resp.json()
+                reply = body["choices"][0]["message"]
+                rec["model"] = body.get("model") or rec["model"]
+                rec["usage"] = body.get("usage")
+            finally:
+                self.release(payload, rec, _reply_text(reply))
+        except BaseException as e:
+            rec["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            if reply.get("tool_calls"):
+                rec["tool_calls"] = len(reply["tool_calls"])
+            self._log(rec, message, _reply_text(reply))
+        if cache and reply:
+            cache.put(key, [json.dumps(reply)])
+        return reply
+
+    def embed(self, texts: List[str], model: str, timeout: float | None = None) -> List[List[float]]:
+        """one vector per text, from /v1/embeddings"""
+        payload = {"model": model, "input": texts}
+        resp = self.post("/v1/embeddings", payload, timeout=timeout)
+        try:
+            data = sorted(resp.json()["data"], key=lambda d: d["index"])
+            vecs = [d["embedding"] for d in data]
+        except (ValueError, KeyError, TypeError) as e:
+            raise APIError(f"Bad embeddings response: {e}") from e
+        finally:
+            self.release(payload)
+        if len(vecs) != len(texts):
+            raise APIError(f"Bad embeddings response: {len(vecs)} vectors for {len(texts)} texts")
+        return vecs
+
+    def stream(
+            self,
+            message: List[Dict[str, str]],
+            timeout: float | None = None,
+            use_cache: bool = True,
+            cancel: threading.Event | None = None,
+            route: str | None = None,
+    ) -> Iterator[str]:
+        """
+        yield reply deltas as they arrive
+
+        a cached reply is replayed delta by delta; a reply is cached only
+        when the stream was read to the end
+        cancel: once set, a failure is recorded as cancelled, not as an error
+        route:  metrics label of this request, instead of the client's
+        """
+        payload = self.build_payload(message, stream=True)
+        cache = self.cache if use_cache else None
+        key = payload_key(self.base_url, payload) if cache else ""
+        rec = self._metric(payload, route)
+        chunks: List[str] = []
+        try:
+            if cache:
+                cached = cache.get(key)
+                if cached is not None:
+                    rec["cached"] = True
+                    chunks = cached
+                    yield from chunks
+                    return
+
+            resp = self.post("/v1/chat/completions", payload, stream=True, timeout=timeout, rec=rec)
+            try:
+                with resp:
+                    for delta in self._deltas(resp, rec):
+                        if not chunks:
+                            rec["ttft_ms"] = round((time.perf_counter() - rec["t0"]) * 1000, 2)
+                        chunks.append(delta)
+                        yield delta
+            finally:
+                self.release(payload, rec, "".join(chunks))
+        except BaseException as e:
+            # GeneratorExit: the consumer stopped reading
+            if cancel is not None and cancel.is_set():
+                rec["cancelled"] = True
+            else:
+                rec["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            self._log(rec, message, "".join(chunks))
+        if cache and chunks:
+            cache.put(key, chunks)
+
+    @staticmethod
+    def _deltas(resp: requests.Response, rec: Dict[str, Any] | None = None) -> Iterator[str]:
+        """
+        content deltas of an SSE response, read as raw bytes (see ag.sse)
+
+        usage, model and finish_reason go into <rec>; an error event or
+        chunk, or a connection lost mid-stream, raises APIError
+        """
+        decoder = sse.Decoder()
+        raw = resp.raw
+        if raw.chunked:
+            reads = raw.stream(READ_SIZE, decode_content=True)  # each HTTP chunk as it comes
+        else:
+            # read(n) would wait for n bytes: take whatever has arrived
+            reads = iter(lambda: raw.read1(READ_SIZE, decode_content=True), b"")
+        try:
+            for data in reads:
+                for event in decoder.feed(data):
+                    if event.data == sse.DONE:
+                        return
+                    if event.type == "error":
+                        raise APIError(f"Stream error: {event.data.decode('utf-8', 'replace')}")
+                    if event.type != "message":
+                        continue  # provider-specific events (ping, ...)
+                    c = sse.chunk(event.data)
+                    if c is None:
+                        continue
+                    if c.error:
+                        raise APIError(f"Stream error: {c.error}")
+                    if rec is not None:
+                        if c.usage:
+                            rec["usage"] = c.usage
+                        if c.model:
+                            rec["model"] = c.model
+                        if c.finish_reason:
+                            rec["finish_reason"] = c.finish_reason
+                    if c.content:
+                        yield c.content
+        except (urllib3.exceptions.HTTPError, OSError) as e:
+            raise APIError(f"Stream broken: {e}") from e
+        except ValueError as e:
+            raise APIError(f"Bad stream chunk: {e}") from e
+
+    def _metric(self, payload: Dict[str, Any], route: str | None = None) -> Dict[str, Any]:
+        rec = {"ts": time.time(), "t0": time.perf_counter(), "url": self.base_url,
+               "model": payload["model"], "stream": bool(payload.get("stream"))}
+        if route or self.route:
+            rec["route"] = route or self.route
+        if self.replay:
+            rec["replayed"] = True
+        return rec
+
+    def _log(self, rec: Dict[str, Any], message: List[Dict[str, str]], reply: str) -> None:
+        """finish a metrics record and append it to the log"""
+        total = time.perf_counter() - rec.pop("t0")
+        rec["total_ms"] = round(total * 1000, 2)
+        usage = rec.pop("usage", None) or {}
+        if usage.get("completion_tokens") is not None:
+            rec["prompt_tokens"] = usage.get("prompt_tokens")
+            rec["completion_tokens"] = usage["completion_tokens"]
+        else:
+            from .context import estimate_tokens, message_tokens
+            rec["prompt_tokens"] = sum(message_tokens(m) for m in message)
+            rec["completion_tokens"] = estimate_tokens(reply)
+            rec["estimated"] = True
+        # generation rate: from the first token on when streaming
+        gen = total - rec["ttft_ms"] / 1000 if rec.get("ttft_ms") else total
+        if rec["completion_tokens"] and gen > 0 and not rec.get("cached"):
+            rec["tok_s"] = round(rec["completion_tokens"] / gen, 2)
+        metrics.record(rec)
+
+_client: Client | None = None
+
+def get_client() -> Client:
+    """process-wide default client, created on first use"""
+    global _client
+    if _client is None:
+        _client = Client(cache=ResponseCache() if CACHE_ENABLED else None)
+    return _client
 
 def send_message(
         message: List[Dict[str, str]],
         stream: bool = False,
-        timeout: int = 30
+        timeout: float | None = None,
+        use_cache: bool = True,
+        hedge: str | None = None
 ) -> str:
     """
-    message: [{"role":"system"|"user"|"assistant","content": "..."}...]
-    stream:  ~
-    timeout: ~
-    """
-    if not API_KEY:
-        raise APIError("Missing API_KEY: set $API_KEY in .env")
-
-    url = f"{BASE_URL}/v1/chat/completions"
-    header = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload: Dict[str, Any] = {
-        "model": DEFAULT_MODEL,
-        "messages": message,
-    }
-    if stream:
-        payload["stream"] = True
-
-    resp = requests.post(url, headers=header, json=payload, timeout=timeout, stream=stream)
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as e:
-        raise APIError(f"HTTP {resp.status_code} : {resp.text}") from e
-
-    if not stream:
-        body = resp.json()
-        return body["choices"][0]["message"]["content"]
-
-    full = ""
-    for line in resp.iter_lines():
-        if not line or line.startswith(b"data: [DONE]"):
-            continue
-        chunk = line.decode().removeprefix("data: ")
-        data = json.loads(chunk)
-        delta = data["choices"][0]["delta"].get("content")
-        if delta:
-            print(delta, end="", flush=True)
-            full += delta
-    print()
-
-    return full
+    message:   [{"role":"system"|"user"|"assistant","content": "..."}...]
+    stream:    ~
+    timeout:   read timeout in seconds (default: $AG_READ_TIMEOUT)
+    use_cache: reuse a cached reply for an identical request ($AG_CACHE=0 disables)
+    hedge:     off | hedge | race (default: $AG_HEDGE), see ag.hedge
+    """
+    if (hedge or HEDGE) != "off":
+        deltas = stream_message(message, timeout=timeout, use_cache=use_cache, hedge=hedge)
+        return consume(deltas, TerminalSink()) if stream else consume(deltas)
+    return get_client().chat(message, stream=stream, timeout=timeout, use_cache=use_cache)
+
+def stream_message(
+        message: List[Dict[str, str]],
+        timeout: float | None = None,
+        use_cache: bool = True,
+        hedge: str | None = None
+) -> Iterator[str]:
+    """
+    yield reply deltas; drive it into sinks with ag.sinks.consume
+
+      reply = consume(stream_message(msgs), TerminalSink(), FileSink("out.md"))
+    """
+    mode = hedge or HEDGE
+    if mode != "off":
+        from .hedge import hedged_stream
+        return hedged_stream(message, timeout=timeout, use_cache=use_cache, race=mode == "race")
+    return get_client().stream(message, timeout=timeout, use_cache=use_cache)
+
+class AsyncClient:
+    """
+    asyncio front-end over Client
+
+    requests is blocking, so each call runs on a worker thread of a
+    private executor; `concurrency` bounds in-flight requests and is
+    also used as the connection pool size
+    """
+    def __init__(self, concurrency: int = POOL_SIZE, client: Client | None = None) -> None:
+        self.client = client or Client(
+            pool_size=concurrency, cache=ResponseCache() if CACHE_ENABLED else None
+        )
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ag")
+        self.sem = asyncio.Semaphore(concurrency)
+
+    async def chat(
+            self,
+            message: List[Dict[str, str]],
+            timeout: float | None = None,
+            use_cache: bool = True
+    ) -> str:
+        async with self.sem:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                lambda: self.client.chat(message, timeout=timeout, use_cache=use_cache)
+            )
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.client.close()
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.close()
+
+async def send_message_async(
+        message: List[Dict[str, str]],
+        timeout: float | None = None,
+        use_cache: bool = True
+) -> str:
+    """async counterpart of send_message (non-stream), shares the default client"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: send_message(message, timeout=timeout, use_cache=use_cache)
+    )
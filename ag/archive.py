@@ -0,0 +1,108 @@
+"""
+cold storage: old sessions packed into compressed pack files
+
+~/.ag/archive/pack-<time>.agz is a run of independently zlib-compressed
+sessions, so any one of them is a single seek + read away; the offset
+index ~/.ag/archive/index.db maps name -> (pack, offset, length, size,
+mtime). packs are written once and never rewritten: thawing a session
+drops its index row, and a pack is deleted when no member is left
+
+chat_fs reads archived sessions transparently and thaws them back into
+CHAT_DIR on any write
+"""
+from pathlib import Path
+from contextlib import closing
+import json, os, sqlite3, time, zlib
+
+ARCHIVE_DIR = Path.home() / ".ag" / "archive"
+ARCHIVE_DB  = ARCHIVE_DIR / "index.db"
+LEVEL       = 9
+
+SCHEMA = """
+create table if not exists members (
+    name     text primary key,
+    pack     text    not null,
+    offset   integer not null,
+    length   integer not null,   -- compressed
+    size     integer not null,   -- original
+    mtime    real    not null,   -- of the original file
+    archived real    not null
+);
+create index if not exists members_pack on members(pack);
+"""
+
+def connect() -> sqlite3.Connection:
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(ARCHIVE_DB, timeout=5)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+def member(name: str) -> sqlite3.Row | None:
+    """the index row of an archived session"""
+    if not ARCHIVE_DB.exists():
+        return None  # nothing was ever archived: don't create the db on a lookup
+    with closing(connect()) as conn:
+        return conn.execute("select * from members where name = ?", (name,)).fetchone()
+
+def has(name: str) -> bool:
+    return member(name) is not None
+
+def read(name: str) -> bytes | None:
+    """the archived session's bytes, None if it isn't archived"""
+    row = member(name)
+    if row is None:
+        return None
+    with (ARCHIVE_DIR / row["pack"]).open("rb") as f:
+        f.seek(row["offset"])
+        return zlib.decompress(f.read(row["length"]))
+
+def members() -> list[sqlite3.Row]:
+    if not ARCHIVE_DB.exists():
+        return []
+    with closing(connect()) as conn:
+        return conn.execute("select * from members order by name").fetchall()
+
+def pack(sessions: list[tuple[str, Path]]) -> tuple[str, int, int]:
+    """
+    write <sessions> (name, path) into a new pack and index them
+    return (pack name, bytes in, bytes out); the caller removes the files
+    """
+    if not sessions:
+        raise ValueError("nothing to pack")
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    name = f"pack-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.agz"
+    rows = []
+    size_in = 0
+    with (ARCHIVE_DIR / name).open("wb") as f:
+        for session, path in sessions:
+            data = path.read_bytes()
+            blob = zlib.compress(data, LEVEL)
+            rows.append((session, name, f.tell(), len(blob), len(data), path.stat().st_mtime, time.time()))
+            f.write(blob)
+            size_in += len(data)
+        f.flush()
+        os.fsync(f.fileno())
+        size_out = f.tell()
+    with closing(connect()) as conn, conn:
+        # one json parameter: a placeholder per session would hit sqlite's variable limit
+        old = {r["pack"] for r in conn.execute(
+            "select pack from members where name in (select value from json_each(?))",
+            (json.dumps([r[0] for r in rows]),))}
+        conn.executemany("insert or replace into members values (?, ?, ?, ?, ?, ?, ?)", rows)
+        _drop_empty(conn, old)
+    return name, size_in, size_out
+
+def remove(name: str) -> None:
+    """forget an archived session (after thawing or deleting it)"""
+    row = member(name)
+    if row is None:
+        return
+    with closing(connect()) as conn, conn:
+        conn.execute("delete from members where name = ?", (name,))
+        _drop_empty(conn, {row["pack"]})
+
+def _drop_empty(conn: sqlite3.Connection, packs: set[str]) -> None:
+    for p in packs:
+        if conn.execute("select 1 from members where pack = ? limit 1", (p,)).fetchone() is None:
+            (ARCHIVE_DIR / p).unlink(missing_ok=True)
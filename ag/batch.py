@@ -0,0 +1,101 @@
+import asyncio, json
+from typing import IO, Any, Callable, Dict, Iterable, List
+from .api_client import AsyncClient, APIError
+from .chat_fs import chat_exists, new_chat, append_user_and_reply
+
+def build_messages(req: Dict[str, Any], system_for: Callable[[str | None], str | None]) -> List[Dict[str, str]]:
+    """
+    one batch request -> chat messages
+
+    {"messages": [...]} is sent as is, {"prompt": "..."} becomes a single
+    user message; "insn" (name or literal) is prepended as system prompt
+    """
+    if "messages" in req:
+        messages = list(req["messages"])
+    elif "prompt" in req:
+        messages = [{"role": "user", "content": req["prompt"]}]
+    else:
+        raise ValueError("request needs 'messages' or 'prompt'")
+    if not any(m.get("role") == "system" for m in messages):
+        system_content = system_for(req.get("insn"))
+        if system_content:
+            messages.insert(0, {"role": "system", "content": system_content})
+    return messages
+
+def save_result(session: str, messages: List[Dict[str, str]], reply: str, model: str | None = None) -> None:
+    """write the last user message and the reply to <session>, create it if needed"""
+    if not chat_exists(session):
+        new_chat(session)
+    question = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    append_user_and_reply(session, question, reply, model=model)
+
+async def run_batch(
+        lines: Iterable[str],
+        out: IO[str],
+        system_for: Callable[[str | None], str | None],
+        jobs: int = 8,
+        ordered: bool = False,
+        timeout: float | None = None,
+        use_cache: bool = True,
+) -> tuple[int, int, list[str]]:
+    """
+    run JSONL requests with at most `jobs` in flight, write JSONL results to `out`
+
+    results go out in completion order, or input order with `ordered`
+    (finished results are held back until every earlier one is written)
+    return (ok, failed, sessions written)
+    """
+    ok = failed = 0
+    sessions: list[str] = []
+    pending: dict[int, Dict[str, Any]] = {}
+    next_out = 0
+    slots = asyncio.Semaphore(jobs)
+
+    def emit(index: int, result: Dict[str, Any]) -> None:
+        nonlocal next_out
+        if not ordered:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            return
+        pending[index] = result
+        while next_out in pending:
+            out.write(json.dumps(pending.pop(next_out), ensure_ascii=False) + "\n")
+            next_out += 1
+        out.flush()
+
+    async def one(client: AsyncClient, index: int, line: str) -> None:
+        nonlocal ok, failed
+        result: Dict[str, Any] = {"index": index}
+        try:
+            req = json.loads(line)
+            if "id" in req:
+                result["id"] = req["id"]
+            messages = build_messages(req, system_for)
+            reply = await client.chat(messages, timeout=timeout, use_cache=use_cache)
+            result["reply"] = reply
+            session = req.get("session")
+            if session:
+                save_result(session, messages, reply, client.client.model)
+                result["session"] = session
+                sessions.append(session)
+            ok += 1
+        except (APIError, ValueError, KeyError, TypeError, OSError) as e:  # OSError: saving to the session
+            result["error"] = str(e)
+            failed += 1
+        finally:
+            slots.release()
+        emit(index, result)
+
+    async with AsyncClient(concurrency=jobs) as client:
+        tasks = []
+        index = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            # read ahead only as far as there are free slots
+            await slots.acquire()
+            tasks.append(asyncio.create_task(one(client, index, line)))
+            index += 1
+        await asyncio.gather(*tasks)
+
+    return ok, failed, sessions
@@ -0,0 +1,110 @@
+import hashlib, json, sqlite3, time
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, List
+from .config import CACHE_MAX_BYTES, CACHE_TTL
+
+CACHE_DIR = Path.home() / ".ag" / "cache"
+CACHE_DB  = CACHE_DIR / "responses.db"
+
+SCHEMA = """
+create table if not exists entries (
+    key      text primary key,
+    chunks   text    not null,
+    size     integer not null,
+    created  real    not null,
+    accessed real    not null
+);
+create index if not exists entries_accessed on entries(accessed);
+"""
+
+def payload_key(base_url: str, payload: Dict[str, Any]) -> str:
+    """sha256 of the canonical request body (stream flags excluded)"""
+    body = {k: v for k, v in payload.items() if k not in ("stream", "stream_options")}
+    canon = json.dumps([base_url, body], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    content-addressed reply cache in a single sqlite file
+
+    replies are stored as the list of streamed deltas (one item for
+    non-stream replies) so a cached stream can be replayed chunk by chunk;
+    least recently used entries are evicted once the total size exceeds
+    max_bytes, entries older than ttl are ignored and purged
+    """
+    def __init__(self, path: Path = CACHE_DB, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._ready = False
+
+    def connect(self) -> sqlite3.Connection:
+        # one connection per call: cheap, and safe across batch worker threads
+        if not self._ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._ready:
+            conn.executescript(SCHEMA)
+            self._ready = True
+        return conn
+
+    def get(self, key: str) -> List[str] | None:
+        now = time.time()
+        with closing(self.connect()) as conn, conn:
+            row = conn.execute("select chunks, created from entries where key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                conn.execute("delete from entries where key = ?", (key,))
+                return None
+            conn.execute("update entries set accessed = ? where key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, chunks: List[str]) -> None:
+        data = json.dumps(chunks, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with closing(self.connect()) as conn, conn:
+            conn.execute(
+                "insert or replace into entries (key, chunks, size, created, accessed) values (?, ?, ?, ?, ?)",
+                (key, data, size, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl:
+            conn.execute("delete from entries where created < ?", (now - self.ttl,))
+        total = conn.execute("select coalesce(sum(size), 0) from entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed: list[tuple[str]] = []
+        for key, size in conn.execute("select key, size from entries order by accessed"):
+            doomed.append((key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        conn.executemany("delete from entries where key = ?", doomed)
+
+    def stats(self) -> Dict[str, Any]:
+        with closing(self.connect()) as conn:
+            count, size, oldest = conn.execute(
+                "select count(*), coalesce(sum(size), 0), min(created) from entries"
+            ).fetchone()
+        return {
+            "path": str(self.path),
+            "entries": count,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "oldest": oldest,
+        }
+
+    def clear(self) -> int:
+        with closing(self.connect()) as conn, conn:
+            count = conn.execute("delete from entries").rowcount
+        with closing(self.connect()) as conn:
+            conn.execute("vacuum")
+        return count
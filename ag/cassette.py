@@ -0,0 +1,262 @@
+"""
+record / replay transport: api_client's HTTP traffic without the network
+
+$AG_CASSETTE (or `ag --cassette FILE ...`) names a cassette, a JSON lines
+file with one exchange per line:
+  {"method", "path", "request": body, "status", "reason", "headers",
+   "ttfb": s, "reads": [[s, text]...]}
+reads are the response body as the client read it, decoded (no
+content-encoding left), each with the seconds since the request went
+out, so a stream keeps its chunking and pacing; bytes that aren't UTF-8
+are kept through surrogateescape. request headers, the API key with
+them, are not stored
+
+$AG_CASSETTE_MODE:
+  record  Recorder: the live adapter plus a tap on every response; the
+          exchange is appended (under flock, so several processes can
+          record into one file) once its body was read to the end or
+          closed, a stream cut short as far as it was read. delete the
+          file to start over
+  replay  Player: answers from the file, never the network. requests
+          match on method, path and body (JSON keys in any order, gzip
+          undone); repeats of one request get its recordings in order,
+          then the last one again; a request that was never recorded
+          fails at once, without retries
+  once    replay when the file exists, else record (the default)
+
+a replayed response comes after its recorded TTFB and each read at its
+recorded time, divided by $AG_REPLAY_SPEED: 1 as recorded, 10 ten times
+faster, 0 at once
+"""
+from pathlib import Path
+from collections import deque
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+import fcntl, gzip, json, threading, time
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from .config import CASSETTE, CASSETTE_MODE, REPLAY_SPEED
+
+MODES = ("once", "record", "replay")
+# response headers that describe the wire, not the (decoded) body
+WIRE_HEADERS = {"connection", "content-encoding", "content-length", "keep-alive", "transfer-encoding"}
+
+class CassetteMiss(requests.RequestException):
+    """a request the cassette has no recording of (not retried)"""
+
+def _body(body: bytes | str | None) -> Any:
+    """a request body as stored: parsed JSON when it is JSON, else text"""
+    if body is None:
+        return None
+    if isinstance(body, bytes):
+        if body[:2] == b"\x1f\x8b":
+            body = gzip.decompress(body)
+        body = body.decode("utf-8", "surrogateescape")
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body
+
+def _key(method: str, path: str, body: Any) -> str:
+    return json.dumps([method.upper(), path, body], sort_keys=True, separators=(",", ":"))
+
+class Cassette:
+    """one cassette file, shared by every client of the process"""
+    def __init__(self, path: Path, replay: bool) -> None:
+        self.path = path
+        self.replay = replay  # decided once: under "once", the first recording must not flip it
+        self._lock = threading.Lock()
+        self._tracks: Dict[str, List[dict]] | None = None  # replay: recordings by request
+        self._played: Dict[str, int] = {}
+
+    def append(self, entry: dict) -> None:
+        line = (json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8", "surrogateescape")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, self.path.open("ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def take(self, key: str) -> dict | None:
+        """the next recording of request <key>, None if there is none"""
+        with self._lock:
+            if self._tracks is None:
+                self._tracks = {}
+                with self.path.open("rb") as f:
+                    for line in f:
+                        if line.strip():
+                            e = json.loads(line.decode("utf-8", "surrogateescape"))
+                            self._tracks.setdefault(_key(e["method"], e["path"], e.get("request")), []).append(e)
+            track = self._tracks.get(key)
+            if not track:
+                return None
+            n = self._played.get(key, 0)
+            self._played[key] = n + 1
+            return track[min(n, len(track) - 1)]
+
+class _Tape:
+    """a urllib3 response whose body reads are recorded"""
+    def __init__(self, raw, cassette: Cassette, entry: dict, t0: float) -> None:
+        self._raw = raw
+        self._cassette = cassette
+        self._entry = entry
+        self._t0 = t0
+        self._done = False
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw, name)
+
+    def _take(self, data: bytes) -> bytes:
+        if data:
+            self._entry["reads"].append([round(time.perf_counter() - self._t0, 6),
+                                         data.decode("utf-8", "surrogateescape")])
+        return data
+
+    def _finish(self) -> None:
+        if not self._done:
+            self._done = True
+            self._cassette.append(self._entry)
+
+    def stream(self, amt: int = 2 ** 16, decode_content: bool | None = None):
+        for data in self._raw.stream(amt, decode_content=decode_content):
+            yield self._take(data)
+        self._finish()
+
+    def read(self, amt: int | None = None, decode_content: bool | None = None, **kwargs) -> bytes:
+        data = self._take(self._raw.read(amt, decode_content=decode_content, **kwargs))
+        if amt is None or not data:
+            self._finish()
+        return data
+
+    def read1(self, amt: int | None = None, decode_content: bool | None = None) -> bytes:
+        data = self._take(self._raw.read1(amt, decode_content=decode_content))
+        if not data:
+            self._finish()
+        return data
+
+    def close(self) -> None:
+        self._finish()
+        self._raw.close()
+
+class Recorder(BaseAdapter):
+    """<live>'s requests, every exchange appended to <cassette>"""
+    def __init__(self, live: BaseAdapter, cassette: Cassette) -> None:
+        super().__init__()
+        self.live = live
+        self.cassette = cassette
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        t0 = time.perf_counter()
+        resp = self.live.send(request, **kwargs)
+        resp.raw = _Tape(resp.raw, self.cassette, {
+            "method": request.method,
+            "path": urlsplit(request.url).path,
+            "request": _body(request.body),
+            "status": resp.status_code,
+            "reason": resp.reason,
+            "headers": {k: v for k, v in resp.headers.items() if k.lower() not in WIRE_HEADERS},
+            "ttfb": round(time.perf_counter() - t0, 6),
+            "reads": [],
+        }, t0)
+        return resp
+
+    def close(self) -> None:
+        self.live.close()
+
+class _Playback:
+    """the body of a recorded response, read back on its recorded schedule"""
+    chunked = False  # read1() hands out one recorded read at a time
+
+    def __init__(self, reads: List[list], speed: float, t0: float) -> None:
+        self._reads = deque((at, text.encode("utf-8", "surrogateescape")) for at, text in reads)
+        self._speed = speed
+        self._t0 = t0
+        self.closed = False
+
+    def _next(self, amt: int | None) -> bytes:
+        if self.closed or not self._reads:
+            return b""
+        at, data = self._reads[0]
+        if self._speed:
+            wait = self._t0 + at / self._speed - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        if amt is not None and len(data) > amt:
+            self._reads[0] = (at, data[amt:])
+            return data[:amt]
+        self._reads.popleft()
+        return data
+
+    def read1(self, amt: int | None = None, decode_content: bool = True) -> bytes:
+        return self._next(amt)
+
+    def read(self, amt: int | None = None, decode_content: bool = True, **kwargs) -> bytes:
+        out = bytearray()
+        while amt is None or len(out) < amt:
+            data = self._next(None if amt is None else amt - len(out))
+            if not data:
+                break
+            out += data
+        return bytes(out)
+
+    def stream(self, amt: int = 2 ** 16, decode_content: bool = True):
+        yield from iter(lambda: self._next(amt), b"")
+
+    def close(self) -> None:
+        self.closed = True
+
+    def release_conn(self) -> None:
+        pass
+
+class Player(BaseAdapter):
+    """answers every request from <cassette>, <speed> times as fast as recorded (0: at once)"""
+    def __init__(self, cassette: Cassette, speed: float = REPLAY_SPEED) -> None:
+        super().__init__()
+        self.cassette = cassette
+        self.speed = speed
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        t0 = time.perf_counter()
+        path = urlsplit(request.url).path
+        entry = self.cassette.take(_key(request.method, path, _body(request.body)))
+        if entry is None:
+            raise CassetteMiss(f"no recording of {request.method} {path} with this body in {self.cassette.path}",
+                               request=request)
+        if self.speed and entry["ttfb"] > 0:
+            time.sleep(entry["ttfb"] / self.speed)
+        resp = requests.Response()
+        resp.status_code = entry["status"]
+        resp.reason = entry.get("reason")
+        resp.headers = CaseInsensitiveDict(entry.get("headers") or {})
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp.raw = _Playback(entry["reads"], self.speed, t0)
+        resp.url = request.url
+        resp.request = request
+        resp.connection = self
+        return resp
+
+    def close(self) -> None:
+        pass
+
+_cassettes: Dict[Path, Cassette] = {}
+
+def adapter(live: BaseAdapter, path: str = CASSETTE, mode: str = CASSETTE_MODE,
+            speed: float = REPLAY_SPEED) -> BaseAdapter:
+    """the transport for a client: <live>, or a Recorder / Player per $AG_CASSETTE"""
+    if not path:
+        return live
+    if mode not in MODES:
+        raise ValueError(f"AG_CASSETTE_MODE must be one of {', '.join(MODES)}, not '{mode}'")
+    file = Path(path).expanduser().resolve()
+    if file not in _cassettes:
+        _cassettes[file] = Cassette(file, replay=mode == "replay" or (mode == "once" and file.exists()))
+    cassette = _cassettes[file]
+    if cassette.replay:
+        live.close()
+        return Player(cassette, speed)
+    return Recorder(live, cassette)
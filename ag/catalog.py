@@ -0,0 +1,219 @@
+"""
+session catalog: per-session metadata in ~/.ag/catalog.db
+
+kept up to date by the chat_fs writers, so `ag ls --long --sort ...` and
+`ag sw` never have to stat or parse the session files; changes made
+behind ag's back are picked up when the chat dir's mtime moves, and
+`ag ls --rebuild` recreates it from disk. archived sessions (ag.archive)
+keep their row, marked archived, until they are thawed or deleted
+"""
+from pathlib import Path
+from contextlib import closing
+import math, sqlite3, time
+from . import layout, turnstore, archive
+
+CATALOG_DB = Path.home() / ".ag" / "catalog.db"
+HALF_LIFE  = 7 * 24 * 3600  # frecency: an access counts half as much after a week
+
+SCHEMA = """
+create table if not exists sessions (
+    name        text primary key,
+    size        integer not null default 0,
+    turns       integer not null default 0,
+    created     real    not null,
+    modified    real    not null,
+    model       text,
+    accesses    integer not null default 0,
+    last_access real,
+    frecency    real    not null default 0,
+    archived    integer not null default 0
+);
+create index if not exists sessions_modified on sessions(modified);
+create index if not exists sessions_size     on sessions(size);
+create index if not exists sessions_frecency on sessions(frecency);
+create table if not exists meta (key text primary key, value);
+"""
+
+SORTS = {
+    "name":     "name",
+    "recent":   "modified desc",
+    "size":     "size desc",
+    "frecency": "frecency desc, modified desc",
+}
+
+_ready = False
+
+def connect() -> sqlite3.Connection:
+    global _ready
+    if not _ready:
+        CATALOG_DB.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(CATALOG_DB, timeout=5)
+    conn.row_factory = sqlite3.Row
+    if not _ready:
+        conn.executescript(SCHEMA)
+        if "archived" not in {r["name"] for r in conn.execute("pragma table_info(sessions)")}:
+            # older catalogs: add the column, and rescan once so archived sessions get their rows back
+            conn.execute("alter table sessions add column archived integer not null default 0")
+            conn.execute("delete from meta where key = 'dir_mtime'")
+            conn.commit()
+        _ready = True
+    return conn
+
+def _bump(row: sqlite3.Row | None, now: float) -> tuple[int, float]:
+    """
+    one more access: return (accesses, frecency)
+
+    frecency is log2 of the decayed access score shifted by time, which
+    orders sessions exactly like the decayed score at any later moment
+    """
+    if row is None or not row["accesses"]:
+        score = 1.0
+    else:
+        last = row["last_access"] or now
+        prev = 2 ** (row["frecency"] - last / HALF_LIFE)
+        score = prev * 2 ** (-(now - last) / HALF_LIFE) + 1
+    return (row["accesses"] if row else 0) + 1, math.log2(score) + now / HALF_LIFE
+
+def _stat(path: Path) -> tuple[int, float]:
+    if path.suffix == turnstore.SUFFIX:
+        return turnstore.view_stat(path)  # a stored session: the size of its .md view
+    st = path.stat()
+    return st.st_size, st.st_mtime
+
+def record_new(name: str, path: Path) -> None:
+    size, mtime = _stat(path)
+    now = time.time()
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "insert or replace into sessions (name, size, turns, created, modified) values (?, ?, 0, ?, ?)",
+            (name, size, now, mtime),
+        )
+
+def record_write(name: str, path: Path, turns: int, model: str | None = None) -> None:
+    """a session was appended to, it now has <turns> turns"""
+    size, mtime = _stat(path)
+    now = time.time()
+    with closing(connect()) as conn, conn:
+        row = conn.execute("select * from sessions where name = ?", (name,)).fetchone()
+        accesses, frecency = _bump(row, now)
+        conn.execute(
+            """insert into sessions (name, size, turns, created, modified, model, accesses, last_access, frecency)
+               values (?, ?, ?, ?, ?, ?, ?, ?, ?)
+               on conflict(name) do update set size = excluded.size, turns = excluded.turns,
+                   modified = excluded.modified, model = coalesce(excluded.model, model),
+                   accesses = excluded.accesses, last_access = excluded.last_access,
+                   frecency = excluded.frecency""",
+            (name, size, turns, mtime, mtime, model, accesses, now, frecency),
+        )
+
+def record_access(name: str) -> None:
+    now = time.time()
+    with closing(connect()) as conn, conn:
+        row = conn.execute("select * from sessions where name = ?", (name,)).fetchone()
+        if row is None:
+            return
+        accesses, frecency = _bump(row, now)
+        conn.execute(
+            "update sessions set accesses = ?, last_access = ?, frecency = ? where name = ?",
+            (accesses, now, frecency, name),
+        )
+
+def record_archived(name: str) -> None:
+    with closing(connect()) as conn, conn:
+        conn.execute("update sessions set archived = 1 where name = ?", (name,))
+
+def record_thawed(name: str, path: Path) -> None:
+    """an archived session is back as <path>: its row is kept, accesses and model too"""
+    size, mtime = _stat(path)
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            """insert into sessions (name, size, turns, created, modified) values (?, ?, ?, ?, ?)
+               on conflict(name) do update set size = excluded.size, turns = excluded.turns,
+                                                modified = excluded.modified, archived = 0""",
+            (name, size, count_turns(path), time.time(), mtime),
+        )
+
+def record_rename(old: str, new: str) -> None:
+    with closing(connect()) as conn, conn:
+        conn.execute("delete from sessions where name = ?", (new,))
+        conn.execute("update sessions set name = ? where name = ?", (new, old))
+
+def record_delete(name: str) -> None:
+    with closing(connect()) as conn, conn:
+        conn.execute("delete from sessions where name = ?", (name,))
+
+def refresh(name: str, path: Path) -> None:
+    """re-read one session after it was edited outside ag"""
+    size, mtime = _stat(path)
+    with closing(connect()) as conn, conn:
+        conn.execute(
+            "update sessions set size = ?, turns = ?, modified = ? where name = ?",
+            (size, count_turns(path), mtime, name),
+        )
+
+def parse_turns(data: bytes) -> int:
+    from .turns import parse
+    res = parse(data)
+    return len(res["turns"]) + len(res["open"])
+
+def count_turns(path: Path) -> int:
+    if path.suffix == turnstore.SUFFIX:
+        return turnstore.count_turns(path)
+    return parse_turns(path.read_bytes())
+
+def sync(chat_dir: Path, rebuild: bool = False) -> None:
+    """
+    reconcile the catalog with <chat_dir>
+
+    cheap when nothing happened: the dir's (and its shards') mtime, compared with
+    the mtime recorded at the last sync; rebuild re-reads every file
+    """
+    dir_mtime = layout.dir_mtime(chat_dir)
+    with closing(connect()) as conn, conn:
+        seen = conn.execute("select value from meta where key = 'dir_mtime'").fetchone()
+        if not rebuild and seen is not None and seen[0] == dir_mtime:
+            return
+        on_disk = {**turnstore.scan(), **layout.scan(chat_dir)}
+        known = {r[0] for r in conn.execute("select name from sessions where not archived")}
+        packed = {r["name"]: r for r in archive.members()}
+        gone = known - on_disk.keys()
+        conn.executemany("delete from sessions where name = ?", [(n,) for n in gone])
+        # archived sessions: rows lost (archived before they were kept, or a deleted db) come back
+        listed = {r[0] for r in conn.execute("select name from sessions where archived")}
+        for name in packed.keys() - listed - on_disk.keys():
+            row = packed[name]
+            conn.execute(
+                """insert or replace into sessions (name, size, turns, created, modified, archived)
+                   values (?, ?, ?, ?, ?, 1)""",
+                (name, row["size"], parse_turns(archive.read(name)), row["archived"], row["mtime"]),
+            )
+        conn.executemany("delete from sessions where name = ?", [(n,) for n in listed - packed.keys()])
+        if rebuild:
+            known = set()
+        for name in on_disk.keys() - known:
+            path = on_disk[name]
+            size, mtime = _stat(path)
+            conn.execute(
+                """insert into sessions (name, size, turns, created, modified) values (?, ?, ?, ?, ?)
+                   on conflict(name) do update set size = excluded.size, turns = excluded.turns,
+                                                    modified = excluded.modified""",
+                (name, size, count_turns(path), path.stat().st_ctime, mtime),
+            )
+        conn.execute("insert or replace into meta (key, value) values ('dir_mtime', ?)", (dir_mtime,))
+
+def mark_synced(chat_dir: Path, *touched: Path) -> None:
+    """
+    our own write changed the dir mtime, the catalog already knows why
+    touched: the files written, so only their shards need a stat
+    """
+    with closing(connect()) as conn, conn:
+        seen = conn.execute("select value from meta where key = 'dir_mtime'").fetchone()
+        if touched and seen is not None and layout.current(chat_dir) != layout.FLAT:
+            mtime = max(seen[0], chat_dir.stat().st_mtime, *(p.parent.stat().st_mtime for p in touched))
+        else:
+            mtime = layout.dir_mtime(chat_dir)
+        conn.execute("insert or replace into meta (key, value) values ('dir_mtime', ?)", (mtime,))
+
+def sessions(sort: str = "name") -> list[sqlite3.Row]:
+    with closing(connect()) as conn:
+        return conn.execute(f"select * from sessions order by {SORTS[sort]}").fetchall()
@@ -1,10 +1,16 @@
 from pathlib import Path
-import subprocess, time
+import subprocess, time, os, sys, json, fcntl, re
+from contextlib import contextmanager
+from . import turns, catalog, archive, layout, turnstore
+from .sinks import Sink
 
 CHAT_DIR     = Path.home() / ".ag" / "chats"
 CURRENT_FILE = Path.home() / ".ag" / "current"
 INSN_DIR     = Path.home() / ".ag" / "insn"
 INSN_CURRENT = Path.home() / ".ag" / "insn" / "current"
+GIT_JOURNAL  = Path.home() / ".ag" / "git-journal"
+GIT_LOCK     = Path.home() / ".ag" / "git.lock"
+STREAM_FENCE   = "`````"  # live replies can't be measured up front, use a fence they won't contain
 DEFAULT_INSTRUCTIONS = ("")
 
 def ensure_insn_dir() -> None:
@@ -14,11 +20,20 @@ def list_insns() -> list[str]:
     ensure_insn_dir()
     return sorted(p.stem for p in INSN_DIR.iterdir() if p.suffix == ".md")
 
+_insn_cache: dict[Path, tuple[int, int, str]] = {}  # path -> (mtime_ns, size, text), pays off in `ag serve`
+
 def read_insn(name: str) -> str:
     path = INSN_DIR / f"{name}.md"
-    if not path.exists():
-        raise FileNotFoundError(f"Prompt '{name}' not found")
-    return path.read_text(encoding="utf-8")
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Prompt '{name}' not found") from None
+    hit = _insn_cache.get(path)
+    if hit and hit[:2] == (st.st_mtime_ns, st.st_size):
+        return hit[2]
+    text = path.read_text(encoding="utf-8")
+    _insn_cache[path] = (st.st_mtime_ns, st.st_size, text)
+    return text
 
 def new_insn(name: str, src_file: str | None = None) -> None:
     ensure_insn_dir()
@@ -49,8 +64,8 @@ def get_default_insn() -> str | None:
     except FileNotFoundError:
         return None
 
-def ensure_git_repo() -> None:
-    """init git repo"""
+def ensure_git_repo() -> bool:
+    """init git repo, return True if it was just created"""
     git_dir = CHAT_DIR / ".git"
     if not git_dir.exists():
         subprocess.run(
@@ -59,33 +74,118 @@ def ensure_git_repo() -> None:
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
         )
+        return True
+    return False
+
+@contextmanager
+def _flock(path: Path):
+    """exclusive advisory lock on <path>, blocks until acquired"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _journal(entry: dict) -> None:
+    """append one pending change to the git journal"""
+    with _flock(GIT_JOURNAL) as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+
+def _git_mode() -> str:
+    from . import config  # on the first write only: reading a session doesn't load .env
+    return config.GIT_MODE
+
+def record_change(*paths: Path) -> None:
+    """remember touched chat files, they are staged by the next commit"""
+    if _git_mode() == "off":
+        return
+    for path in paths:
+        _journal({"path": str(path.relative_to(CHAT_DIR))})
+
+def _drain_journal() -> list[dict]:
+    with _flock(GIT_JOURNAL) as f:
+        with GIT_JOURNAL.open("r", encoding="utf-8") as r:
+            lines = r.read().splitlines()
+        f.truncate(0)
+    return [json.loads(line) for line in lines if line.strip()]
+
+def _git(*args: str, check: bool = True) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        ["git", "-C", str(CHAT_DIR), *args],
+        check=check,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+def flush_git() -> None:
+    """
+    commit every journaled change as one commit
+
+    writers are serialized by GIT_LOCK; a process that finds the journal
+    already drained returns at once, its changes went into the commit of
+    whoever held the lock
+    """
+    created = ensure_git_repo()
+    with _flock(GIT_LOCK):
+        entries = _drain_journal()
+        if not entries:
+            return
+        paths = list(dict.fromkeys(e["path"] for e in entries if "path" in e))
+        if created:
+            # first commit picks up chats written before the repo existed
+            paths = ["."]
+        sessions = list(dict.fromkeys(e["session"] for e in entries if "session" in e))
+        present = [p for p in paths if (CHAT_DIR / p).exists()]
+        missing = [p for p in paths if not (CHAT_DIR / p).exists()]
+        try:
+            if present:
+                _git("add", "--", *present)
+            if missing:
+                _git("rm", "--cached", "--ignore-unmatch", "-q", "--", *missing)
+            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            msg = f"{', '.join(sessions) or 'ag'}: Q&A @ {ts}"
+            done = _git("commit", "-m", msg, check=False)
+            if done.returncode != 0 and _git("diff", "--cached", "--quiet", check=False).returncode != 0:
+                raise subprocess.CalledProcessError(done.returncode, done.args)
+        except subprocess.CalledProcessError:
+            # keep the changes for the next attempt
+            for e in entries:
+                _journal(e)
+            raise
 
 def git_commit(session: str) -> None:
     """
-    git add ... && git commit
+    commit the changes recorded by chat_fs writers
 
     <session>: Q&A @ YYYY-MM-DD HH:MM:SS
+
+    $AG_GIT selects when: sync (now), background (detached process),
+    defer (left in the journal for the next commit or `ag commit`), off
     """
-    ensure_git_repo()
-    subprocess.run(
-        ["git", "-C", str(CHAT_DIR), "add", "."],
-        check=True,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-    ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    msg = f"{session}: Q&A @ {ts}"
-    subprocess.run(
-        ["git", "-C", str(CHAT_DIR), "commit", "-m", msg],
-        check=True,
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
+    mode = _git_mode()
+    if mode == "off":
+        return
+    _journal({"session": session})
+    if mode == "defer":
+        return
+    if mode == "background":
+        subprocess.Popen(
+            [sys.executable, "-c", "from ag.chat_fs import flush_git; flush_git()"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        return
+    flush_git()
 
 def list_chats() -> list[str]:
     """list sessions (without .md), alphabetic order"""
     ensure_chat_dir()
-    return sorted(f.stem for f in CHAT_DIR.iterdir() if f.suffix == ".md")
+    return sorted(layout.scan(CHAT_DIR))
 
 def get_default_chat() -> str | None:
     """read ~/.ag/current"""
@@ -94,30 +194,227 @@ def get_default_chat() -> str | None:
     except FileNotFoundError:
         return None
 
+def list_sessions(sort: str = "name", rebuild: bool = False) -> list:
+    """
+    sessions with metadata from the catalog
+    sort: name | recent | size | frecency
+    """
+    ensure_chat_dir()
+    catalog.sync(CHAT_DIR, rebuild=rebuild)
+    return catalog.sessions(sort)
+
 def set_default_chat(name: str) -> None:
     """set default chat"""
-    ensure_chat_dir()
-    if name not in list_chats():
+    if not chat_exists(name):
         raise FileNotFoundError(f"Chat '{name}' doesn't exist")
     CURRENT_FILE.write_text(name, encoding="utf-8")
+    catalog.record_access(name)
 
 def show_chat(name: str) -> str:
     """
     print chat to stdout
     """
-    path = chat_path(name)
-    if not path.exists():
-        raise FileNotFoundError(f"Chat '{name}' doesn't exist")
-    return path.read_text(encoding="utf-8")
+    data = _read_bytes(name)
+    catalog.record_access(name)
+    return data.decode("utf-8")
 
 def ensure_chat_dir() -> None:
-    """make sure chat dir exists"""
-    CHAT_DIR.mkdir(parents=True, exist_ok=True)
+    """make sure chat dir exists, a new one is sharded from the start"""
+    if CHAT_DIR.is_dir():
+        return
+    try:
+        CHAT_DIR.mkdir(parents=True)
+    except FileExistsError:
+        return
+    layout.set_state(CHAT_DIR, layout.SHARDED)
 
 def chat_path(name: str) -> Path:
-    """return the path of markdown file"""
+    """return the path of markdown file (see layout)"""
+    ensure_chat_dir()
+    return layout.path(CHAT_DIR, name)
+
+def chat_exists(name: str) -> bool:
+    """a plain session file, an archived one or one in the turn store"""
+    return chat_path(name).exists() or archive.has(name) or turnstore.has(name)
+
+def _read_bytes(name: str) -> bytes:
+    """session bytes, from the file or else the archive or the turn store"""
+    path = chat_path(name)
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+    # `ag migrate` may have moved it from flat to its shard since the lookup:
+    # chat_path reads .layout again, so a changed answer is worth a second try
+    moved = chat_path(name)
+    if moved != path:
+        try:
+            return moved.read_bytes()
+        except FileNotFoundError:
+            pass
+    data = archive.read(name)
+    if data is None:
+        data = turnstore.render(name)
+    if data is None:
+        raise FileNotFoundError(f"Chat '{name}' doesn't exist")
+    return data
+
+def _writable(name: str) -> Path:
+    """the session's file, thawed out of the archive or turn store first if need be"""
+    path = chat_path(name)
+    if not path.exists() and not thaw_chat(name):
+        raise FileNotFoundError(f"Chat '{name}' doesn't exist")
+    return path
+
+def _open_append(name: str, mode: str = "a", **kw):
+    """
+    (path, file) of the session opened for appending
+
+    never creates the file: if `ag migrate` moved it after it was looked
+    up, it is looked up again instead of leaving a stray flat file behind
+    """
+    for _ in range(3):
+        path = _writable(name)
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            continue
+        return path, open(fd, mode, **kw)
+    raise FileNotFoundError(f"Chat '{name}' doesn't exist")
+
+def thaw_chat(name: str) -> bool:
+    """
+    bring an archived or stored session back into CHAT_DIR as a file
+    False if it is neither
+    """
+    row = archive.member(name)
+    if row is not None:
+        data, mtime = archive.read(name), row["mtime"]
+    elif turnstore.has(name):
+        data, mtime = turnstore.render(name), turnstore.manifest_path(name).stat().st_mtime
+    else:
+        return False
+    path = chat_path(name)
+    catalog.sync(CHAT_DIR)
+    path.parent.mkdir(exist_ok=True)
+    tmp = path.with_suffix(".md.thaw")
+    tmp.write_bytes(data)
+    os.utime(tmp, (mtime, mtime))
+    os.replace(tmp, path)
+    catalog.record_thawed(name, path)
+    catalog.mark_synced(CHAT_DIR, path)
+    if row is not None:
+        archive.remove(name)
+        record_change(path)
+    else:
+        record_change(path, *turnstore.remove(name))
+    return True
+
+def store_chat(name: str) -> None:
+    """
+    move a session file (or an archived session) into the turn store
+    a session with a reply still being written, or never finished, stays put
+    """
+    if unfinished_reply(name):
+        raise ValueError(f"Chat '{name}' has an unfinished reply, resume or repair it first")
+    path = chat_path(name)
+    if path.exists():
+        with path.open("rb") as f:
+            if not _try_lock(f):
+                raise BlockingIOError(f"Chat '{name}' is being written by another process")
+            data, mtime = f.read(), os.fstat(f.fileno()).st_mtime
+            catalog.sync(CHAT_DIR)
+            touched = turnstore.put(name, data, mtime)
+            path.unlink()
+        turns.drop_index(name)
+        catalog.mark_synced(CHAT_DIR, path)
+        touched.append(path)
+    else:
+        row = archive.member(name)
+        if row is None:
+            raise FileNotFoundError(f"Chat '{name}' doesn't exist")
+        touched = turnstore.put(name, archive.read(name), row["mtime"])
+        archive.remove(name)
+        catalog.record_thawed(name, turnstore.manifest_path(name))
+    catalog.refresh(name, turnstore.manifest_path(name))
+    record_change(*touched)
+
+def fork_chat(src: str, new: str, at: int | None = None) -> int:
+    """
+    new session <new> with the first <at> turns of <src> (default: all)
+    both end up in the turn store, sharing those turns; return how many
+    """
+    if chat_exists(new):
+        raise FileExistsError(f"Chat '{new}' already exists")
+    if at is not None:
+        n = sum(m["role"] != "system" for m in read_messages(src))
+        if at > n:
+            raise ValueError(f"Chat '{src}' has {n} turns, can't fork at {at}")
+    if not turnstore.has(src) or chat_path(src).exists():
+        store_chat(src)
+    kept, touched = turnstore.fork(src, new, at)
+    catalog.record_new(new, turnstore.manifest_path(new))
+    catalog.refresh(new, turnstore.manifest_path(new))
+    record_change(*touched)
+    return kept
+
+def archive_chats(names: list[str]) -> tuple[int, int]:
+    """move sessions into a compressed pack, return (bytes in, bytes out)"""
+    paths = [(name, chat_path(name)) for name in names]
+    catalog.sync(CHAT_DIR)
+    _, size_in, size_out = archive.pack(paths)
+    for name, path in paths:
+        path.unlink()
+        turns.drop_index(name)
+        catalog.record_archived(name)
+    catalog.mark_synced(CHAT_DIR, *(path for _, path in paths))
+    record_change(*(path for _, path in paths))
+    return size_in, size_out
+
+def migrate_chats(progress=None) -> tuple[int, list[str]]:
+    """
+    move a flat chat dir to the sharded layout, online
+
+    other ag processes keep working meanwhile; a session a reply is being
+    streamed into is moved once its writer lets go of it
+    progress: called with the number of sessions moved so far
+    return (sessions moved, names left behind because of a name clash)
+    """
     ensure_chat_dir()
-    return CHAT_DIR / f"{name}.md"
+    if layout.current(CHAT_DIR) == layout.SHARDED:
+        return 0, []
+    catalog.sync(CHAT_DIR)
+    layout.set_state(CHAT_DIR, layout.MIGRATING)
+    moved: list[tuple[Path, Path]] = []
+    clashes: list[str] = []
+    for wait in (False, True):  # second pass: block on the sessions still being written
+        for src in sorted(CHAT_DIR.glob("*.md")):
+            dst = CHAT_DIR / layout.shard(src.stem) / src.name
+            if dst.exists():
+                if src.stem not in clashes:
+                    clashes.append(src.stem)
+                continue
+            dst.parent.mkdir(exist_ok=True)
+            try:
+                with src.open("rb") as f:
+                    if wait:
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                    elif not _try_lock(f):
+                        continue
+                    os.rename(src, dst)
+            except FileNotFoundError:
+                continue  # deleted or renamed meanwhile
+            moved.append((src, dst))
+            if progress and len(moved) % 1000 == 0:
+                progress(len(moved))
+    if not clashes:
+        layout.set_state(CHAT_DIR, layout.SHARDED)
+    catalog.mark_synced(CHAT_DIR)
+    if moved:
+        from .search import moved as search_moved
+        search_moved([(str(a), str(b)) for a, b in moved])
+        record_change(CHAT_DIR)  # one `git add .` rather than two paths per session
+    return len(moved), clashes
 
 def new_chat(name: str, insn: str | None = None) -> None:
     """
@@ -126,8 +423,9 @@ def new_chat(name: str, insn: str | None = None) -> None:
     insn: instruction
     """
     path = chat_path(name)
-    if path.exists():
+    if chat_exists(name):
         raise FileExistsError(f"Chat '{name}' already exists")
+    catalog.sync(CHAT_DIR)
     inst = insn.strip() if insn else DEFAULT_INSTRUCTIONS
     content = (
         f"# Chat: {name}\n\n"
@@ -135,57 +433,284 @@ def new_chat(name: str, insn: str | None = None) -> None:
         f"{inst}\n\n"
         "## Conversation\n\n"
     )
+    path.parent.mkdir(exist_ok=True)
     path.write_text(content, encoding="utf-8")
+    catalog.record_new(name, path)
+    catalog.mark_synced(CHAT_DIR, path)
+    record_change(path)
 
 def rename_chat(old: str, new: str) -> None:
     """rename chat"""
-    old_path = chat_path(old)
     new_path = chat_path(new)
-    if not old_path.exists():
-        raise FileNotFoundError(f"Chat '{old}' doesn't exist")
-    if new_path.exists():
+    if chat_exists(new):
         raise FileExistsError(f"Chat '{new}' already exists")
+    if not chat_path(old).exists() and turnstore.has(old):
+        touched = turnstore.rename(old, new)
+        catalog.record_rename(old, new)
+        record_change(*touched)
+        return
+    old_path = _writable(old)
+    catalog.sync(CHAT_DIR)
+    new_path.parent.mkdir(exist_ok=True)
     old_path.rename(new_path)
+    turns.move_index(old, new)
+    catalog.record_rename(old, new)
+    catalog.mark_synced(CHAT_DIR, old_path, new_path)
+    record_change(old_path, new_path)
 
 def delete_chat(name: str) -> None:
     """delete chat"""
     path = chat_path(name)
     if not path.exists():
-        raise FileNotFoundError(f"Chat '{name}' doesn't exist")
+        if turnstore.has(name):
+            record_change(*turnstore.remove(name))
+        elif archive.has(name):
+            archive.remove(name)
+        else:
+            raise FileNotFoundError(f"Chat '{name}' doesn't exist")
+        catalog.record_delete(name)
+        return
+    catalog.sync(CHAT_DIR)
     path.unlink()
+    turns.drop_index(name)
+    turns.live_path(name).unlink(missing_ok=True)
+    catalog.record_delete(name)
+    catalog.mark_synced(CHAT_DIR, path)
+    record_change(path)
 
 def read_chat(name: str) -> str:
     """read the entire chat (to send to the model)"""
+    data = _read_bytes(name)
+    catalog.record_access(name)
+    return data.decode("utf-8")
+
+def read_messages(name: str, last: int | None = None) -> list[dict[str, str]]:
+    """
+    read the chat as role messages: instructions -> system, then user / assistant turns
+    last: only the last N turns
+    """
     path = chat_path(name)
-    if not path.exists():
-        raise FileNotFoundError(f"Chat '{name}' doesn't exist")
-    return path.read_text(encoding="utf-8")
+    if path.exists():
+        system, msgs = turns.read_turns(name, path, last)
+    else:
+        system, msgs = turns.read_turns_from(_read_bytes(name), last)
+    catalog.record_access(name)
+    if system:
+        msgs.insert(0, {"role": "system", "content": system})
+    return msgs
 
-def append_reply(name: str, reply: str) -> None:
+def _reply_block(reply: str) -> str:
+    """fence the reply, longer than any backtick run inside it"""
+    longest = max((len(run) for run in re.findall(r"`{3,}", reply)), default=2)
+    fence = "`" * (longest + 1)
+    return f"{fence}reply\n{reply.strip()}\n{fence}\n"
+
+def append_reply(name: str, reply: str, model: str | None = None) -> None:
     """
     append AI's reply to the file
+    model: model that wrote the reply (recorded in the catalog)
     """
-    path: Path = chat_path(name)
-    if not path.exists():
-        raise FileNotFoundError(f"Chat '{name}' doesn't exist")
+    _append(name, "\n### Assistant\n" + _reply_block(reply), model)
 
-    with path.open("a", encoding="utf-8") as file:
-        file.write("\n### Assistant\n")
-        file.write("```reply\n")
-        file.write(reply.strip() + "\n")
-        file.write("```\n")
-
-def append_user_and_reply(name: str, question: str, reply: str) -> None:
+def append_user_and_reply(name: str, question: str, reply: str, model: str | None = None) -> None:
     """
     append user's question and AI's reply to the file
+    model: model that wrote the reply (recorded in the catalog)
+    """
+    append_turns(name, [(question, reply)], model)
+
+def append_turns(name: str, pairs: list[tuple[str, str]], model: str | None = None) -> None:
+    """
+    append (question, reply) pairs with one write and one catalog update
+    model: model that wrote the replies (recorded in the catalog)
     """
+    _append(name, "".join(
+        f"\n### User\n{question.strip()}\n\n\n### Assistant\n{_reply_block(reply)}"
+        for question, reply in pairs
+    ), model)
+
+def _append(name: str, text: str, model: str | None) -> None:
+    """append whole turns: to the file, or as new objects of a stored session"""
+    if not chat_path(name).exists() and turnstore.has(name):
+        touched = turnstore.append(name, text.encode("utf-8"))
+        path = turnstore.manifest_path(name)
+        catalog.record_write(name, path, turnstore.count_turns(path), model)
+        record_change(*touched)
+        return
+    path, file = _open_append(name, encoding="utf-8")
+    with file:
+        file.write(text)
+    catalog.record_write(name, path, turns.count_turns(name, path), model)
+    record_change(path)
+
+def unfinished_reply(name: str) -> list[int] | None:
+    """[fence length, flag offset] if the chat ends inside a streamed reply that never finished"""
     path = chat_path(name)
     if not path.exists():
+        if archive.has(name) or turnstore.has(name):
+            return None  # only finished sessions get archived or stored
         raise FileNotFoundError(f"Chat '{name}' doesn't exist")
-    with path.open("a", encoding="utf-8") as file:
-        file.write("\n### User\n")
-        file.write(question.strip() + "\n\n")
-        file.write("\n### Assistant\n")
-        file.write("```reply\n")
-        file.write(reply.strip() + "\n")
-        file.write("```\n")
+    return turns.load_index(name, path)["partial"]
+
+def _try_lock(f) -> bool:
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+LIVE_MARK = b"%020d %020d\n"  # flag offset, end of the streamed bytes: fixed width, rewritten in place
+
+def _live_end(name: str, flag_at: int) -> int | None:
+    """where the streamed bytes of the reply flagged at <flag_at> end, None if unknown"""
+    try:
+        flag, end = map(int, turns.live_path(name).read_bytes().split())
+    except (FileNotFoundError, ValueError):
+        return None
+    return end if flag == flag_at else None
+
+def _unknown_end(name: str) -> ValueError:
+    return ValueError(f"Can't tell where the interrupted reply in '{name}' ends; "
+                      f"close its fence by hand (ag ed {name})")
+
+def repair_chat(name: str) -> bool:
+    """
+    close a reply left unfinished by a crash, flagging it "aborted"
+    the fence goes where the streamed bytes end, before anything typed after
+    them; ValueError if that place isn't known
+    return False if there was nothing to repair (or it is still being written)
+    """
+    partial = unfinished_reply(name)
+    if not partial:
+        return False
+    fence, flag_at = partial
+    path, f = _open_append(name, "ab")
+    with f:
+        if not _try_lock(f):
+            return False  # a live writer holds it
+        size = f.seek(0, 2)
+        end = _live_end(name, flag_at)
+        if end is None or end > size:
+            raise _unknown_end(name)
+        fd = os.open(path, os.O_RDWR)  # pwrite ignores the offset on O_APPEND fds
+        try:
+            tail = os.pread(fd, size - end, end)
+            os.pwrite(fd, b"\n" + b"`" * fence + b"\n" + tail, end)
+            os.pwrite(fd, turns.ABORTED, flag_at)
+        finally:
+            os.close(fd)
+    turns.live_path(name).unlink(missing_ok=True)
+    record_change(path)
+    return True
+
+class ReplySink(Sink):
+    """
+    stream a reply straight into the session file
+
+    the reply is opened as ```reply partial, written through a buffered
+    file that is flushed every 0.1s and fsynced every config.FSYNC_INTERVAL
+    seconds, and on close the
+    fence is closed and the flag blanked in place; if the stream dies the
+    turn stays marked partial, to be resumed or repaired later. every flush
+    records where the streamed bytes end (turns.live_path), so a repair
+    knows what the user typed after them
+
+    question: also write a ### User turn first
+    resume:   keep appending to the chat's unfinished reply
+    """
+    def __init__(
+            self,
+            name: str,
+            question: str | None = None,
+            model: str | None = None,
+            resume: bool = False,
+            fsync_interval: float | None = None,
+    ) -> None:
+        self.name = name
+        self.model = model
+        partial = unfinished_reply(name)
+        if resume and not partial:
+            raise ValueError(f"Chat '{name}' has no unfinished reply")
+        if not resume and partial:
+            repair_chat(name)
+
+        self.path, self.file = _open_append(name, "ab", buffering=self.buffer_size)
+        if not _try_lock(self.file):
+            self.file.close()
+            raise BlockingIOError(f"Chat '{name}' is being written by another process")
+        if fsync_interval is None:
+            from . import config  # only streaming needs it: local commands skip .env
+            fsync_interval = config.FSYNC_INTERVAL
+        self.fsync_interval = fsync_interval
+        self.synced = self.flushed = time.monotonic()
+        self.pending = 0
+        end = self.file.seek(0, 2)
+        if resume:
+            self.fence, self.flag_at = partial[0], partial[1]
+            known = _live_end(name, self.flag_at)
+            if known != end:
+                self.file.close()
+                if known is None or known > end:
+                    raise _unknown_end(name)
+                raise ValueError(f"Text was added after the interrupted reply in '{name}'; "
+                                 f"`ag ask {name}` closes the reply and answers it")
+            self.live = os.open(turns.live_path(name), os.O_WRONLY)
+            return
+        turns.INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        self.live = os.open(turns.live_path(name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        head = ""
+        if question is not None:
+            head += "\n### User\n" + question.strip() + "\n\n"
+        head += f"\n### Assistant\n{STREAM_FENCE}reply "
+        self.fence = len(STREAM_FENCE)
+        self.flag_at = end + len(head.encode("utf-8"))
+        self.file.write(head.encode("utf-8") + turns.PARTIAL + b"\n")
+        self._sync()
+
+    flush_interval = 0.1  # hand buffered deltas to the kernel at least this often
+    buffer_size = 64 * 1024
+
+    def _flush(self) -> None:
+        self.file.flush()
+        self.pending = 0
+        os.pwrite(self.live, LIVE_MARK % (self.flag_at, self.file.tell()), 0)
+        self.flushed = time.monotonic()
+
+    def _sync(self) -> None:
+        self._flush()
+        os.fsync(self.file.fileno())
+        os.fsync(self.live)  # after the file: a durable mark never runs ahead of the bytes
+        self.synced = self.flushed
+
+    def write(self, delta: str) -> None:
+        data = delta.encode("utf-8")
+        if self.pending + len(data) > self.buffer_size:
+            self._flush()  # don't let the buffer spill on its own, past the mark
+        self.file.write(data)
+        self.pending += len(data)
+        now = time.monotonic()
+        if now - self.synced >= self.fsync_interval:
+            self._sync()
+        elif now - self.flushed >= self.flush_interval:
+            self._flush()
+
+    def close(self) -> None:
+        self.file.write(b"\n" + b"`" * self.fence + b"\n")
+        self.file.flush()
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, b" " * len(turns.PARTIAL), self.flag_at)
+        finally:
+            os.close(fd)
+        self._sync()
+        self.file.close()
+        os.close(self.live)
+        turns.live_path(self.name).unlink(missing_ok=True)
+        catalog.record_write(self.name, self.path, turns.count_turns(self.name, self.path), self.model)
+        record_change(self.path)
+
+    def abort(self) -> None:
+        # keep what was paid for; the turn stays flagged partial, the mark stays with it
+        self._sync()
+        self.file.close()
+        os.close(self.live)
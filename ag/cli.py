@@ -1,17 +1,111 @@
-import subprocess, tempfile, sys, os, shutil, time, locale
+import subprocess, sys, os, shutil, time, locale, re, json
 import click
 from .chat_fs import (
-    chat_path, get_default_chat, get_default_insn, git_commit, list_chats,list_insns,
-    rename_chat, set_default_chat, append_reply,read_chat, append_user_and_reply, delete_chat,
+    chat_path, get_default_chat, get_default_insn, git_commit, list_chats,list_insns, list_sessions,
+    rename_chat, set_default_chat, append_reply, append_user_and_reply, append_turns, delete_chat,
+    read_messages, unfinished_reply, repair_chat, ReplySink, chat_exists, thaw_chat, archive_chats, migrate_chats,
+    fork_chat,
     show_chat, new_chat, DEFAULT_INSTRUCTIONS, list_insns, get_default_insn, new_insn,
-    delete_insn, set_default_insn, read_insn, INSN_DIR
+    delete_insn, set_default_insn, read_insn, INSN_DIR, CHAT_DIR, ensure_chat_dir
 )
-from .api_client import send_message, APIError
+from .turns import drop_index
+from .catalog import refresh
+from .context import fit, STRATEGIES
+from . import metrics
+
+# ag.api_client (requests, urllib3, ...) and ag.config (.env) are imported
+# inside the commands that talk to the model, so local commands stay fast
+
+HEDGE_MODES    = ["off", "hedge", "race"]
+CASSETTE_MODES = ["once", "record", "replay"]
+
+RESUME_PROMPT = (
+    "Your previous reply was cut off. Continue it exactly where it stopped, "
+    "without repeating anything or adding any preamble."
+)
+
+def resolve_system_content(insn: str | None) -> str | None:
+    """
+    system prompt for a request
+    insn: saved prompt name or literal prompt, falls back to the default prompt
+    """
+    if insn:
+        try:
+            return read_insn(insn)
+        except FileNotFoundError:
+            return insn
+    default_name = get_default_insn()
+    if default_name:
+        try:
+            return read_insn(default_name)
+        except FileNotFoundError:
+            return None
+    return DEFAULT_INSTRUCTIONS or None
+
+def add_recall(messages: list[dict[str, str]], query: str, k: int, exclude: str | None = None) -> list[dict[str, str]]:
+    """
+    <messages> with the <k> past exchanges closest to <query> (see ag.recall)
+    exclude: session whose turns are in <messages> already
+    a failed lookup is reported and the messages go out without
+    """
+    from . import recall
+    from .api_client import APIError
+    from .config import RECALL_TOKENS
+    ensure_chat_dir()
+    try:
+        model, embed = recall.embedder()
+        recall.update(CHAT_DIR, INSN_DIR, model, embed)
+        hits = recall.query(query, k, model, embed, exclude=exclude)
+    except (APIError, OSError) as e:
+        click.secho(f"Recall skipped: {e}", fg="yellow", err=True)
+        return messages
+    return recall.inject(messages, hits, RECALL_TOKENS)
+
+def context_notice(text: str) -> None:
+    click.secho(text, fg="yellow", err=True)
+
+def pick_tools(names: str | None, **conflicts: bool) -> dict | None:
+    """
+    the tools named by --tools (default: $AG_TOOLS), None for none
+    conflicts: option name -> set, for the options a tool run can't take
+    """
+    from .config import TOOLS
+    names = TOOLS if names is None else names
+    if not names:
+        return None
+    given = [f"--{k.replace('_', '-')}" for k, v in conflicts.items() if v]
+    if given:
+        raise click.UsageError(f"--tools waits for the whole answer, it can't take {', '.join(given)}")
+    from .tools import select
+    try:
+        return select(names)
+    except KeyError as e:
+        raise click.UsageError(e.args[0])
+
+def tool_reply(messages: list[dict], tools: dict, no_cache: bool) -> str:
+    """the answer to <messages> with <tools> at hand (see ag.agent), each call reported on stderr"""
+    from .agent import run
+    from .api_client import get_client
+
+    def report(name: str, args: dict, seconds: float, result: str) -> None:
+        brief = json.dumps(args, ensure_ascii=False)
+        brief = brief if len(brief) <= 60 else brief[:57] + "..."
+        failed = result.startswith("error: ")
+        note = result.splitlines()[0] if failed else f"{len(result.encode('utf-8'))} bytes"
+        click.secho(f"  {name} {brief}  {seconds:.2f}s  {note}", fg="red" if failed else "cyan", err=True)
+
+    return run(get_client(), messages, tools, use_cache=not no_cache, report=report)
 
 @click.group(context_settings={"help_option_names": ["-h", "--help"]})
-def cli():
+@click.option("--cassette"     , "cassette"    , default = None, metavar="FILE", help="record the api traffic to FILE, or replay it from there (default: $AG_CASSETTE)")
+@click.option("--cassette-mode", "cassette_mode", type=click.Choice(CASSETTE_MODES), default=None, help="replay if FILE exists, else record (once), or force one (default: $AG_CASSETTE_MODE)")
+@click.option("--replay-speed" , "replay_speed", type=float, default=None, metavar="X", help="replay X times as fast as recorded, 0: at once (default: $AG_REPLAY_SPEED)")
+def cli(cassette, cassette_mode, replay_speed):
     """ag: agent for everything"""
-    pass
+    # ag.config reads these when a command first talks to the model
+    for key, value in (("AG_CASSETTE", cassette), ("AG_CASSETTE_MODE", cassette_mode), ("AG_REPLAY_SPEED", replay_speed)):
+        if value is not None:
+            os.environ[key] = str(value)
 
 @cli.group(name="insn", help="manage system prompts")
 def insn(): pass
@@ -68,36 +162,83 @@ def insn_show(name):
     except FileNotFoundError as e:
         raise click.ClickException(str(e))
 
+@cli.group(name="cache", help="manage the response cache")
+def cache(): pass
+
+@cache.command(name="stats")
+def cache_stats():
+    from .cache import ResponseCache
+    st = ResponseCache().stats()
+    click.echo(f"path:    {st['path']}")
+    click.echo(f"entries: {st['entries']}")
+    click.echo(f"size:    {st['bytes'] / 1024:.1f} KiB / {st['max_bytes'] / 1024:.1f} KiB")
+    click.echo(f"ttl:     {st['ttl']:.0f}s")
+    if st["oldest"]:
+        click.echo(f"oldest:  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(st['oldest']))}")
+
+@cache.command(name="clear")
+def cache_clear():
+    from .cache import ResponseCache
+    count = ResponseCache().clear()
+    click.secho(f"Removed {count} cached replies.", fg="green")
+
 @cli.command(name="re", help="repl mode")
 @click.option("-s", "--stream" , is_flag = True          , help="stream")
 @click.option("-i", "--insn"   , "insn" , default = None , help="system prompt or saved prompt name")
-def repl(stream: bool, insn: str | None) -> None:
+@click.option("--no-cache"     , "no_cache", is_flag = True, help="always ask the model, skip the response cache")
+@click.option("--context"      , "context" , type=click.Choice(STRATEGIES), default=None, help="over-budget strategy (default: $AG_CONTEXT)")
+@click.option("--budget"       , "budget"  , type=int, default=None, help="prompt token budget (default: from model)")
+@click.option("--resume"       , "resume"  , default = None, metavar="NAME", help="continue session NAME, appending each turn as it completes")
+@click.option("--recover"      , "recover" , is_flag = True, help="save REPL conversations left behind by a crash, then exit")
+@click.option("--timing"       , "timing"  , is_flag = True, help="print request timings to stderr")
+@click.option("--hedge"        , "hedge"   , type=click.Choice(HEDGE_MODES), default=None, help="backup request to $AG_HEDGE_URL/$AG_HEDGE_MODEL (default: $AG_HEDGE)")
+@click.option("--recall"       , "recall"  , type=int, default=0, metavar="K", help="add the K most relevant past exchanges of any session to each question")
+@click.option("--tools"        , "tool_names", default = None, metavar="NAMES", help="tools the model may call: sh,read_file,list_dir or all (default: $AG_TOOLS)")
+def repl(stream: bool, insn: str | None, no_cache: bool, context: str | None, budget: int | None,
+         resume: str | None, recover: bool, timing: bool, hedge: str | None, recall: int, tool_names: str | None) -> None:
     """
     repl mode
+
+    every turn is written as soon as it completes: to the session with
+    --resume, otherwise to a journal under ~/.ag/journal that `--recover`
+    turns into a session if the REPL dies before its save prompt
     """
-    encoding = locale.getpreferredencoding(False)
+    from . import journal
+    if recover:
+        recover_journals(journal)
+        return
 
-    click.secho("Entering REPL mode. Type /exit or Ctrl+D to quit.", fg="blue")
+    from .api_client import send_message, stream_message, get_client, APIError
+    from .sinks import TerminalSink, consume
+    tools = pick_tools(tool_names, stream=stream, hedge=bool(hedge))
+    encoding = locale.getpreferredencoding(False)
+    metrics.verbose = metrics.verbose or timing
+    metrics.tags.update(command="re", session=resume)
 
     messages: list[dict[str, str]] = []
-    system_content: str | None = None
-    if insn:
+    system_content = resolve_system_content(insn)
+    if system_content:
+        messages.append({"role": "system", "content": system_content})
+
+    log = None
+    if resume:
         try:
-            system_content = read_insn(insn)
-        except FileNotFoundError:
-            system_content = insn
+            if unfinished_reply(resume) and repair_chat(resume):
+                click.secho(f"Closed an interrupted reply in '{resume}' (marked aborted).", fg="yellow", err=True)
+            messages.extend(read_messages(resume))
+        except (FileNotFoundError, ValueError) as e:
+            click.secho(f"Error encounted: {e}", fg="red")
+            sys.exit(1)
     else:
-        default_name = get_default_insn()
-        if default_name:
-            try:
-                system_content = read_insn(default_name)
-            except FileNotFoundError:
-                system_content = None
-        else:
-            system_content = DEFAULT_INSTRUCTIONS or None
+        left = journal.orphans()
+        if left:
+            click.secho(f"{len(left)} unsaved REPL conversation(s) from a crash; save them with: ag re --recover", fg="yellow")
+        log = journal.ReplJournal()
 
-    if system_content:
-        messages.append({"role": "system", "content": system_content})
+    click.secho("Entering REPL mode. Type /exit or Ctrl+D to quit.", fg="blue")
+    if resume:
+        turns = sum(m["role"] == "user" for m in messages)
+        click.secho(f"Resumed '{resume}' ({turns} turns).", fg="blue")
 
     history: list[tuple[str, str]] = []
 
@@ -118,9 +259,17 @@ def repl(stream: bool, insn: str | None) -> None:
             break
 
         messages.append({"role": "user", "content": q})
+        if recall:
+            messages = add_recall(messages, q, recall, exclude=resume)  # replaces the last question's
+        messages = fit(messages, strategy=context, budget=budget, notice=context_notice)
         click.secho("Processing...", fg="green")
         try:
-            reply = send_message(messages, stream=stream)
+            if tools:
+                reply = tool_reply(messages, tools, no_cache)
+            elif stream:
+                reply = consume(stream_message(messages, use_cache=not no_cache, hedge=hedge), TerminalSink())
+            else:
+                reply = send_message(messages, use_cache=not no_cache, hedge=hedge)
         except APIError as e:
             click.secho(f"API Error: {e}", fg="red")
             messages.pop()
@@ -130,12 +279,23 @@ def repl(stream: bool, insn: str | None) -> None:
             click.echo(reply)
         history.append((q, reply))
         messages.append({"role": "assistant", "content": reply})
+        if resume:
+            append_user_and_reply(resume, q, reply, model=get_client().model)
+        else:
+            log.append(q, reply, model=get_client().model)
+
+    if resume:
+        if history:
+            commit_session(resume)
+        return
 
     if not history:
+        log.discard()
         click.secho("No messages in this REPL session.", fg="yellow")
         return
 
     if not click.confirm("Save this REPL conversation as a new session?", default=False):
+        log.discard()
         click.secho("REPL session discarded.", fg="yellow")
         return
 
@@ -147,15 +307,38 @@ def repl(stream: bool, insn: str | None) -> None:
         except FileExistsError:
             click.secho(f"Session '{name}' already exists.", fg="red")
 
-    for q, reply in history:
-        append_user_and_reply(name, q, reply)
-
+    append_turns(name, history, model=get_client().model)
+    log.discard()
     click.secho(f"REPL conversation saved to session '{name}'", fg="green")
+    commit_session(name)
+
+def commit_session(name: str) -> None:
     try:
         git_commit(name)
     except subprocess.CalledProcessError:
         click.secho("Git commit failed; please check your Git setup.", fg="yellow")
 
+def recover_journals(journal) -> None:
+    """turn every orphaned REPL journal into a session"""
+    left = journal.orphans()
+    if not left:
+        click.secho("No unsaved REPL conversations.", fg="yellow")
+        return
+    for path in left:
+        entries = journal.load(path)
+        if not entries:
+            path.unlink()
+            continue
+        stamp = path.stem.split("-")[-1]
+        name, n = f"repl-{stamp}", 1
+        while chat_exists(name):
+            name, n = f"repl-{stamp}-{n}", n + 1
+        new_chat(name)
+        append_turns(name, [(e["q"], e["reply"]) for e in entries], model=entries[-1].get("model"))
+        path.unlink()
+        click.secho(f"Recovered {len(entries)} turn(s) into session '{name}'", fg="green")
+        commit_session(name)
+
 @cli.command(name="new")
 @click.argument("name")
 @click.option("-i", "--insn", help="system prompt")
@@ -172,6 +355,29 @@ def new(name, insn):
         click.secho(f"Error encounted: {e}", fg="red")
         sys.exit(1)
 
+@cli.command(name="migrate")
+def migrate():
+    """
+    move sessions into the sharded layout (~/.ag/chats/ab/NAME.md)
+
+    safe while other ag commands run; session names don't change
+    """
+    from .layout import current, SHARDED
+    ensure_chat_dir()
+    if current(CHAT_DIR) == SHARDED:
+        click.secho("Sessions are already sharded.", fg="green")
+        return
+    moved, clashes = migrate_chats(progress=lambda n: click.echo(f"  {n} moved...", err=True))
+    click.secho(f"moved {moved} sessions to the sharded layout", fg="green")
+    try:
+        git_commit("migrate")
+    except subprocess.CalledProcessError:
+        click.secho("Git commit failed; please check your Git setup.", fg="yellow")
+    if clashes:
+        click.secho(f"left in place, a session of the same name is already sharded: {', '.join(clashes)}", fg="red")
+        click.secho("resolve them and run `ag migrate` again", fg="red")
+        sys.exit(1)
+
 @cli.command(name="mv")
 @click.argument("old_name")
 @click.argument("new_name")
@@ -188,6 +394,30 @@ def rename(old_name, new_name):
         click.secho(f"Error encounted: {e}", fg="red")
         sys.exit(1)
 
+@cli.command(name="fork")
+@click.argument("src")
+@click.argument("new")
+@click.option("--at", "at", type=click.IntRange(min=0), help="keep the first TURN turns of SRC (default: all)", metavar="TURN")
+def fork(src, new, at):
+    """
+    new session NEW continuing SRC (or SRC cut after turn TURN)
+
+    both move into the turn store, where the turns they share are kept
+    once: a fork costs a few hundred bytes, however long SRC is. turns
+    are numbered as in `ag search`, user and assistant each count one.
+    `ag ed` turns a stored session back into a plain file
+    """
+    try:
+        kept = fork_chat(src, new, at)
+    except (FileNotFoundError, FileExistsError, ValueError, BlockingIOError) as e:
+        click.secho(f"Error encounted: {e}", fg="red")
+        sys.exit(1)
+    click.secho(f"Forked '{src}' into '{new}' at turn {kept}", fg="green")
+    try:
+        git_commit(new)
+    except subprocess.CalledProcessError:
+        click.secho("Git commit failed; please check your Git setup.", fg="yellow")
+
 @cli.command(name="rm")
 @click.argument("name")
 def delete(name):
@@ -210,26 +440,78 @@ def delete(name):
 @click.option("--save-as", "save_as"  , default = None, help="save the chat (temp session)")
 @click.option("-s", "--stream" , "stream"   , is_flag = True, help="turn on stream")
 @click.option("-i", "--insn"   , "insn"     , default = None, help="system prompt or saved prompt name")
-def ask(name, use_stdin, is_temp, save_as, stream, insn):
+@click.option("--no-cache"     , "no_cache" , is_flag = True, help="always ask the model, skip the response cache")
+@click.option("--context"      , "context"  , type=click.Choice(STRATEGIES), default=None, help="over-budget strategy (default: $AG_CONTEXT)")
+@click.option("--budget"       , "budget"   , type=int, default=None, help="prompt token budget (default: from model)")
+@click.option("--live"         , "live"     , is_flag = True, help="stream the reply straight into the session file")
+@click.option("--resume"       , "resume"   , is_flag = True, help="continue the session's interrupted reply (implies --live)")
+@click.option("--timing"       , "timing"   , is_flag = True, help="print request timings to stderr")
+@click.option("--hedge"        , "hedge"    , type=click.Choice(HEDGE_MODES), default=None, help="backup request to $AG_HEDGE_URL/$AG_HEDGE_MODEL (default: $AG_HEDGE)")
+@click.option("--recall"       , "recall"   , type=int, default=0, metavar="K", help="add the K most relevant past exchanges of any session")
+@click.option("--map-reduce"   , "map_reduce", is_flag = True, help="with --stdin: run -i on each chunk of the input in parallel, then combine the answers")
+@click.option("--reduce"       , "reduce_insn", default = None, help="prompt or saved prompt name that combines the chunk answers (--map-reduce)")
+@click.option("--chunk-tokens" , "chunk_tokens", type=int, default=4000, show_default=True, help="chunk size for --map-reduce")
+@click.option("-j", "--jobs"   , "jobs"     , default = 8, show_default=True, help="requests in flight for --map-reduce")
+@click.option("--tools"        , "tool_names", default = None, metavar="NAMES", help="tools the model may call: sh,read_file,list_dir or all (default: $AG_TOOLS)")
+def ask(name, use_stdin, is_temp, save_as, stream, insn, no_cache, context, budget, live, resume, timing, hedge, recall,
+        map_reduce, reduce_insn, chunk_tokens, jobs, tool_names):
     """
     send question to llm
 
     pipe:
       echo "question" | ag ask --stdin [--temp] [--save-as NAME|--no-save]
+      cat big.log | ag ask --stdin --map-reduce -i "list the distinct errors" [-j 16]
     normal:
-      ag ask [NAME] [--stream]
+      ag ask [NAME] [--stream] [--live] [--resume] [--recall K]
+    tools:
+      ag ask [NAME] --tools read_file,list_dir [-i "..."]
     """
+    import tempfile
+    from .api_client import send_message, stream_message, get_client, APIError
+    from .sinks import TerminalSink, consume
+    if resume and (use_stdin or is_temp):
+        raise click.UsageError("--resume continues a session's reply, it can't take --stdin or --temp")
+    if map_reduce:
+        if not use_stdin or is_temp or live or resume or recall or tool_names:
+            raise click.UsageError("--map-reduce reads --stdin, it can't take --temp, --live, --resume, --recall or --tools")
+        if chunk_tokens < 100 or jobs < 1:
+            raise click.UsageError("--chunk-tokens must be >= 100 and --jobs >= 1")
+        metrics.verbose = metrics.verbose or timing
+        metrics.tags.update(command="ask", session=name)
+        return ask_map_reduce(name, insn, reduce_insn, chunk_tokens, jobs, no_cache)
+    tools = pick_tools(tool_names, stream=stream, live=live, resume=resume, hedge=bool(hedge))
+    live = (live or resume) and not is_temp
+    stream = stream or live
+    metrics.verbose = metrics.verbose or timing
+    metrics.tags.update(command="ask", session=name)
+    history: list[dict[str, str]] = []
     if use_stdin:
         prompt = sys.stdin.read().strip()
     else:
         if not name:
             default = get_default_chat()
-            if default:
-                click.secho("Using default session")
-                name = default
-            click.secho("Require a session name, default session or --stdin flag", fg="red", err=True)
+            if not default:
+                click.secho("Require a session name, default session or --stdin flag", fg="red", err=True)
+                sys.exit(1)
+            click.secho("Using default session")
+            name = default
+            metrics.tags["session"] = name
+        try:
+            if unfinished_reply(name) and not resume and repair_chat(name):
+                click.secho(f"Closed an interrupted reply in '{name}' (marked aborted).", fg="yellow", err=True)
+            elif resume and not unfinished_reply(name):
+                click.secho(f"'{name}' has no interrupted reply to resume", fg="red", err=True)
+                sys.exit(1)
+            history = read_messages(name)
+        except (FileNotFoundError, ValueError) as e:
+            click.secho(f"Error encounted: {e}", fg="red")
             sys.exit(1)
-        prompt = read_chat(name)
+        if resume:
+            history.append({"role": "user", "content": RESUME_PROMPT})
+        if not history or history[-1]["role"] != "user":
+            click.secho(f"Nothing to ask: add your question to the end of '{name}' (ag ed {name})", fg="red", err=True)
+            sys.exit(1)
+        prompt = history[-1]["content"]
 
     temp_path : str | None = None
     if is_temp:
@@ -241,29 +523,45 @@ def ask(name, use_stdin, is_temp, save_as, stream, insn):
 
     click.secho("Processing...", fg="green")
     message: list[dict[str,str]] = []
-    system_content: str | None = None
-    if insn:
-        try:
-            system_content = read_insn(insn)
-        except FileNotFoundError:
-            system_content = insn
-    else:
-        default_name = get_default_insn()
-        if default_name:
-            try:
-                system_content = read_insn(default_name)
-            except FileNotFoundError:
-                system_content = None
-        else:
-            system_content = DEFAULT_INSTRUCTIONS or None
-
+    system_content = resolve_system_content(insn)
     if system_content:
         message.append({"role": "system", "content": system_content})
 
-    message.append({"role": "user", "content": prompt})
+    if history:
+        message.extend(history)
+    else:
+        message.append({"role": "user", "content": prompt})
+    if recall:
+        message = add_recall(message, prompt, recall, exclude=name if history else None)
+    message = fit(message, strategy=context, budget=budget, notice=context_notice)
+
+    if live and name:
+        # the reply goes to the session file as it arrives, nothing is held in memory
+        try:
+            sink = ReplySink(name, question=prompt if use_stdin else None,
+                             model=get_client().model, resume=resume)
+        except (FileNotFoundError, BlockingIOError, ValueError) as e:
+            click.secho(f"Error encounted: {e}", fg="red")
+            sys.exit(1)
+        try:
+            consume(stream_message(message, use_cache=False, hedge=hedge), TerminalSink(), sink, keep=False)
+        except (APIError, KeyboardInterrupt) as e:
+            click.secho(f"\nReply interrupted ({str(e) or 'Ctrl-C'}); the partial reply is kept in '{name}'.", fg="red")
+            click.secho(f"Continue it with: ag ask {name} --resume", fg="yellow")
+            sys.exit(1)
+        try:
+            git_commit(name)
+        except subprocess.CalledProcessError:
+            click.secho("Git commit failed; please check your Git setup.", fg="yellow")
+        return
 
     try:
-        reply = send_message(message, stream=stream)
+        if tools:
+            reply = tool_reply(message, tools, no_cache)
+        elif stream:
+            reply = consume(stream_message(message, use_cache=not no_cache, hedge=hedge), TerminalSink())
+        else:
+            reply = send_message(message, use_cache=not no_cache, hedge=hedge)
     except APIError as e:
         click.secho(f"Failed to fetch reply, {e}", fg="red")
         if temp_path is not None:
@@ -281,7 +579,7 @@ def ask(name, use_stdin, is_temp, save_as, stream, insn):
 
             if save_as:
                 new_chat(save_as)
-                append_user_and_reply(save_as, prompt, reply)
+                append_user_and_reply(save_as, prompt, reply, model=get_client().model)
                 try:
                     git_commit(save_as)
                 except subprocess.CalledProcessError:
@@ -295,34 +593,312 @@ def ask(name, use_stdin, is_temp, save_as, stream, insn):
             return
     else:
         if use_stdin:
-            append_user_and_reply(name, prompt, reply)
+            append_user_and_reply(name, prompt, reply, model=get_client().model)
         else:
-            append_reply(name, reply)
+            append_reply(name, reply, model=get_client().model)
         try:
             git_commit(name)
         except subprocess.CalledProcessError:
             click.secho("Git commit failed; please check your Git setup.", fg="yellow")
 
+def ask_map_reduce(name: str | None, insn: str | None, reduce_insn: str | None,
+                   chunk_tokens: int, jobs: int, no_cache: bool) -> None:
+    """ask --stdin --map-reduce: answer -i for stdin chunk by chunk, print (and save) the combined answer"""
+    import asyncio
+    from .mapreduce import map_reduce, read_lines, DEFAULT_MAP
+    from .api_client import get_client, APIError
+    map_prompt = resolve_system_content(insn) if insn else DEFAULT_MAP
+    reduce_prompt = resolve_system_content(reduce_insn) if reduce_insn else None
+    tty = sys.stderr.isatty()
+
+    def progress(stage: str, done: int, total: int | None, resumed: int) -> None:
+        msg = f"{stage} {done}{f'/{total}' if total else ''}" + (f" ({resumed} kept from an earlier run)" if resumed else "")
+        if tty:
+            click.echo(f"\r{msg}\x1b[K", nl=False, err=True)
+        elif total and done == total:
+            click.echo(msg, err=True)  # a log: only the end of each step
+
+    try:
+        reply, parts = asyncio.run(map_reduce(read_lines(sys.stdin), map_prompt, reduce_prompt, chunk_tokens=chunk_tokens,
+                                              jobs=jobs, use_cache=not no_cache, progress=progress))
+    except (APIError, KeyboardInterrupt) as e:
+        if tty:
+            click.echo(err=True)
+        click.secho(f"Failed to fetch reply, {str(e) or 'interrupted'}", fg="red")
+        click.secho("Answers received so far are kept: run the same command again to resume.", fg="yellow")
+        sys.exit(1)
+    if tty:
+        click.echo(err=True)
+    click.echo(reply)
+    if name:
+        append_user_and_reply(name, f"(stdin, map-reduce over {parts} parts)\n\n{map_prompt}", reply,
+                              model=get_client().model)
+        try:
+            git_commit(name)
+        except subprocess.CalledProcessError:
+            click.secho("Git commit failed; please check your Git setup.", fg="yellow")
+
+@cli.command(name="batch")
+@click.argument("src", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("-o", "--output" , "out"    , type=click.File("w", encoding="utf-8"), default="-", help="write results here (default: stdout)")
+@click.option("-j", "--jobs"   , "jobs"   , default = 8     , show_default=True, help="max concurrent requests")
+@click.option("--ordered"      , "ordered", is_flag = True  , help="write results in input order instead of completion order")
+@click.option("--timeout"      , "timeout", type=float, default = None, help="read timeout per request")
+@click.option("--no-cache"     , "no_cache", is_flag = True , help="always ask the model, skip the response cache")
+def batch(src, out, jobs, ordered, timeout, no_cache):
+    """
+    run JSONL requests concurrently
+
+    \b
+    each line: {"prompt": "..."} or {"messages": [...]}
+      optional: "id", "insn" (name or literal), "session" (save reply to it)
+    each result: {"index": N, "id": ..., "reply": "..."} or {..., "error": "..."}
+
+    \b
+      ag batch prompts.jsonl -j 16 > results.jsonl
+      cat prompts.jsonl | ag batch --ordered
+    """
+    import asyncio
+    from .batch import run_batch
+    metrics.tags["command"] = "batch"
+    if jobs < 1:
+        raise click.BadParameter("must be >= 1", param_hint="--jobs")
+
+    ok, failed, sessions = asyncio.run(
+        run_batch(src, out, resolve_system_content, jobs=jobs, ordered=ordered,
+                  timeout=timeout, use_cache=not no_cache)
+    )
+    if sessions:
+        try:
+            git_commit("batch")
+        except subprocess.CalledProcessError:
+            click.secho("Git commit failed; please check your Git setup.", fg="yellow", err=True)
+    click.secho(f"batch done: {ok} ok, {failed} failed", fg="green" if not failed else "yellow", err=True)
+    if failed:
+        sys.exit(1)
+
+@cli.command(name="commit")
+def commit():
+    """commit pending session changes to git (see $AG_GIT)"""
+    from .chat_fs import flush_git
+    try:
+        flush_git()
+    except subprocess.CalledProcessError:
+        click.secho("Git commit failed; please check your Git setup.", fg="yellow")
+        sys.exit(1)
+
 @cli.command(name="ed")
 @click.argument("name")
 def edit(name):
     """edit conversation"""
     import os, subprocess
     path = chat_path(name)
-    if not path.exists():
+    if not path.exists() and not thaw_chat(name):
         click.secho(f"Chat '{name}' not found", fg="red")
         sys.exit(1)
     editor = os.getenv("EDITOR", "vi")
     subprocess.call([editor, str(path)])
+    drop_index(name)
+    refresh(name, path)
 
 @cli.command(name="ls")
-def ag_list():
+@click.option("-l", "--long"   , "long"   , is_flag = True, help="show turns, size, last change and model")
+@click.option("--sort"         , "sort"   , type=click.Choice(["name", "recent", "size", "frecency"]), default="name", help="order of the list")
+@click.option("--rebuild"      , "rebuild", is_flag = True, help="rebuild the session catalog from disk")
+def ag_list(long, sort, rebuild):
     """list all sessions, display '*' before default session"""
-    chats = list_chats()
+    chats = list_sessions(sort, rebuild=rebuild)
     default = get_default_chat()
-    for name in chats:
-        prefix = "* " if name == default else "  "
-        click.echo(f"{prefix}{name}")
+    lines = []
+    for row in chats:
+        prefix = "* " if row["name"] == default else "  "
+        archived = "  (archived)" if row["archived"] else ""
+        if not long:
+            lines.append(f"{prefix}{row['name']}{archived}")
+            continue
+        modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["modified"]))
+        lines.append(
+            f"{prefix}{row['name']:<24} {row['turns']:>5} turns {human_size(row['size']):>8}  "
+            f"{modified}  {row['model'] or '-'}{archived}"
+        )
+    # one write: per-line echo dominates with many sessions
+    if lines:
+        click.echo("\n".join(lines))
+
+def human_size(n: int) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if n < 1024 or unit == "G":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+    return f"{n}"
+
+SIZE_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+def parse_size(text: str) -> int:
+    """"512K", "2M", "100" -> bytes"""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([bkmg]?)b?\s*", text.lower())
+    if not m:
+        raise ValueError(f"bad size '{text}' (use e.g. 500K, 2M)")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2)])
+
+@cli.command(name="archive")
+@click.option("--older-than"   , "older"  , default = None, help="sessions untouched for this long, e.g. 180d (default when no --larger-than)")
+@click.option("--larger-than"  , "larger" , default = None, help="sessions bigger than this, e.g. 2M")
+@click.option("-n", "--dry-run", "dry_run", is_flag = True, help="only show what would be archived")
+@click.option("-l", "--list"   , "ls"     , is_flag = True, help="list archived sessions")
+@click.option("--thaw"         , "thaw"   , default = None, metavar="NAME", help="move an archived session back to a plain file")
+def archive_cmd(older, larger, dry_run, ls, thaw):
+    """
+    pack cold sessions into compressed files under ~/.ag/archive
+
+    archived sessions still work with cat, ask, search, etc.; anything
+    that writes to one thaws it back into a plain file first.
+    both criteria given: a session has to meet both
+
+    \b
+      ag archive -n                 # what would go (untouched for 180 days)
+      ag archive --older-than 52w
+      ag archive --larger-than 1M --older-than 30d
+    """
+    from . import archive
+    if ls:
+        for row in archive.members():
+            archived = time.strftime("%Y-%m-%d", time.localtime(row["archived"]))
+            click.echo(f"{row['name']:<24} {human_size(row['size']):>8} -> {human_size(row['length']):>8}  {archived}  {row['pack']}")
+        return
+    if thaw:
+        if not thaw_chat(thaw):
+            click.secho(f"Chat '{thaw}' is not archived", fg="red")
+            sys.exit(1)
+        click.secho(f"thawed '{thaw}'", fg="green")
+        try:
+            git_commit("archive")
+        except subprocess.CalledProcessError:
+            click.secho("Git commit failed; please check your Git setup.", fg="yellow")
+        return
+    try:
+        min_age = metrics.parse_window(older) if older else None if larger else metrics.parse_window("180d")
+        min_size = parse_size(larger) if larger else None
+    except ValueError as e:
+        click.secho(str(e), fg="red")
+        sys.exit(1)
+    now = time.time()
+    default = get_default_chat()
+    names = []
+    for name in list_chats():
+        # the files, not the catalog: edits made outside ag count too
+        st = chat_path(name).stat()
+        if (name != default
+                and (min_age is None or now - st.st_mtime >= min_age)
+                and (min_size is None or st.st_size >= min_size)):
+            names.append(name)
+    # a reply that never finished is left to `ag ask --resume`
+    names = [n for n in names if unfinished_reply(n) is None]
+    if not names:
+        click.secho("Nothing to archive.", fg="yellow")
+        return
+    if dry_run:
+        click.echo("\n".join(names))
+        return
+    size_in, size_out = archive_chats(names)
+    click.secho(f"archived {len(names)} sessions: {human_size(size_in)} -> {human_size(size_out)}", fg="green")
+    try:
+        git_commit("archive")
+    except subprocess.CalledProcessError:
+        click.secho("Git commit failed; please check your Git setup.", fg="yellow")
+
+@cli.command(name="search")
+@click.argument("query", nargs=-1, required=True)
+@click.option("-r", "--role"   , "role"   , type=click.Choice(["user", "assistant", "system", "insn"]), default=None, help="only turns of this role")
+@click.option("-n", "--limit"  , "limit"  , default = 20, show_default=True, help="max hits")
+@click.option("--rebuild"      , "rebuild", is_flag = True, help="rebuild the search index from scratch")
+def search_cmd(query, role, limit, rebuild):
+    """
+    full-text search across sessions and prompts
+
+    \b
+      ag search docker compose          # both words
+      ag search '"connection refused"'  # phrase
+      ag search 'kube*' -r assistant    # prefix, replies only
+    """
+    from .search import update, search
+    ensure_chat_dir()
+    update(CHAT_DIR, INSN_DIR, rebuild=rebuild)
+    hits = search(" ".join(query), role=role, limit=limit)
+    if not hits:
+        click.secho("No matches.", fg="yellow")
+        sys.exit(1)
+    for hit in hits:
+        where = hit["name"] if hit["kind"] == "chat" else f"insn:{hit['name']}"
+        label = hit["role"] if hit["kind"] == "insn" else f"{hit['role']}#{hit['turn']}"
+        snippet = " ".join(hit["snippet"].split())
+        snippet = re.sub("\x02(.*?)\x03", lambda m: click.style(m.group(1), bold=True, fg="red"), snippet)
+        click.echo(f"{click.style(where, fg='blue')} {click.style(label, fg='green')}  {snippet}")
+
+@cli.command(name="serve")
+@click.option("-d", "--detach" , "detach" , is_flag = True, help="run in the background (log: ~/.ag/serve.log)")
+@click.option("--stop"         , "stop"   , is_flag = True, help="stop the running daemon")
+def serve(detach, stop):
+    """
+    keep ag resident: ask/ls/cat/search are forwarded to it
+
+    \b
+      ag serve -d     # start in the background
+      ag serve --stop
+    """
+    from .daemon import serve as run, stop_daemon, SOCKET
+    if stop:
+        if not stop_daemon():
+            click.secho(f"No daemon on {SOCKET}", fg="yellow")
+            sys.exit(1)
+        click.secho("ag serve stopped", fg="green")
+        return
+    run(detach=detach)
+    if detach:
+        click.secho(f"ag serve started on {SOCKET}", fg="green")
+
+@cli.command(name="stats")
+@click.option("--by"           , "by"     , type=click.Choice(sorted(metrics.GROUPS)), default="model", show_default=True, help="group requests by")
+@click.option("--since"        , "since"  , default = None, help="only the last 30m / 24h / 7d / 2w")
+@click.option("--cached"       , "cached" , is_flag = True, help="count cache hits too")
+@click.option("--json"         , "as_json", is_flag = True, help="machine-readable output")
+def stats(by, since, cached, as_json):
+    """
+    request latency and token usage from ~/.ag/metrics.jsonl
+
+    \b
+      ag stats                      # per model, all time
+      ag stats --by session --since 7d
+      ag stats --by day --json
+    """
+    import json
+    try:
+        start = time.time() - metrics.parse_window(since) if since else None
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--since")
+    records = [r for r in metrics.load(start) if cached or not r.get("cached")]
+    rows = metrics.summarize(records, by)
+    if as_json:
+        click.echo(json.dumps(rows, indent=2))
+        return
+    if not rows:
+        click.secho("No requests recorded.", fg="yellow")
+        return
+
+    def ms(v):
+        return "-" if v is None else f"{v:.0f}" if v >= 10 else f"{v:.1f}"
+
+    width = max(len(by), *(len(str(r[by])) for r in rows))
+    click.secho(f"{by:<{width}}  {'reqs':>5} {'err':>4} {'cxl':>4}  {'p50':>7} {'p95':>7} {'p99':>7}  {'ttft':>6}  "
+                f"{'tok/s':>6}  {'in':>9} {'out':>9}", bold=True)
+    lines = [
+        f"{str(r[by]):<{width}}  {r['requests']:>5} {r['errors']:>4} {r['cancelled']:>4}  {ms(r['p50_ms']):>7} {ms(r['p95_ms']):>7} "
+        f"{ms(r['p99_ms']):>7}  {ms(r['ttft_p50_ms']):>6}  {ms(r['tok_s_p50']):>6}  "
+        f"{r['prompt_tokens']:>9} {r['completion_tokens']:>9}"
+        for r in rows
+    ]
+    click.echo("\n".join(lines))
+    click.secho("latency in ms (total request time; ttft = median time to first token; cxl = hedges cancelled)", fg="blue")
 
 @cli.command(name="sw")
 @click.argument("name", required=False)
@@ -342,7 +918,7 @@ def switch(name):
             click.secho(f"Error encounted: {e}", fg="red")
             sys.exit(1)
     else:
-        chats = list_chats()
+        chats = [row["name"] for row in list_sessions("frecency")]
         if not chats:
             click.secho("No available sessions found", fg="red")
             sys.exit(1)
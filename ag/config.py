@@ -6,3 +6,63 @@ load_dotenv()
 API_KEY = os.getenv("API_KEY")
 BASE_URL = os.getenv("BASE_URL", "https://api.openai.com")
 DEFAULT_MODEL = os.getenv("DEFAULT_MODEL", "gpt-4o")
+
+# http client
+POOL_SIZE       = int(os.getenv("AG_POOL_SIZE", "4"))
+KEEP_ALIVE      = os.getenv("AG_KEEP_ALIVE", "1") != "0"
+CONNECT_TIMEOUT = float(os.getenv("AG_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT    = float(os.getenv("AG_READ_TIMEOUT", "30"))
+GZIP_MIN_BYTES  = int(os.getenv("AG_GZIP_MIN_BYTES", "0"))  # 0: never gzip
+STREAM_USAGE    = os.getenv("AG_STREAM_USAGE", "1") != "0"  # ask for token usage at the end of a stream
+
+# rate limits and retries, shared by all ag processes through ~/.ag/ratelimit/
+RPM          = int(os.getenv("AG_RPM", "0"))            # requests per minute per endpoint + model, 0: no limit
+TPM          = int(os.getenv("AG_TPM", "0"))            # tokens per minute, 0: no limit
+MAX_INFLIGHT = int(os.getenv("AG_MAX_INFLIGHT", "0"))   # requests in flight, 0: only the adaptive limit
+RETRIES      = int(os.getenv("AG_RETRIES", "4"))        # on 429 / 5xx / connection errors, 0: fail at once
+RETRY_MAX    = float(os.getenv("AG_RETRY_MAX", "60"))   # seconds, a longer Retry-After fails instead
+
+# record / replay of the api traffic (see ag.cassette)
+CASSETTE      = os.getenv("AG_CASSETTE", "")                  # cassette file, "": talk to the endpoint
+CASSETTE_MODE = os.getenv("AG_CASSETTE_MODE", "once")         # record | replay | once: replay if the file exists
+REPLAY_SPEED  = float(os.getenv("AG_REPLAY_SPEED", "1"))      # 1: as recorded, 10: ten times faster, 0: no waits
+
+# tools the model can call (ask / re --tools, see ag.tools)
+TOOLS          = os.getenv("AG_TOOLS", "")                        # default --tools, e.g. read_file,list_dir
+TOOL_JOBS      = int(os.getenv("AG_TOOL_JOBS", "4"))              # tool calls of one turn run at once
+TOOL_ROUNDS    = int(os.getenv("AG_TOOL_ROUNDS", "8"))            # turns of tool calls before an answer is required
+TOOL_TIMEOUT   = float(os.getenv("AG_TOOL_TIMEOUT", "30"))        # seconds, per call (read_file, list_dir: 10)
+TOOL_MAX_BYTES = int(os.getenv("AG_TOOL_MAX_BYTES", "16384"))     # of a call's result sent to the model
+
+# hedged requests: a backup request goes to HEDGE_URL / HEDGE_MODEL when the
+# first token is late (race: both at once)
+HEDGE          = os.getenv("AG_HEDGE", "off")                       # off | hedge | race
+HEDGE_URL      = os.getenv("AG_HEDGE_URL", BASE_URL)
+HEDGE_MODEL    = os.getenv("AG_HEDGE_MODEL", DEFAULT_MODEL)
+HEDGE_API_KEY  = os.getenv("AG_HEDGE_API_KEY", API_KEY or "")
+HEDGE_AFTER_MS = float(os.getenv("AG_HEDGE_AFTER_MS", "0"))         # 0: adapt to the primary's p95 TTFT
+
+# per-request metrics (see ag.metrics)
+METRICS = os.getenv("AG_METRICS", "1") != "0"   # append a record to ~/.ag/metrics.jsonl
+TIMING  = os.getenv("AG_TIMING", "0") != "0"    # print a timing line to stderr, like --timing
+
+# response cache
+CACHE_ENABLED   = os.getenv("AG_CACHE", "1") != "0"
+CACHE_MAX_BYTES = int(os.getenv("AG_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL       = float(os.getenv("AG_CACHE_TTL", str(7 * 24 * 3600)))  # seconds, 0: never expire
+
+# context window
+CONTEXT_STRATEGY   = os.getenv("AG_CONTEXT", "drop")                  # none | drop | ends | summary
+CONTEXT_BUDGET     = int(os.getenv("AG_CONTEXT_BUDGET", "0"))         # prompt tokens, 0: from model window
+CONTEXT_RESERVE    = int(os.getenv("AG_CONTEXT_RESERVE", "4096"))     # tokens left for the reply
+CONTEXT_KEEP_FIRST = int(os.getenv("AG_CONTEXT_KEEP_FIRST", "2"))     # turns kept by the "ends" strategy
+
+# session history in git (see chat_fs.git_commit)
+GIT_MODE = os.getenv("AG_GIT", "sync")   # sync | background | defer | off
+
+# live replies (ask --live)
+FSYNC_INTERVAL = float(os.getenv("AG_FSYNC_INTERVAL", "1"))   # seconds between fsyncs of the session file
+
+# semantic recall (ask / re --recall K)
+EMBED_MODEL   = os.getenv("AG_EMBED_MODEL", "text-embedding-3-small")  # "hash": local, no network
+RECALL_TOKENS = int(os.getenv("AG_RECALL_TOKENS", "2000"))            # most recalled text put in a prompt
@@ -0,0 +1,188 @@
+"""
+fit chat messages into the model's context window
+
+strategies (applied only when the estimate is over budget; a model not in
+MODEL_WINDOWS has no budget unless $AG_CONTEXT_BUDGET sets one):
+  none     send everything
+  drop     drop the oldest turns
+  ends     keep the first N turns and as many of the latest as fit
+  summary  replace the dropped turns with a rolling summary (cached in ~/.ag/summaries)
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+import hashlib, json, re
+
+SUMMARY_DIR    = Path.home() / ".ag" / "summaries"
+SUMMARY_HEAD   = "Summary of the earlier conversation:\n"
+SUMMARY_TOKENS = 512  # room kept for the summary message itself
+STRATEGIES     = ("none", "drop", "ends", "summary")
+
+# context window per model family, longest prefix wins
+MODEL_WINDOWS = {
+    "gpt-4o": 128000,
+    "gpt-4.1": 1000000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+    "claude": 200000,
+    "deepseek": 64000,
+}
+DEFAULT_WINDOW = None  # unknown model: its window is the server's business, send everything
+
+TOKEN_RE = re.compile(r"[A-Za-z]+|\d{1,3}|\S")
+
+def estimate_tokens(text: str) -> int:
+    """rough BPE-like count: a token per word (long words count more), digit group or symbol"""
+    n = 0
+    for tok in TOKEN_RE.findall(text):
+        n += 1 + len(tok) // 8
+    return n
+
+def message_tokens(msg: Dict[str, Any]) -> int:
+    n = 4 + estimate_tokens(msg.get("content") or "")  # role and framing overhead
+    if msg.get("tool_calls"):
+        n += estimate_tokens(json.dumps(msg["tool_calls"]))
+    return n
+
+def model_budget(model: str | None = None) -> int | None:
+    """tokens available for the prompt: context window minus room for the reply, None: no limit"""
+    # config loads .env, keep it out of import time (see cli)
+    from .config import DEFAULT_MODEL, CONTEXT_BUDGET, CONTEXT_RESERVE
+    model = model or DEFAULT_MODEL
+    if CONTEXT_BUDGET:
+        return CONTEXT_BUDGET
+    window = DEFAULT_WINDOW
+    for prefix in sorted(MODEL_WINDOWS, key=len, reverse=True):
+        if model.split("/")[-1].startswith(prefix):
+            window = MODEL_WINDOWS[prefix]
+            break
+    if window is None:
+        return None
+    return max(window - CONTEXT_RESERVE, window // 2)
+
+def _is_summary(msg: Dict[str, str]) -> bool:
+    return msg["role"] == "system" and msg["content"].startswith(SUMMARY_HEAD)
+
+def _drop_oldest(turns: List[Dict[str, str]], budget: int, keep_first: int = 0) -> tuple[list, list]:
+    """drop turns after the first <keep_first> until the rest fits, return (kept, dropped)"""
+    kept = list(turns)
+    dropped: list = []
+    total = sum(message_tokens(m) for m in kept)
+    while total > budget and len(kept) > keep_first + 1:
+        m = kept.pop(keep_first)
+        dropped.append(m)
+        total -= message_tokens(m)
+    # don't open the window on an orphaned reply
+    while len(kept) > keep_first + 1 and kept[keep_first]["role"] == "assistant":
+        dropped.append(kept.pop(keep_first))
+    return kept, dropped
+
+def _chain(turns: List[Dict[str, str]]) -> list[str]:
+    """hash of every prefix: chain[i] covers turns[:i + 1]"""
+    out, h = [], ""
+    for m in turns:
+        h = hashlib.sha256(f"{h}\0{m['role']}\0{m['content']}".encode("utf-8")).hexdigest()
+        out.append(h)
+    return out
+
+def rolling_summary(turns: List[Dict[str, str]], summarize: Callable[[str], str]) -> str:
+    """
+    summary of <turns>, reusing the longest already summarized prefix
+
+    summaries are cached by the hash chain of the turns they cover, so a
+    session that keeps growing only summarizes the newly dropped turns
+    """
+    chain = _chain(turns)
+    base, start = "", 0
+    for i in range(len(chain) - 1, -1, -1):
+        cached = SUMMARY_DIR / f"{chain[i]}.txt"
+        if cached.exists():
+            base, start = cached.read_text(encoding="utf-8"), i + 1
+            break
+    if start == len(turns):
+        return base
+    parts = [f"(summary so far)\n{base}"] if base else []
+    for m in turns[start:]:
+        content = m["content"].removeprefix(SUMMARY_HEAD)
+        parts.append(f"{m['role']}:\n{content}")
+    summary = summarize("\n\n".join(parts)).strip()
+    SUMMARY_DIR.mkdir(parents=True, exist_ok=True)
+    (SUMMARY_DIR / f"{chain[-1]}.txt").write_text(summary, encoding="utf-8")
+    return summary
+
+def summarize_with_model(text: str) -> str:
+    """default summarizer: ask the configured model"""
+    from .api_client import send_message
+    return send_message([
+        {"role": "system", "content": (
+            "Summarize this conversation for your own later reference. Keep facts, "
+            "decisions, names, code identifiers and open questions; drop pleasantries. "
+            "Be concise."
+        )},
+        {"role": "user", "content": text},
+    ])
+
+def fit(
+        messages: List[Dict[str, str]],
+        strategy: str | None = None,
+        budget: int | None = None,
+        model: str | None = None,
+        keep_first: int | None = None,
+        summarize: Callable[[str], str] | None = summarize_with_model,
+        notice: Callable[[str], None] | None = None,
+) -> List[Dict[str, str]]:
+    """
+    return <messages> trimmed to the budget with <strategy>
+
+    leading system prompts are always kept, and so is the last turn
+    notice: told in one line whenever turns were dropped
+    """
+    from .config import CONTEXT_STRATEGY, CONTEXT_KEEP_FIRST
+    strategy = strategy or CONTEXT_STRATEGY
+    keep_first = CONTEXT_KEEP_FIRST if keep_first is None else keep_first
+    if strategy not in STRATEGIES:
+        raise ValueError(f"unknown context strategy '{strategy}', use one of {', '.join(STRATEGIES)}")
+    budget = budget or model_budget(model)
+    if budget is None:
+        return list(messages)
+
+    pinned: list = []
+    for m in messages:
+        if m["role"] != "system" or _is_summary(m):
+            break
+        pinned.append(m)
+    turns = messages[len(pinned):]
+    room = budget - sum(message_tokens(m) for m in pinned)
+
+    if strategy == "none" or sum(message_tokens(m) for m in turns) <= room:
+        return list(messages)
+
+    def told(kept: list, how: str = "dropped") -> list:
+        if notice and len(kept) < len(turns):
+            notice(f"context: {how} {len(turns) - len(kept)} of {len(turns)} turns to fit "
+                   f"{budget} tokens ({strategy}; --context none sends them all)")
+        return kept
+
+    if strategy == "ends":
+        kept, _ = _drop_oldest(turns, room, keep_first)
+        if sum(message_tokens(m) for m in kept) > room:
+            kept, _ = _drop_oldest(kept, room)
+        return pinned + told(kept)
+
+    if strategy == "summary" and summarize is not None:
+        kept, dropped = _drop_oldest(turns, room - SUMMARY_TOKENS)
+        if dropped:
+            try:
+                summary = rolling_summary(dropped, summarize)
+            except Exception:
+                # summarizing is best effort, fall back to plain dropping
+                summary = ""
+            if summary:
+                return pinned + [{"role": "system", "content": SUMMARY_HEAD + summary}] + told(kept, "summarized")
+
+    kept, _ = _drop_oldest(turns, room)
+    return pinned + told(kept)
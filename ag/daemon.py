@@ -0,0 +1,284 @@
+"""
+`ag serve`: a resident ag process behind a Unix socket
+
+the daemon keeps what every fresh `ag` pays for again: imports, .env,
+the pooled (TLS) connections of the api client, prompt files and the
+catalog/search connections' schema set-up. thin `ag` invocations of
+FORWARD commands connect to ~/.ag/ag.sock ($AG_SOCKET), hand over their
+stdin/stdout/stderr file descriptors (SCM_RIGHTS) and wait for the exit
+status; the command runs on a daemon thread writing straight to the
+caller's terminal, so colours, streaming and pipes behave as in-process.
+
+the caller runs the command itself (transparent fallback) when there is
+no daemon, $AG_NO_DAEMON is set, its environment (API_KEY, BASE_URL,
+DEFAULT_MODEL, HOME, AG_*) differs from the daemon's, ag's code changed
+since the daemon started (the daemon then exits), or an `ask` is already
+running in the daemon (asks are one at a time: they set process-wide
+metrics state), or the ask may call tools (--tools, $AG_TOOLS): those
+resolve paths against the working directory, which is the caller's
+
+this module is the console entry point, so it imports nothing heavy
+until it knows where the command will run
+"""
+from pathlib import Path
+import json, os, socket, sys
+
+SOCKET  = Path(os.getenv("AG_SOCKET") or Path.home() / ".ag" / "ag.sock")
+LOG     = Path.home() / ".ag" / "serve.log"
+FORWARD = ("ask", "ls", "cat", "search")
+
+def fingerprint(env: os._Environ | dict) -> dict:
+    """what a command's result depends on besides its arguments"""
+    keys = ("API_KEY", "BASE_URL", "DEFAULT_MODEL", "HOME")
+    pkg = Path(__file__).parent
+    code = max(p.stat().st_mtime_ns for p in pkg.glob("*.py"))
+    return {
+        "env": {k: v for k, v in env.items() if k in keys or (k.startswith("AG_") and k != "AG_SOCKET")},
+        "code": code,
+    }
+
+# -- client --------------------------------------------------------------
+
+def _tools(argv: list[str]) -> bool:
+    return any(a == "--tools" or a.startswith("--tools=") for a in argv)
+
+def forward(argv: list[str]) -> int | None:
+    """run argv in the daemon, return its exit status, None to run it here"""
+    if not argv or argv[0] not in FORWARD or os.getenv("AG_NO_DAEMON") or not SOCKET.exists():
+        return None
+    if _tools(argv):
+        return None  # tools work in the caller's directory, not the daemon's
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(SOCKET))
+    except OSError:
+        conn.close()
+        return None
+    with conn:
+        header = json.dumps({"argv": argv, **fingerprint(os.environ)}).encode() + b"\n"
+        try:
+            socket.send_fds(conn, [header], [0, 1, 2])
+        except OSError:
+            return None
+        reply = b""
+        interrupted = False
+        while not reply.endswith(b"\n"):
+            try:
+                chunk = conn.recv(4096)
+            except KeyboardInterrupt:
+                if interrupted:
+                    return 130
+                interrupted = True
+                conn.sendall(b"INT\n")  # delivered to the command as KeyboardInterrupt
+                continue
+            if not chunk:
+                return None if not reply else 1
+            reply += chunk
+    msg = json.loads(reply)
+    return None if "fallback" in msg else msg["exit"]
+
+def main() -> None:
+    """console entry: hand the command to `ag serve` if one runs, else run it here"""
+    code = forward(sys.argv[1:])
+    if code is not None:
+        sys.exit(code)
+    from .cli import cli
+    cli(prog_name="ag")
+
+# -- server --------------------------------------------------------------
+
+class _ThreadStream:
+    """stand-in for sys.stdin/out/err: each request thread sees its caller's stream"""
+    def __init__(self, local, name: str, default) -> None:
+        self._local = local
+        self._name = name
+        self._default = default
+
+    def _stream(self):
+        return getattr(self._local, self._name, None) or self._default
+
+    @property
+    def encoding(self) -> str:
+        return "utf-8"  # keeps click from re-wrapping the proxy
+
+    def __getattr__(self, attr):
+        return getattr(self._stream(), attr)
+
+    def __iter__(self):
+        return iter(self._stream())
+
+def serve(detach: bool = False) -> None:
+    import ctypes, io, threading, time, traceback
+    # before anything loads .env: callers compare against the plain environment
+    ident = fingerprint(os.environ)
+
+    if detach:
+        if os.fork():
+            return
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        LOG.parent.mkdir(parents=True, exist_ok=True)
+        log = os.open(LOG, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        null = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null, 0)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+
+    # warm up: what a cold `ag ask` spends its first 100+ ms on
+    from .cli import cli
+    from . import api_client, metrics, config
+    api_client.get_client()
+    base_tags, base_verbose = dict(metrics.tags), metrics.verbose
+
+    local = threading.local()
+    sys.stdin = _ThreadStream(local, "stdin", sys.stdin)
+    sys.stdout = _ThreadStream(local, "stdout", sys.stdout)
+    sys.stderr = _ThreadStream(local, "stderr", sys.stderr)
+    ask_lock = threading.Lock()
+    stop = threading.Event()
+
+    def say(msg: str) -> None:
+        print(time.strftime("%Y-%m-%d %H:%M:%S"), msg, file=sys.__stderr__, flush=True)
+
+    def reply(conn: socket.socket, obj: dict) -> None:
+        try:
+            conn.sendall(json.dumps(obj).encode() + b"\n")
+        except OSError:
+            pass
+
+    def watch(conn: socket.socket, thread_id: int, done: threading.Event) -> None:
+        # the caller's Ctrl-C
+        while not done.is_set():
+            try:
+                data = conn.recv(64)
+            except OSError:
+                return
+            if not data:
+                return
+            if b"INT" in data and not done.is_set():
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(KeyboardInterrupt))
+
+    def handle(conn: socket.socket) -> None:
+        fds: list[int] = []
+        with conn:
+            try:
+                data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 3)
+                while not data.endswith(b"\n"):
+                    more = conn.recv(1 << 16)
+                    if not more:
+                        raise ConnectionError("caller went away")
+                    data += more
+                req = json.loads(data)
+            except (OSError, ValueError) as e:
+                for fd in fds:
+                    os.close(fd)
+                say(f"bad request: {e}")
+                return
+            if req.get("cmd") == "stop":
+                reply(conn, {"exit": 0})
+                stop.set()
+                return
+            if req.get("code") != ident["code"]:
+                reply(conn, {"fallback": "code changed"})
+                for fd in fds:
+                    os.close(fd)
+                say("ag's code changed, exiting; restart with `ag serve`")
+                stop.set()
+                return
+            if req.get("env") != ident["env"] or len(fds) != 3:
+                reply(conn, {"fallback": "environment differs"})
+                for fd in fds:
+                    os.close(fd)
+                return
+            argv = req["argv"]
+            is_ask = argv[0] == "ask"
+            if is_ask and config.TOOLS:
+                reply(conn, {"fallback": "tools"})  # $AG_TOOLS (maybe from .env): the caller's directory
+                for fd in fds:
+                    os.close(fd)
+                return
+            if is_ask and not ask_lock.acquire(blocking=False):
+                reply(conn, {"fallback": "busy"})
+                for fd in fds:
+                    os.close(fd)
+                return
+            try:
+                local.stdin = io.TextIOWrapper(io.FileIO(fds[0], "r"), encoding="utf-8", errors="replace")
+                local.stdout = io.TextIOWrapper(io.FileIO(fds[1], "w"), encoding="utf-8", errors="replace", write_through=True)
+                local.stderr = io.TextIOWrapper(io.FileIO(fds[2], "w"), encoding="utf-8", errors="replace", write_through=True)
+                if is_ask:
+                    metrics.tags.clear()
+                    metrics.tags.update(base_tags)
+                    metrics.verbose = base_verbose
+                done = threading.Event()
+                threading.Thread(target=watch, args=(conn, threading.get_ident(), done), daemon=True).start()
+                code = 0
+                try:
+                    cli.main(args=argv, prog_name="ag", standalone_mode=True)
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                except KeyboardInterrupt:
+                    code = 130
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                finally:
+                    done.set()
+                    for stream in (local.stdin, local.stdout, local.stderr):
+                        try:
+                            stream.close()
+                        except OSError:
+                            pass
+                    local.stdin = local.stdout = local.stderr = None
+                reply(conn, {"exit": code})
+            finally:
+                if is_ask:
+                    ask_lock.release()
+
+    SOCKET.parent.mkdir(parents=True, exist_ok=True)
+    if SOCKET.exists():
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(SOCKET))
+            probe.close()
+            raise SystemExit(f"ag serve is already running on {SOCKET}")
+        except ConnectionRefusedError:
+            SOCKET.unlink()  # left behind by a daemon that died
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(str(SOCKET))
+    finally:
+        os.umask(old_umask)
+    server.listen(16)
+    server.settimeout(0.5)
+    say(f"ag serve listening on {SOCKET} (pid {os.getpid()})")
+    try:
+        while not stop.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        SOCKET.unlink(missing_ok=True)
+        say("ag serve stopped")
+    if detach:
+        sys.exit(0)  # the background child must not return into the cli
+
+def stop_daemon() -> bool:
+    """ask a running daemon to exit, False if none answered"""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(str(SOCKET))
+        conn.sendall(json.dumps({"cmd": "stop"}).encode() + b"\n")
+        return bool(conn.recv(64))
+    except OSError:
+        return False
+    finally:
+        conn.close()
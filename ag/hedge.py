@@ -0,0 +1,149 @@
+"""
+hedged requests: cut tail latency with a backup request
+
+the primary request (BASE_URL / DEFAULT_MODEL) starts at once; if it
+hasn't produced a token after the hedge threshold, or fails, the same
+request goes to the backup ($AG_HEDGE_URL / $AG_HEDGE_MODEL). the first
+stream to yield a token wins and the other one is cancelled: its socket
+is shut down, so even a request still waiting for headers ends at once.
+"race" mode starts both immediately.
+
+the threshold is $AG_HEDGE_AFTER_MS, or, when that is 0, the p95 time to
+first token of the primary's recent requests in the metrics log, so
+only about one request in twenty is hedged
+"""
+from typing import Dict, Iterator, List
+import queue, socket, threading, time
+from .api_client import Client, _connect, get_client
+from .cache import ResponseCache
+from .config import HEDGE_URL, HEDGE_MODEL, HEDGE_API_KEY, HEDGE_AFTER_MS, CACHE_ENABLED
+from . import metrics
+
+DEFAULT_AFTER_MS = 2000   # until there are enough samples
+MIN_AFTER_MS     = 250
+MAX_AFTER_MS     = 10000
+MIN_SAMPLES      = 20
+
+_backup: Client | None = None
+
+def backup_client() -> Client:
+    global _backup
+    if _backup is None:
+        _backup = Client(base_url=HEDGE_URL, api_key=HEDGE_API_KEY, model=HEDGE_MODEL,
+                         cache=ResponseCache() if CACHE_ENABLED else None, route="backup")
+    return _backup
+
+def threshold(client: Client) -> float:
+    """seconds to wait for the primary's first token before hedging"""
+    if HEDGE_AFTER_MS:
+        return HEDGE_AFTER_MS / 1000
+    ttft = [r["ttft_ms"] for r in metrics.recent(client.base_url, client.model) if r.get("ttft_ms")]
+    if len(ttft) < MIN_SAMPLES:
+        return DEFAULT_AFTER_MS / 1000
+    return min(max(metrics.percentile(ttft, 95), MIN_AFTER_MS), MAX_AFTER_MS) / 1000
+
+class _Racer(threading.Thread):
+    """runs one stream, hands (racer, delta | None at the end | exception) to the queue"""
+    def __init__(self, client: Client, message: List[Dict[str, str]], timeout: float | None,
+                 use_cache: bool, out: queue.Queue, route: str | None = None) -> None:
+        super().__init__(daemon=True)
+        self.client = client
+        self.route = route
+        self.args = (message, timeout, use_cache)
+        self.out = out
+        self.cancel = threading.Event()
+        self.conn = None
+        self.done = False
+
+    def run(self) -> None:
+        _connect.watch = self.watch
+        message, timeout, use_cache = self.args
+        gen = self.client.stream(message, timeout=timeout, use_cache=use_cache, cancel=self.cancel,
+                                 route=self.route)
+        try:
+            for delta in gen:
+                if self.cancel.is_set():
+                    break
+                self.out.put((self, delta))
+        except BaseException as e:
+            self.out.put((self, e))
+            return
+        finally:
+            gen.close()
+            self.done = True
+        self.out.put((self, None))
+
+    def watch(self, conn) -> None:
+        self.conn = conn
+        if self.cancel.is_set():
+            self.cut()
+
+    def stop(self) -> None:
+        self.cancel.set()
+        if not self.done:
+            self.cut()
+
+    def cut(self) -> None:
+        sock = getattr(self.conn, "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+def hedged_stream(
+        message: List[Dict[str, str]],
+        timeout: float | None = None,
+        use_cache: bool = True,
+        race: bool = False,
+) -> Iterator[str]:
+    """yield the deltas of whichever of primary / backup answers first"""
+    primary = get_client()  # shared: the route label goes with this request only
+    out: queue.Queue = queue.Queue()
+    racers = [_Racer(primary, message, timeout, use_cache, out, primary.route or "primary")]
+    racers[0].start()
+    fire_at = time.monotonic() + (0 if race else threshold(primary))
+    winner: _Racer | None = None
+    failed: list[BaseException] = []
+
+    def fire_backup() -> None:
+        racer = _Racer(backup_client(), message, timeout, use_cache, out)
+        racers.append(racer)
+        racer.start()
+
+    try:
+        while True:
+            if winner is None and len(racers) == 1:
+                wait = fire_at - time.monotonic()
+                if wait <= 0:
+                    fire_backup()
+                    continue
+                try:
+                    racer, item = out.get(timeout=wait)
+                except queue.Empty:
+                    continue
+            else:
+                racer, item = out.get()
+
+            if winner is not None and racer is not winner:
+                continue
+            if isinstance(item, BaseException):
+                if winner is not None:
+                    raise item
+                failed.append(item)
+                if len(racers) == 1:
+                    fire_backup()  # fail over without waiting
+                elif len(failed) == len(racers):
+                    raise failed[0]
+                continue
+            if winner is None:
+                winner = racer
+                for other in racers:
+                    if other is not winner:
+                        other.stop()
+            if item is None:
+                return
+            yield item
+    finally:
+        for racer in racers:
+            racer.stop()
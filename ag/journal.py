@@ -0,0 +1,59 @@
+"""
+write-ahead journal for REPL turns
+
+every finished turn is appended (and fsynced) to
+~/.ag/journal/repl-<pid>-<time>.jsonl, so a crashed REPL loses nothing;
+journals whose process is gone are offered back by `ag re --recover`
+"""
+from pathlib import Path
+import json, os, time
+
+JOURNAL_DIR = Path.home() / ".ag" / "journal"
+
+class ReplJournal:
+    def __init__(self) -> None:
+        JOURNAL_DIR.mkdir(parents=True, exist_ok=True)
+        self.path = JOURNAL_DIR / f"repl-{os.getpid()}-{int(time.time())}.jsonl"
+        self.file = self.path.open("a", encoding="utf-8")
+
+    def append(self, question: str, reply: str, model: str | None = None) -> None:
+        self.file.write(json.dumps({"q": question, "reply": reply, "model": model, "ts": time.time()}) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def discard(self) -> None:
+        self.file.close()
+        self.path.unlink(missing_ok=True)
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def orphans() -> list[Path]:
+    """journals left behind by REPLs that are no longer running"""
+    if not JOURNAL_DIR.is_dir():
+        return []
+    out = []
+    for p in sorted(JOURNAL_DIR.glob("repl-*.jsonl")):
+        try:
+            pid = int(p.stem.split("-")[1])
+        except (IndexError, ValueError):
+            continue
+        if not _alive(pid):
+            out.append(p)
+    return out
+
+def load(path: Path) -> list[dict]:
+    """turns of a journal; a torn last line (crash mid-write) is skipped"""
+    turns = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            turns.append(json.loads(line))
+        except ValueError:
+            continue
+    return turns
@@ -0,0 +1,85 @@
+"""
+on-disk layout of the chat dir
+
+flat:     CHAT_DIR/NAME.md (directories made before sharding)
+sharded:  CHAT_DIR/ab/NAME.md, ab = first two hex digits of sha1(NAME),
+          so no directory holds more than ~1/256 of the sessions
+
+CHAT_DIR/.layout says which ("sharded", or "migrating" while `ag
+migrate` moves the files over; absent: flat). a new chat dir starts out
+sharded. during a migration a session can be in either place, so
+lookups try the shard first, and writers never create a session file by
+appending (see chat_fs): a file moved away under them is looked up again
+"""
+from pathlib import Path
+import hashlib, os
+
+SHARD_LEN   = 2
+LAYOUT_FILE = ".layout"
+FLAT, MIGRATING, SHARDED = "flat", "migrating", "sharded"
+
+_known: dict[Path, str] = {}  # a sharded dir never goes back, the rest is re-read
+
+def current(chat_dir: Path) -> str:
+    if _known.get(chat_dir) == SHARDED:
+        return SHARDED
+    try:
+        state = (chat_dir / LAYOUT_FILE).read_text().strip() or FLAT
+    except FileNotFoundError:
+        state = FLAT
+    _known[chat_dir] = state
+    return state
+
+def set_state(chat_dir: Path, state: str) -> None:
+    tmp = chat_dir / (LAYOUT_FILE + ".tmp")
+    tmp.write_text(state + "\n")
+    os.replace(tmp, chat_dir / LAYOUT_FILE)
+    _known[chat_dir] = state
+
+def shard(name: str) -> str:
+    return hashlib.sha1(name.encode("utf-8")).hexdigest()[:SHARD_LEN]
+
+def path(chat_dir: Path, name: str) -> Path:
+    """where session <name> is (or would be created)"""
+    state = current(chat_dir)
+    sharded = chat_dir / shard(name) / f"{name}.md"
+    if state == SHARDED:
+        return sharded
+    flat = chat_dir / f"{name}.md"
+    if state == FLAT:
+        return flat
+    return flat if not sharded.exists() and flat.exists() else sharded
+
+def _is_shard(entry: os.DirEntry) -> bool:
+    return len(entry.name) == SHARD_LEN and entry.is_dir() and not entry.name.startswith(".")
+
+def scan(chat_dir: Path) -> dict[str, Path]:
+    """name -> path of every session, in either layout"""
+    out: dict[str, Path] = {}
+    shards = []
+    with os.scandir(chat_dir) as it:
+        for e in it:
+            if e.name.endswith(".md") and e.is_file():
+                out[e.name[:-3]] = Path(e.path)
+            elif _is_shard(e):
+                shards.append(e.path)
+    for d in shards:
+        with os.scandir(d) as it:
+            for e in it:
+                if e.name.endswith(".md"):
+                    out[e.name[:-3]] = Path(e.path)  # a shard copy wins over a flat one
+    return out
+
+def dir_mtime(chat_dir: Path) -> float:
+    """
+    latest mtime of chat_dir and its shards: changes whenever a session
+    file is created, renamed or removed anywhere in the layout
+    """
+    latest = chat_dir.stat().st_mtime
+    if current(chat_dir) == FLAT:
+        return latest
+    with os.scandir(chat_dir) as it:
+        for e in it:
+            if _is_shard(e):
+                latest = max(latest, e.stat().st_mtime)
+    return latest
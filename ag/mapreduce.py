@@ -0,0 +1,192 @@
+"""
+map-reduce over an input too big for one request
+
+the input is read a line (at most LINE_MAX characters) at a time and cut
+into chunks of about <chunk_tokens> tokens: at the last blank line when
+that leaves the chunk at least 3/4 full, else at a line end; a line
+longer than a chunk is cut anywhere. at most <jobs> chunks are in memory
+or in flight at once. each chunk is sent with the map prompt, then the
+answers are combined with the reduce prompt, as many at a time as fit
+in a chunk, level by level until one is left
+
+every answer is kept in ~/.ag/mapreduce/ under the hash of the request
+that produced it until the whole run has succeeded, so running the same
+command again after a failure or Ctrl-C sends only what is missing
+"""
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List
+import asyncio, hashlib, json, os
+from .api_client import AsyncClient, APIError
+from .context import estimate_tokens
+
+MR_DIR   = Path.home() / ".ag" / "mapreduce"
+LINE_MAX = 64 * 1024  # characters read at once: a file without newlines still streams
+
+DEFAULT_MAP = (
+    "This is one part of a longer input. Summarize it: keep facts, names, numbers, "
+    "errors and anything unusual."
+)
+REDUCE_HEAD = (
+    "Below are answers to a task for consecutive parts of one long input, in order. "
+    "Combine them into a single answer for the whole input: merge repeats, keep every "
+    "distinct point, and keep the order where it matters. The task was:\n\n"
+)
+
+Progress = Callable[[str, int, int | None, int], None]  # (stage, done, total, resumed)
+
+def read_lines(f) -> Iterator[str]:
+    return iter(lambda: f.readline(LINE_MAX), "")
+
+def chunks(lines: Iterable[str], max_tokens: int) -> Iterator[str]:
+    """<lines> (newlines kept) joined into chunks of at most ~<max_tokens>"""
+    buf: List[str] = []
+    size = 0
+    cut = cut_size = 0  # buf[:cut] ends with a blank line, cut_size tokens
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if cost > max_tokens:
+            # a line of its own bigger than a chunk: flush, then cut it by characters
+            if buf:
+                yield "".join(buf)
+            step = max(1, len(line) * max_tokens // cost)
+            pieces = [line[i:i + step] for i in range(0, len(line), step)]
+            yield from pieces[:-1]
+            line = pieces[-1]
+            buf, size, cut, cut_size = [], 0, 0, 0
+            cost = estimate_tokens(line) + 1
+        if size + cost > max_tokens and buf:
+            if cut and cut_size * 4 >= max_tokens * 3:
+                yield "".join(buf[:cut])
+                buf, size = buf[cut:], size - cut_size
+            else:
+                yield "".join(buf)
+                buf, size = [], 0
+            cut = cut_size = 0
+        buf.append(line)
+        size += cost
+        if not line.strip():
+            cut, cut_size = len(buf), size
+    if buf and any(line.strip() for line in buf):
+        yield "".join(buf)
+
+def _key(model: str, messages: List[Dict[str, str]]) -> str:
+    return hashlib.sha256(json.dumps([model, messages], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def _load(key: str) -> str | None:
+    try:
+        return (MR_DIR / f"{key}.txt").read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+
+def _save(key: str, text: str) -> None:
+    MR_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = MR_DIR / f"{key}.{os.getpid()}.tmp"
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, MR_DIR / f"{key}.txt")
+
+def _groups(answers: List[tuple[str, str]], max_tokens: int) -> List[List[tuple[str, str]]]:
+    """consecutive (label, answer) runs that fit in one reduce request, two at the least"""
+    groups: List[List[tuple[str, str]]] = []
+    size = 0
+    for item in answers:
+        cost = estimate_tokens(item[1]) + 8
+        if groups and (size + cost <= max_tokens or len(groups[-1]) < 2):
+            groups[-1].append(item)
+            size += cost
+        else:
+            groups.append([item])
+            size = cost
+    if len(groups) > 1 and len(groups[-1]) < 2:
+        groups[-2] += groups.pop()  # a lone answer left over isn't a reduction
+    return groups
+
+def _span(group: List[tuple[str, str]]) -> str:
+    first, last = group[0][0].split("-")[0], group[-1][0].split("-")[-1]
+    return first if first == last else f"{first}-{last}"
+
+async def map_reduce(
+        lines: Iterable[str],
+        map_prompt: str,
+        reduce_prompt: str | None = None,
+        chunk_tokens: int = 4000,
+        jobs: int = 8,
+        use_cache: bool = True,
+        progress: Progress | None = None,
+) -> tuple[str, int]:
+    """
+    the reduced answer for the input <lines>, and how many chunks it had
+    reduce_prompt: default REDUCE_HEAD + map_prompt
+    raise APIError when a request failed for good; answers that came
+    back are kept for the next run
+    """
+    reduce_prompt = reduce_prompt or REDUCE_HEAD + map_prompt
+    report = progress or (lambda *args: None)
+    keys: List[str] = []
+    done = resumed = 0
+
+    async with AsyncClient(concurrency=jobs) as client:
+        model = client.client.model
+
+        async def ask(messages: List[Dict[str, str]]) -> str:
+            nonlocal resumed
+            key = _key(model, messages)
+            keys.append(key)
+            answer = _load(key)
+            if answer is not None:
+                resumed += 1
+                return answer
+            answer = await client.chat(messages, use_cache=use_cache)
+            _save(key, answer)
+            return answer
+
+        # map: read ahead only as far as there are free slots
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(jobs)
+        source = chunks(lines, chunk_tokens)
+        tasks: List[asyncio.Task] = []
+
+        async def map_one(i: int, chunk: str) -> str:
+            nonlocal done
+            try:
+                return await ask([{"role": "system", "content": map_prompt},
+                                  {"role": "user", "content": f"Part {i + 1} of the input:\n\n{chunk}"}])
+            finally:
+                slots.release()
+                done += 1
+                report("map", done, None, resumed)
+
+        while True:
+            await slots.acquire()
+            chunk = await loop.run_in_executor(None, next, source, None)  # stdin may block
+            if chunk is None:
+                break
+            tasks.append(asyncio.create_task(map_one(len(tasks), chunk)))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        total = len(tasks)
+        report("map", done, total, resumed)
+        failed = [r for r in results if isinstance(r, BaseException)]
+        if failed:
+            raise APIError(f"{len(failed)} of {total} parts failed, first: {failed[0]}")
+        if not results:
+            raise APIError("empty input")
+
+        # reduce, level by level
+        level = [(str(i + 1), answer) for i, answer in enumerate(results)]
+        while len(level) > 1:
+            groups = _groups(level, chunk_tokens)
+            done = 0
+
+            async def reduce_one(group: List[tuple[str, str]]) -> tuple[str, str]:
+                nonlocal done
+                text = "\n\n".join(f"--- part {label} ---\n{answer}" for label, answer in group)
+                answer = await ask([{"role": "system", "content": reduce_prompt},
+                                    {"role": "user", "content": text}])
+                done += 1
+                report("reduce", done, len(groups), resumed)
+                return _span(group), answer
+
+            level = list(await asyncio.gather(*(reduce_one(g) for g in groups)))
+
+    for key in keys:
+        (MR_DIR / f"{key}.txt").unlink(missing_ok=True)
+    return level[0][1], total
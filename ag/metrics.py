@@ -0,0 +1,157 @@
+"""
+per-request metrics: an append-only JSON-lines log in ~/.ag/metrics.jsonl
+
+one record per model request (cache hits included, flagged "cached";
+hedge losers flagged "cancelled", cassette replays "replayed"): ts, url, model, route, status, error,
+stream, queued_ms, retries, tool_calls, connect_ms, ttfb_ms, ttft_ms, total_ms,
+prompt_tokens, completion_tokens, tok_s, plus the tags set by
+the running command (session, command); each record is a single
+O_APPEND write, so concurrent ag processes don't interleave lines
+
+$AG_METRICS=0 turns logging off, $AG_TIMING=1 (or --timing) prints a
+timing line per request to stderr
+"""
+from pathlib import Path
+import json, os, re, sys, time
+
+METRICS_LOG = Path.home() / ".ag" / "metrics.jsonl"
+
+verbose = False  # --timing, set by the cli; $AG_TIMING turns it on too
+tags: dict[str, str] = {}  # merged into every record, set by the cli
+
+def record(rec: dict) -> None:
+    from . import config  # not at import: the cli loads this module for local commands too
+    rec = {**tags, **rec}
+    if verbose or config.TIMING:
+        print(describe(rec), file=sys.stderr, flush=True)
+    if not config.METRICS:
+        return
+    line = (json.dumps(rec, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+    try:
+        METRICS_LOG.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(METRICS_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass  # metrics must never fail a request
+
+def describe(rec: dict) -> str:
+    """one-line timing summary"""
+    def ms(key: str) -> str:
+        v = rec.get(key)
+        return f"{key[:-3]} {v:.0f}ms" if v is not None else ""
+    state = "cache" if rec.get("cached") else "cancelled" if rec.get("cancelled") else str(rec.get("status") or "error")
+    if rec.get("replayed"):
+        state += " replay"
+    parts = [rec.get("model") or "?", state]
+    parts += [ms("queued_ms"), ms("connect_ms"), ms("ttfb_ms"), ms("ttft_ms"), ms("total_ms")]
+    if rec.get("retries"):
+        parts.append(f"{rec['retries']} retries")
+    if rec.get("tool_calls"):
+        parts.append(f"{rec['tool_calls']} tool calls")
+    if rec.get("tok_s"):
+        parts.append(f"{rec['tok_s']:.1f} tok/s")
+    if rec.get("prompt_tokens") is not None:
+        est = "~" if rec.get("estimated") else ""
+        parts.append(f"in {est}{rec['prompt_tokens']} out {est}{rec.get('completion_tokens', 0)}")
+    if rec.get("error"):
+        parts.append(rec["error"][:80])
+    return "[ag] " + "  ".join(p for p in parts if p)
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+def parse_window(text: str) -> float:
+    """"90m", "24h", "7d", "2w" -> seconds"""
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*", text)
+    if not m:
+        raise ValueError(f"bad time window '{text}' (use e.g. 30m, 24h, 7d, 2w)")
+    return float(m.group(1)) * UNITS[m.group(2)]
+
+def load(since: float | None = None) -> list[dict]:
+    """records with ts >= since, oldest first; unreadable lines are skipped"""
+    if not METRICS_LOG.exists():
+        return []
+    out = []
+    with METRICS_LOG.open("rb") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if since is None or rec.get("ts", 0) >= since:
+                out.append(rec)
+    return out
+
+def recent(url: str, model: str, n: int = 200, tail_bytes: int = 256 * 1024) -> list[dict]:
+    """
+    the last <n> successful, uncached, live requests to one endpoint + model,
+    read from the end of the log only
+    """
+    try:
+        with METRICS_LOG.open("rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - tail_bytes))
+            lines = f.read().splitlines()[1 if size > tail_bytes else 0:]
+    except OSError:
+        return []
+    out = []
+    for line in reversed(lines):
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if (rec.get("url") == url and rec.get("model") == model and not rec.get("error")
+                and not rec.get("cached") and not rec.get("cancelled") and not rec.get("replayed")):
+            out.append(rec)
+            if len(out) == n:
+                break
+    return out
+
+def percentile(values: list[float], p: float) -> float | None:
+    """linear-interpolated percentile of unsorted values, None if empty"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return round(values[lo] + (values[hi] - values[lo]) * (k - lo), 2)
+
+GROUPS = {
+    "model":    lambda r: r.get("model") or "?",
+    "endpoint": lambda r: f"{r.get('url') or '?'} {r.get('model') or '?'}",
+    "session":  lambda r: r.get("session") or "-",
+    "command":  lambda r: r.get("command") or "-",
+    "day":      lambda r: time.strftime("%Y-%m-%d", time.localtime(r.get("ts", 0))),
+    "hour":     lambda r: time.strftime("%Y-%m-%d %H:00", time.localtime(r.get("ts", 0))),
+}
+
+def summarize(records: list[dict], by: str = "model") -> list[dict]:
+    """per group: requests, errors, latency percentiles, token totals"""
+    groups: dict[str, list[dict]] = {}
+    for rec in records:
+        groups.setdefault(GROUPS[by](rec), []).append(rec)
+    rows = []
+    for key in sorted(groups):
+        recs = groups[key]
+        done = [r for r in recs if not r.get("cancelled")]
+        ok = [r for r in done if not r.get("error")]
+        total = [r["total_ms"] for r in ok if r.get("total_ms") is not None]
+        ttft = [r["ttft_ms"] for r in ok if r.get("ttft_ms") is not None]
+        rate = [r["tok_s"] for r in ok if r.get("tok_s")]
+        rows.append({
+            by:                  key,
+            "requests":          len(recs),
+            "errors":            len(done) - len(ok),
+            "cancelled":         len(recs) - len(done),
+            "p50_ms":            percentile(total, 50),
+            "p95_ms":            percentile(total, 95),
+            "p99_ms":            percentile(total, 99),
+            "ttft_p50_ms":       percentile(ttft, 50),
+            "tok_s_p50":         percentile(rate, 50),
+            "prompt_tokens":     sum(r.get("prompt_tokens") or 0 for r in recs),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in recs),
+        })
+    return rows
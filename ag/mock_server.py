@@ -0,0 +1,265 @@
+"""
+offline stand-in for an OpenAI-compatible /v1/chat/completions (and
+/v1/embeddings, answered with ag.recall's hashing embedder)
+
+for benchmarks and manual testing; every reply is <tokens> synthetic
+words, delivered after <latency> (headers) and <ttft> (first token) at
+<rate> tokens per second, optionally failing a share of requests
+
+with "tools" in the request, a user message with lines like
+  call read_file {"path": "setup.py"}
+is answered with those tool calls (all in one turn), and the tool
+results that come back with a reply listing what each returned
+
+  python -m ag.mock_server [--port 8765] [--latency 0] [--ttft 0] [--rate 0]
+                           [--tokens 64] [--chunk 1] [--split 0] [--framing chunked|close]
+                           [--error-rate 0] [--error-status 500] [--quota 0]
+
+  BASE_URL=http://127.0.0.1:8765 API_KEY=x ag ask ...
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse, json, math, random, subprocess, sys, threading, time
+
+DEFAULTS = {
+    "latency":      0.0,  # seconds before the response headers
+    "ttft":         0.0,  # seconds between the headers and the first token
+    "rate":         0.0,  # tokens per second after the first, 0 = as fast as possible
+    "tokens":       64,   # reply length
+    "chunk":        1,    # tokens per SSE event
+    "split":        0,    # cut the SSE byte stream into writes of at most this many bytes
+    "framing":      "chunked",  # or "close": no Transfer-Encoding, the body ends with the connection
+    "error_rate":   0.0,  # share of requests answered with error_status
+    "error_status": 500,
+    "quota":        0.0,  # requests per second (1 s burst) before answering 429 + Retry-After, 0 = none
+    "seed":         None,
+}
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+         "tempor incididunt ut labore et dolore magna aliqua").split()
+
+def reply_tokens(n: int) -> list[str]:
+    return [WORDS[i % len(WORDS)] + " " for i in range(n)]
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+    server: "MockServer"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            import gzip
+            body = gzip.decompress(body)
+        payload = json.loads(body or b"{}")
+        opts = self.server.opts
+        self.server.count()
+        time.sleep(opts["latency"])
+
+        embeddings = self.path.endswith("/embeddings")
+        if not embeddings and not self.path.endswith("/chat/completions"):
+            return self.send_json(404, {"error": {"message": f"no route {self.path}"}})
+        wait = self.server.over_quota()
+        if wait:
+            headers = {"Retry-After": str(math.ceil(wait)), "retry-after-ms": str(round(wait * 1000))}
+            return self.send_json(429, {"error": {"message": "quota exceeded", "code": 429}}, headers)
+        if opts["error_rate"] and self.server.rng.random() < opts["error_rate"]:
+            status = opts["error_status"]
+            headers = {"Retry-After": "1"} if status in (429, 503) else {}
+            return self.send_json(status, {"error": {"message": "injected failure", "code": status}}, headers)
+        if embeddings:
+            return self.embeddings(payload)
+        if payload.get("tools") and payload.get("tool_choice") != "none" and not payload.get("stream"):
+            message = self.tool_turn(payload)
+            if message:
+                time.sleep(opts["ttft"])
+                return self.send_json(200, {
+                    "id": "mock", "object": "chat.completion", "model": payload.get("model", "mock"),
+                    "choices": [{"index": 0, "message": message,
+                                 "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+                })
+
+        tokens = reply_tokens(opts["tokens"])
+        prompt = sum(len(str(m.get("content", "")).split()) for m in payload.get("messages", []))
+        usage = {"prompt_tokens": prompt, "completion_tokens": len(tokens), "total_tokens": prompt + len(tokens)}
+        model = payload.get("model", "mock")
+        if payload.get("stream"):
+            self.stream(tokens, model, usage, payload.get("stream_options", {}).get("include_usage"))
+        else:
+            time.sleep(opts["ttft"] + (len(tokens) / opts["rate"] if opts["rate"] else 0))
+            self.send_json(200, {
+                "id": "mock", "object": "chat.completion", "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    def tool_turn(self, payload: dict) -> dict | None:
+        """the tool calls a user message asks for, or the reply to tool results; None: a plain reply"""
+        messages = payload.get("messages") or [{}]
+        last = messages[-1]
+        if last.get("role") == "tool":
+            results = []
+            for m in reversed(messages):
+                if m.get("role") != "tool":
+                    break
+                first = (m.get("content") or "").strip().splitlines()[:1]
+                results.append(f"{m.get('tool_call_id')}: {first[0][:80] if first else ''}")
+            return {"role": "assistant", "content": "tool results:\n" + "\n".join(reversed(results))}
+        names = {t.get("function", {}).get("name") for t in payload["tools"]}
+        calls = []
+        for line in str(last.get("content") or "").splitlines():
+            words = line.strip().split(" ", 2)
+            if len(words) == 3 and words[0] == "call" and words[1] in names:
+                calls.append({"id": f"call_{len(calls)}", "type": "function",
+                              "function": {"name": words[1], "arguments": words[2]}})
+        return {"role": "assistant", "content": None, "tool_calls": calls} if calls else None
+
+    def embeddings(self, payload: dict) -> None:
+        from .recall import hash_embed  # what AG_EMBED_MODEL=hash computes locally
+        texts = payload.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        n = sum(len(t.split()) for t in texts)
+        self.send_json(200, {
+            "object": "list", "model": payload.get("model", "mock"),
+            "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(hash_embed(texts))],
+            "usage": {"prompt_tokens": n, "total_tokens": n},
+        })
+
+    def send_json(self, status: int, obj: dict, headers: dict | None = None) -> None:
+        out = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(out)
+
+    def stream(self, tokens: list[str], model: str, usage: dict, include_usage: bool) -> None:
+        opts = self.server.opts
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        if opts["framing"] == "close":
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        else:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(opts["ttft"])
+
+        def event(obj: dict | str) -> bytes:
+            data = obj if isinstance(obj, str) else json.dumps(obj)
+            return f"data: {data}\n\n".encode()
+
+        start = time.monotonic()
+        step = max(1, opts["chunk"])
+        for i in range(0, len(tokens), step):
+            if opts["rate"] and i:
+                # pace against the clock so sleep overshoot doesn't accumulate
+                delay = start + i / opts["rate"] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self.send_chunk(event({
+                "id": "mock", "object": "chat.completion.chunk", "model": model,
+                "choices": [{"index": 0, "delta": {"content": "".join(tokens[i:i + step])}, "finish_reason": None}],
+            }))
+        tail = event({"id": "mock", "object": "chat.completion.chunk", "model": model,
+                      "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if include_usage:
+            tail += event({"id": "mock", "object": "chat.completion.chunk", "model": model,
+                           "choices": [], "usage": usage})
+        self.send_chunk(tail + event("[DONE]"))
+        if opts["framing"] != "close":
+            self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def send_chunk(self, data: bytes) -> None:
+        split = self.server.opts["split"] or len(data)
+        close = self.server.opts["framing"] == "close"
+        for i in range(0, len(data), split):
+            part = data[i:i + split]
+            self.wfile.write(part if close else b"%x\r\n%s\r\n" % (len(part), part))
+            self.wfile.flush()
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, **opts) -> None:
+        unknown = opts.keys() - DEFAULTS.keys()
+        if unknown:
+            raise TypeError(f"unknown option(s): {', '.join(sorted(unknown))}")
+        self.opts = {**DEFAULTS, **opts}
+        self.rng = random.Random(self.opts["seed"])
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.bucket = (max(1.0, self.opts["quota"]), time.monotonic())  # (level, at)
+        super().__init__(("127.0.0.1", port), Handler)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self) -> None:
+        with self.lock:
+            self.requests += 1
+
+    def over_quota(self) -> float:
+        """0 to serve a request, else the seconds until the quota allows one"""
+        rate = self.opts["quota"]
+        if not rate:
+            return 0.0
+        with self.lock:
+            level, at = self.bucket
+            now = time.monotonic()
+            level = min(max(1.0, rate), level + (now - at) * rate)
+            if level >= 1:
+                self.bucket = (level - 1, now)
+                return 0.0
+            self.bucket = (level, now)
+            self.throttled += 1
+            return (1 - level) / rate
+
+def start(port: int = 0, **opts) -> MockServer:
+    """serve in a background thread; stop with server.shutdown()"""
+    server = MockServer(port, **opts)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def spawn(**opts) -> tuple[subprocess.Popen, str]:
+    """
+    serve from a child process (no GIL shared with the caller), return
+    (process, base url); terminate() the process when done
+    """
+    argv = [sys.executable, "-m", "ag.mock_server", "--port", "0"]
+    for key, value in opts.items():
+        if key not in DEFAULTS:
+            raise TypeError(f"unknown option: {key}")
+        argv += ["--" + key.replace("_", "-"), str(value)]
+    proc = subprocess.Popen(argv, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line:
+        proc.wait()
+        raise RuntimeError("mock server failed to start")
+    return proc, line.split()[-1]
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=8765)
+    for key, value in DEFAULTS.items():
+        if key != "seed":
+            ap.add_argument("--" + key.replace("_", "-"), type=type(value), default=value)
+    ap.add_argument("--seed", type=int, default=None)
+    opts = vars(ap.parse_args())
+    server = MockServer(opts.pop("port"), **opts)
+    print(f"mock server on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+client-side rate limiting and retries, shared by every ag process
+
+one small state file per endpoint + model, ~/.ag/ratelimit/<hash>.json,
+read and rewritten under flock when a request starts and when it ends:
+  req, tok, at  token buckets for $AG_RPM requests and $AG_TPM tokens a
+                minute, refilled continuously and holding at most
+                BURST_S seconds' worth, so a backlog drains at the quota
+                instead of in bursts that run into it
+  until         no request starts before this: a Retry-After holds back
+                every process, not only the one that was told
+  limit, cut    adaptive concurrency (AIMD): a throttled answer halves
+                the requests in flight (at most once per CUT_EVERY, a
+                burst of 429s is one signal), each success adds 1/limit;
+                dropped once it climbs past the ceiling
+  inflight      {pid: requests in flight}, dead pids are dropped
+
+a request is charged its estimated prompt tokens when it starts and its
+completion tokens when it ends, so the token bucket can go below zero
+and the next callers wait off the overshoot
+
+with no limit configured the file only appears with the first throttled
+answer; until then a request costs one stat()
+"""
+from pathlib import Path
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import fcntl, hashlib, json, os, random, threading, time
+from .config import RPM, TPM, MAX_INFLIGHT, RETRY_MAX
+
+RATE_DIR     = Path.home() / ".ag" / "ratelimit"
+RETRY_STATUS = (408, 429, 500, 502, 503, 504, 529)
+RETRY_BASE   = 0.5    # s, first backoff step without a Retry-After
+BURST_S      = 1      # bucket size, in seconds of quota (providers enforce per-minute quotas over shorter windows too)
+CUT_EVERY    = 1.0    # s
+CEILING      = 64     # an adaptive limit past this (or $AG_MAX_INFLIGHT) is dropped
+POLL_S       = 0.05   # a caller waiting for a free slot looks again after about this long
+
+def retry_after(headers) -> float | None:
+    """seconds the server asked for: retry-after-ms, or Retry-After in seconds or as a date"""
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return max(0.0, float(ms) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff(attempt: int, hint: float | None = None) -> float:
+    """
+    seconds before retry <attempt> (0-based): full jitter exponential
+    backoff, on top of the server's <hint> (Retry-After) if it gave one,
+    so the callers it turned away together don't all come back together
+    """
+    return (hint or 0.0) + random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt))
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # someone else's process
+    return True
+
+class Limiter:
+    """the shared limits of one endpoint + model"""
+    def __init__(self, base_url: str, model: str, rpm: int = RPM, tpm: int = TPM,
+                 max_inflight: int = MAX_INFLIGHT) -> None:
+        key = hashlib.sha1(f"{base_url}\0{model}".encode("utf-8")).hexdigest()[:16]
+        self.path = RATE_DIR / f"{key}.json"
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_inflight = max_inflight
+        self._held = 0  # this process' requests counted in the file
+        self._lock = threading.Lock()
+
+    def _active(self) -> bool:
+        return bool(self.rpm or self.tpm or self.max_inflight) or self.path.exists()
+
+    @contextmanager
+    def _state(self):
+        """the state, locked; written back when the block exits normally"""
+        RATE_DIR.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, "r+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                now = time.time()
+                self._refill(state, now)
+                yield state, now
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+            finally:
+                f.flush()
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state: dict, now: float) -> None:
+        elapsed = max(0.0, now - state.get("at", now))
+        state["at"] = now
+        for key, per_min, least in (("req", self.rpm, 1), ("tok", self.tpm, 0)):
+            if per_min:
+                cap = max(least, per_min * BURST_S / 60)
+                state[key] = min(cap, state.get(key, cap) + elapsed * per_min / 60)
+            else:
+                state.pop(key, None)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """wait until a request of ~<tokens> prompt tokens may start, return the seconds waited"""
+        if not self._active():
+            return 0.0
+        t0 = time.monotonic()
+        pid = str(os.getpid())
+        while True:
+            with self._state() as (st, now):
+                inflight = {p: n for p, n in st.get("inflight", {}).items() if p == pid or _alive(int(p))}
+                st["inflight"] = inflight
+                limit = min(filter(None, (st.get("limit"), self.max_inflight)), default=None)
+                wait = max(0.0, st.get("until", 0) - now)
+                if limit is not None and sum(inflight.values()) >= max(1, int(limit)):
+                    wait = max(wait, POLL_S)
+                if self.rpm and st["req"] < 1:
+                    wait = max(wait, (1 - st["req"]) * 60 / self.rpm)
+                if self.tpm:
+                    # a prompt bigger than the bucket goes once the bucket is full
+                    need = min(tokens, self.tpm * BURST_S / 60)
+                    if st["tok"] < need:
+                        wait = max(wait, (need - st["tok"]) * 60 / self.tpm)
+                if not wait:
+                    with self._lock:
+                        self._held += 1
+                    inflight[pid] = inflight.get(pid, 0) + 1
+                    if self.rpm:
+                        st["req"] -= 1
+                    if self.tpm:
+                        st["tok"] -= tokens
+                    return time.monotonic() - t0
+            # jittered, so the waiters don't all wake up together
+            time.sleep(min(wait, 1.0) + random.uniform(0, POLL_S))
+
+    def release(self, tokens: int = 0, throttled: bool = False, retry_after: float | None = None) -> None:
+        """
+        a request acquired before ended
+        tokens:      completion tokens to charge
+        throttled:   it was turned away (429, 5xx): cut the concurrency
+        retry_after: seconds every caller should hold off
+        """
+        if not (throttled or self._held or self._active()):
+            return
+        pid = str(os.getpid())
+        with self._state() as (st, now):
+            inflight = st.setdefault("inflight", {})
+            running = sum(inflight.values())
+            with self._lock:
+                counted, self._held = self._held > 0, max(0, self._held - 1)
+            if not counted:
+                running += 1  # started before there was a file
+            elif inflight.get(pid, 0) > 1:
+                inflight[pid] -= 1
+            else:
+                inflight.pop(pid, None)
+            if self.tpm and tokens:
+                st["tok"] -= tokens
+            if retry_after:
+                st["until"] = max(st.get("until", 0), now + retry_after)
+            limit = st.get("limit")
+            if throttled:
+                if now - st.get("cut", 0) >= CUT_EVERY:
+                    st["limit"] = max(1.0, min(limit or running, running) / 2)
+                    st["cut"] = now
+            elif limit:
+                limit += 1 / limit
+                if limit > (self.max_inflight or CEILING):
+                    st.pop("limit")
+                else:
+                    st["limit"] = limit
+
+_limiters: dict[tuple[str, str], Limiter] = {}
+
+def limiter(base_url: str, model: str) -> Limiter:
+    key = (base_url, model)
+    if key not in _limiters:
+        _limiters[key] = Limiter(base_url, model)
+    return _limiters[key]
@@ -0,0 +1,211 @@
+"""
+semantic recall: the past exchanges most like a question, from any session
+
+~/.ag/recall.db has one row per exchange (a question and the reply to
+it) of every session, archived ones included, and the embedding of
+each. the text comes from the search index, which ag.search keeps
+current, so only sessions that changed since the last look are re-read;
+embeddings are stored by (model, sha1 of the text), so a session that
+grew costs just its new exchanges and a rename costs nothing
+
+embeddings come from $BASE_URL/v1/embeddings ($AG_EMBED_MODEL), or,
+with AG_EMBED_MODEL=hash, from hash_embed(): feature hashing of the
+words, no network (tests, benchmarks, the mock server). similarity is
+cosine over unit vectors, with NumPy when it is installed
+(pip install ag[recall]) and a plain Python loop otherwise
+"""
+from pathlib import Path
+from contextlib import closing
+from typing import Callable, Dict, List
+from array import array
+import hashlib, heapq, math, operator, re, sqlite3
+from . import search
+
+RECALL_DB   = Path.home() / ".ag" / "recall.db"
+RECALL_HEAD = "Relevant excerpts from earlier conversations:\n"
+HASH_MODEL  = "hash"
+HASH_DIM    = 256
+EMBED_BATCH = 64      # texts per /v1/embeddings request
+EMBED_CHARS = 16000   # an exchange is cut to this before embedding (endpoints cap input at ~8k tokens)
+
+SCHEMA = """
+create table if not exists docs (
+    path  text primary key,
+    mtime real not null,
+    size  integer not null
+);
+create table if not exists units (
+    id    integer primary key,
+    path  text not null,
+    name  text not null,
+    turn  integer not null,     -- of the question
+    text  text not null,
+    key   text not null         -- sha1 of text
+);
+create index if not exists units_path on units(path);
+create index if not exists units_key on units(key);
+create table if not exists vectors (
+    model text not null,
+    key   text not null,
+    vec   blob not null,        -- float32, unit length
+    primary key (model, key)
+);
+"""
+
+Embedder = Callable[[List[str]], List[List[float]]]
+
+def connect() -> sqlite3.Connection:
+    RECALL_DB.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(RECALL_DB, timeout=10)
+    conn.executescript(SCHEMA)
+    return conn
+
+WORD_RE = re.compile(r"\w+")
+
+def hash_embed(texts: List[str], dim: int = HASH_DIM) -> List[List[float]]:
+    """offline embedder: signed feature hashing of lowercased words and word pairs"""
+    out = []
+    for text in texts:
+        vec = [0.0] * dim
+        words = WORD_RE.findall(text.lower())
+        for feat in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % dim] += 1.0 if h >> 63 else -1.0
+        out.append(vec)
+    return out
+
+def embedder(model: str | None = None) -> tuple[str, Embedder]:
+    """(model, embed function) for <model>, default $AG_EMBED_MODEL"""
+    if model is None:
+        # config loads .env, keep it out of import time (see cli)
+        from .config import EMBED_MODEL
+        model = EMBED_MODEL
+    if model == HASH_MODEL:
+        return model, hash_embed
+    from .api_client import get_client
+    return model, lambda texts: get_client().embed(texts, model)
+
+def _unit(vec: List[float]) -> bytes:
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return array("f", [x / norm for x in vec]).tobytes()
+
+def exchanges(rows: List[tuple[str, int, str]]) -> List[tuple[int, str]]:
+    """(turn, text) of every answered question in a session's (role, turn, content) rows"""
+    out = []
+    for (role, turn, q), (next_role, next_turn, a) in zip(rows, rows[1:]):
+        if role == "user" and next_role == "assistant" and next_turn == turn + 1:
+            out.append((turn, f"user: {q}\n\nassistant: {a}"))
+    return out
+
+def update(chat_dir: Path, insn_dir: Path, model: str, embed: Embedder) -> int:
+    """
+    bring the index up to date, return how many exchanges were embedded
+
+    embeddings are committed a batch at a time: an interrupted first run
+    over a large archive keeps what it had done
+    """
+    search.update(chat_dir, insn_dir)
+    with closing(search.connect()) as src, closing(connect()) as conn:
+        docs = {p: (m, s) for p, m, s in src.execute("select path, mtime, size from docs where kind = 'chat'")}
+        known = {p: (m, s) for p, m, s in conn.execute("select path, mtime, size from docs")}
+        gone = known.keys() - docs.keys()
+        with conn:
+            for p in gone:
+                conn.execute("delete from units where path = ?", (p,))
+                conn.execute("delete from docs where path = ?", (p,))
+            for p, (mtime, size) in docs.items():
+                if known.get(p) == (mtime, size):
+                    continue
+                name, = src.execute("select name from docs where path = ?", (p,)).fetchone()
+                rows = src.execute("select role, turn, content from chunks where path = ? order by turn", (p,)).fetchall()
+                conn.execute("delete from units where path = ?", (p,))
+                conn.executemany(
+                    "insert into units (path, name, turn, text, key) values (?, ?, ?, ?, ?)",
+                    [(p, name, turn, text, hashlib.sha1(text.encode("utf-8")).hexdigest())
+                     for turn, text in exchanges(rows)],
+                )
+                conn.execute("insert or replace into docs values (?, ?, ?)", (p, mtime, size))
+            if gone:
+                # after the re-reads: a renamed session's text still has its vectors
+                conn.execute("delete from vectors where key not in (select key from units)")
+        todo = conn.execute("""
+            select u.key, min(u.text) from units u
+            left join vectors v on v.model = ? and v.key = u.key
+            where v.key is null group by u.key
+        """, (model,)).fetchall()
+        for i in range(0, len(todo), EMBED_BATCH):
+            batch = todo[i:i + EMBED_BATCH]
+            vecs = embed([text[:EMBED_CHARS] for _, text in batch])
+            with conn:
+                conn.executemany("insert or replace into vectors values (?, ?, ?)",
+                                 [(model, key, _unit(vec)) for (key, _), vec in zip(batch, vecs)])
+    return len(todo)
+
+# the loaded index, kept while the units and vectors don't change (ag serve)
+_loaded: Dict[str, tuple] = {}
+
+def _matrix(conn: sqlite3.Connection, model: str) -> tuple[list, object]:
+    """([(name, turn, text)...], vectors as a NumPy matrix or a list of lists)"""
+    sig = conn.execute("""
+        select count(*), total(u.id), max(u.id) from units u join vectors v on v.model = ? and v.key = u.key
+    """, (model,)).fetchone()
+    hit = _loaded.get(model)
+    if hit and hit[0] == sig:
+        return hit[1], hit[2]
+    rows = conn.execute("""
+        select u.name, u.turn, u.text, v.vec from units u join vectors v on v.model = ? and v.key = u.key
+        order by u.id
+    """, (model,)).fetchall()
+    meta = [(n, t, text) for n, t, text, _ in rows]
+    try:
+        import numpy as np
+    except ImportError:
+        vecs: object = [array("f", vec).tolist() for *_, vec in rows]  # floats multiply faster than array items
+    else:
+        flat = np.frombuffer(b"".join(vec for *_, vec in rows), dtype=np.float32)
+        vecs = flat.reshape(len(rows), -1) if rows else flat
+    _loaded[model] = (sig, meta, vecs)
+    return meta, vecs
+
+def _scores(query: bytes, vecs) -> list:
+    try:
+        import numpy as np
+    except ImportError:
+        q, mul = array("f", query).tolist(), operator.mul
+        return [sum(map(mul, q, v)) for v in vecs]
+    return (vecs @ np.frombuffer(query, dtype=np.float32)).tolist()
+
+def query(text: str, k: int, model: str, embed: Embedder, exclude: str | None = None) -> List[dict]:
+    """the <k> exchanges closest to <text>: {"name", "turn", "score", "text"}, best first"""
+    with closing(connect()) as conn:
+        meta, vecs = _matrix(conn, model)
+    if not meta:
+        return []
+    scores = _scores(_unit(embed([text[:EMBED_CHARS]])[0]), vecs)
+    top = heapq.nlargest(k, (i for i, m in enumerate(meta) if m[0] != exclude), key=scores.__getitem__)
+    return [{"name": meta[i][0], "turn": meta[i][1], "score": scores[i], "text": meta[i][2]} for i in top]
+
+def _is_recall(msg: Dict[str, str]) -> bool:
+    return msg["role"] == "system" and msg["content"].startswith(RECALL_HEAD)
+
+def inject(messages: List[Dict[str, str]], hits: List[dict], max_tokens: int) -> List[Dict[str, str]]:
+    """
+    <messages> with <hits> as one system message right after the system
+    prompt, in place of an earlier one; best hits first, up to <max_tokens>
+    """
+    from .context import estimate_tokens
+    messages = [m for m in messages if not _is_recall(m)]
+    parts, used = [], estimate_tokens(RECALL_HEAD)
+    for hit in hits:
+        part = f"\n[{hit['name']} #{hit['turn']}]\n{hit['text']}\n"
+        cost = estimate_tokens(part)
+        if used + cost > max_tokens:
+            break
+        parts.append(part)
+        used += cost
+    if not parts:
+        return messages
+    at = 0
+    while at < len(messages) and messages[at]["role"] == "system":
+        at += 1
+    return messages[:at] + [{"role": "system", "content": RECALL_HEAD + "".join(parts)}] + messages[at:]
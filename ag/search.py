@@ -0,0 +1,182 @@
+"""
+full-text search over sessions and saved prompts
+
+an SQLite FTS5 index in ~/.ag/search.db with one row per turn (role and
+turn number kept alongside); before each query the chat and insn dirs
+are scanned and only files whose mtime or size changed are re-indexed;
+archived sessions are indexed once, as "archive:NAME", sessions in the
+turn store (ag.turnstore) as "turns:NAME"
+"""
+from pathlib import Path
+from contextlib import closing
+import os, re, sqlite3
+from . import turns, archive, layout, turnstore
+
+SEARCH_DB = Path.home() / ".ag" / "search.db"
+
+SCHEMA = """
+create table if not exists docs (
+    path  text primary key,
+    kind  text not null,        -- chat | insn
+    name  text not null,
+    mtime real not null,
+    size  integer not null
+);
+create table if not exists chunks (
+    id      integer primary key,
+    path    text not null,
+    role    text not null,
+    turn    integer not null,
+    content text not null
+);
+create index if not exists chunks_path on chunks(path);
+create virtual table if not exists fts using fts5(
+    content, content='chunks', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+create trigger if not exists chunks_ai after insert on chunks begin
+    insert into fts(rowid, content) values (new.id, new.content);
+end;
+create trigger if not exists chunks_ad after delete on chunks begin
+    insert into fts(fts, rowid, content) values ('delete', old.id, old.content);
+end;
+"""
+
+def connect() -> sqlite3.Connection:
+    SEARCH_DB.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(SEARCH_DB, timeout=10)
+    conn.executescript(SCHEMA)
+    return conn
+
+def _files(chat_dir: Path, insn_dir: Path) -> dict[str, tuple[str, str, float, int]]:
+    """path -> (kind, name, mtime, size) for every .md file"""
+    out = {}
+    if chat_dir.is_dir():
+        for name, path in layout.scan(chat_dir).items():
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            out[str(path)] = ("chat", name, st.st_mtime, st.st_size)
+    if insn_dir.is_dir():
+        with os.scandir(insn_dir) as it:
+            for e in it:
+                if e.name.endswith(".md") and e.is_file():
+                    st = e.stat()
+                    out[e.path] = ("insn", e.name[:-3], st.st_mtime, st.st_size)
+    for row in archive.members():
+        out[f"archive:{row['name']}"] = ("chat", row["name"], row["archived"], row["length"])
+    for name, path in turnstore.scan().items():
+        try:
+            size, mtime = turnstore.view_stat(path)
+        except FileNotFoundError:
+            continue
+        out[f"turns:{name}"] = ("chat", name, mtime, size)
+    return out
+
+def _rows(kind: str, name: str, path: Path) -> list[tuple[str, int, str]]:
+    """(role, turn, content) for one file"""
+    if kind == "insn":
+        return [("insn", 0, path.read_text(encoding="utf-8", errors="replace"))]
+    # parse directly: indexing a whole archive shouldn't write a sidecar per session
+    if str(path).startswith("archive:"):
+        data = archive.read(name)
+    elif str(path).startswith("turns:"):
+        data = turnstore.render(name)
+    else:
+        data = path.read_bytes()
+    if data is None:
+        raise FileNotFoundError(path)
+    res = turns.parse(data)
+
+    def text(s: int, e: int) -> str:
+        return data[s:e].decode("utf-8", errors="replace").strip()
+
+    rows = [("system", 0, text(*res["system"]))] if res["system"] else []
+    spans = res["turns"] + res["open"]
+    rows += [(role, i + 1, text(s, e)) for i, (role, s, e) in enumerate(spans)]
+    return rows
+
+def update(chat_dir: Path, insn_dir: Path, rebuild: bool = False) -> int:
+    """bring the index up to date, return how many files were (re)indexed"""
+    files = _files(chat_dir, insn_dir)
+    with closing(connect()) as conn, conn:
+        if rebuild:
+            conn.execute("delete from chunks")
+            conn.execute("delete from docs")
+        known = {p: (m, s) for p, m, s in conn.execute("select path, mtime, size from docs")}
+        gone = known.keys() - files.keys()
+        stale = [p for p, (_, _, m, s) in files.items() if known.get(p) != (m, s)]
+        for p in gone:
+            conn.execute("delete from chunks where path = ?", (p,))
+            conn.execute("delete from docs where path = ?", (p,))
+        for p in stale:
+            kind, name, mtime, size = files[p]
+            try:
+                rows = _rows(kind, name, Path(p))
+            except OSError:
+                continue
+            conn.execute("delete from chunks where path = ?", (p,))
+            conn.executemany(
+                "insert into chunks (path, role, turn, content) values (?, ?, ?, ?)",
+                [(p, role, turn, content) for role, turn, content in rows if content],
+            )
+            conn.execute(
+                "insert or replace into docs (path, kind, name, mtime, size) values (?, ?, ?, ?, ?)",
+                (p, kind, name, mtime, size),
+            )
+    return len(stale)
+
+def moved(pairs: list[tuple[str, str]]) -> None:
+    """files were renamed (old path, new path): keep their rows, no re-indexing"""
+    if not SEARCH_DB.exists():
+        return
+    with closing(connect()) as conn, conn:
+        conn.executemany("update docs set path = ? where path = ?", [(b, a) for a, b in pairs])
+        conn.executemany("update chunks set path = ? where path = ?", [(b, a) for a, b in pairs])
+
+TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+def to_fts_query(query: str) -> str:
+    """
+    user query -> FTS5 query
+
+    "quoted words" stay phrases, `word*` is a prefix match, everything
+    else is quoted so punctuation can't break the FTS syntax; terms AND
+    """
+    terms = []
+    for phrase, word in TERM_RE.findall(query):
+        if phrase:
+            terms.append('"' + phrase.replace('"', '""') + '"')
+        elif word:
+            prefix = word.endswith("*") and len(word) > 1
+            word = word.rstrip("*") if prefix else word
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def search(query: str, role: str | None = None, kind: str | None = None, limit: int = 20) -> list[dict]:
+    """ranked hits: {"name", "kind", "role", "turn", "snippet"}"""
+    fts_query = to_fts_query(query)
+    if not fts_query:
+        return []
+    sql = """
+        select d.name, d.kind, c.role, c.turn,
+               snippet(fts, 0, char(2), char(3), '…', 16)
+        from fts join chunks c on c.id = fts.rowid join docs d on d.path = c.path
+        where fts match ?
+    """
+    args: list = [fts_query]
+    if role:
+        sql += " and c.role = ?"
+        args.append(role)
+    if kind:
+        sql += " and d.kind = ?"
+        args.append(kind)
+    sql += " order by bm25(fts) limit ?"
+    args.append(limit)
+    with closing(connect()) as conn:
+        rows = conn.execute(sql, args).fetchall()
+    return [
+        {"name": n, "kind": k, "role": r, "turn": t, "snippet": s}
+        for n, k, r, t, s in rows
+    ]
@@ -0,0 +1,104 @@
+"""
+consumers for streamed replies
+
+a sink gets every delta through write() and is closed once the stream
+ends; consume() drives a delta iterator into any number of sinks and
+returns the full reply
+"""
+from typing import Callable, IO, Iterable
+import sys, time
+
+class Sink:
+    def write(self, delta: str) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def abort(self) -> None:
+        """the stream failed or was interrupted"""
+        self.close()
+
+class TerminalSink(Sink):
+    """
+    print deltas, coalescing them into fewer, larger writes
+
+    the buffer is flushed when <interval> seconds passed since the last
+    flush or it holds <max_chars>, so fast streams cost a handful of
+    syscalls per second instead of one per token
+    """
+    def __init__(self, out: IO[str] | None = None, interval: float = 0.05, max_chars: int = 4096) -> None:
+        self.out = out or sys.stdout
+        self.interval = interval
+        self.max_chars = max_chars
+        self.buf: list[str] = []
+        self.size = 0
+        self.last = time.monotonic()
+
+    def write(self, delta: str) -> None:
+        self.buf.append(delta)
+        self.size += len(delta)
+        now = time.monotonic()
+        if self.size >= self.max_chars or now - self.last >= self.interval:
+            self.flush(now)
+
+    def flush(self, now: float | None = None) -> None:
+        if self.buf:
+            self.out.write("".join(self.buf))
+            self.buf.clear()
+            self.size = 0
+        self.out.flush()
+        self.last = now or time.monotonic()
+
+    def close(self) -> None:
+        self.buf.append("\n")
+        self.flush()
+
+class FileSink(Sink):
+    """append deltas to a file (path or open text file)"""
+    def __init__(self, target: "str | IO[str]", encoding: str = "utf-8") -> None:
+        if isinstance(target, str):
+            self.file = open(target, "a", encoding=encoding)
+            self.owned = True
+        else:
+            self.file = target
+            self.owned = False
+
+    def write(self, delta: str) -> None:
+        self.file.write(delta)
+
+    def close(self) -> None:
+        if self.owned:
+            self.file.close()
+        else:
+            self.file.flush()
+
+class CallbackSink(Sink):
+    """call fn(delta) for every delta"""
+    def __init__(self, fn: Callable[[str], None]) -> None:
+        self.fn = fn
+
+    def write(self, delta: str) -> None:
+        self.fn(delta)
+
+def consume(deltas: Iterable[str], *sinks: Sink, keep: bool = True) -> str:
+    """
+    feed every delta to <sinks>, return the joined reply
+
+    keep=False doesn't hold the reply in memory (returns ""), for sinks
+    that already persist it
+    """
+    parts: list[str] = []
+    try:
+        for delta in deltas:
+            if keep:
+                parts.append(delta)
+            for sink in sinks:
+                sink.write(delta)
+    except BaseException:
+        for sink in sinks:
+            sink.abort()
+        raise
+    for sink in sinks:
+        sink.close()
+    return "".join(parts)
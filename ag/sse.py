@@ -0,0 +1,177 @@
+"""
+incremental text/event-stream decoder
+
+Decoder.feed() takes raw bytes exactly as they come off the socket,
+split anywhere, and returns the events completed by them. a read is cut
+into whole events with one split() on the blank lines between them, and
+an event that is a single data: line (nearly all of them) is sliced out
+without looking at it line by line; only the unfinished tail is kept,
+in a reusable bytearray. the rest of the event grammar (CR / LF / CRLF
+line ends, comments, event:, id:, retry:, fields without a colon,
+multi-line data, a leading BOM) is handled as the spec says:
+https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+
+chunk() picks a chat.completion.chunk apart: content delta, finish_reason,
+usage; the common content-only chunk gets just its content string
+decoded instead of a full json.loads
+"""
+from typing import Any, NamedTuple
+from json.decoder import scanstring
+import json, re
+
+BOM  = b"\xef\xbb\xbf"
+_new = tuple.__new__  # builds a NamedTuple without its Python-level __new__, for the per-delta path
+
+class Event(NamedTuple):
+    type: str           # "message" unless an event: field said otherwise
+    data: bytes         # data: lines joined with "\n"
+    id: str | None      # last event id seen so far
+
+class Decoder:
+    """feed() raw bytes, get back complete events; an unterminated event at the end is dropped"""
+    __slots__ = ("_buf", "_cr", "_started", "last_id", "retry")
+
+    def __init__(self) -> None:
+        self._buf = bytearray()  # the unfinished event, kept between reads
+        self._cr = False         # the last chunk ended in CR: a LF starting the next one belongs to it
+        self._started = False    # past the (optional) BOM
+        self.last_id: str | None = None
+        self.retry: int | None = None  # ms, from a retry: field
+
+    def feed(self, chunk: bytes) -> list[Event]:
+        if self._cr or b"\r" in chunk:
+            chunk = self._lf(chunk)
+        if not self._started:
+            chunk = self._skip_bom(chunk)
+        buf = self._buf
+        if not buf and chunk.startswith(b"data: ") and chunk.find(b"\n") == len(chunk) - 2 and chunk[-1:] == b"\n":
+            # a read that is exactly one single-line event: how most servers send a reply
+            return [_new(Event, ("message", chunk[6:-2], self.last_id))]
+        if b"\n" not in chunk:
+            buf += chunk  # can't end an event: tiny reads stop here
+            return []
+
+        # a blank line ends an event, so "\n\n" splits the stream into
+        # whole events; the last piece is the unfinished one
+        if buf:
+            seen = len(buf)
+            buf += chunk
+            if buf.find(b"\n\n", seen - 1) < 0:
+                return []
+            blocks = bytes(buf).split(b"\n\n")
+            buf.clear()
+        else:
+            blocks = chunk.split(b"\n\n")
+        buf += blocks.pop()
+
+        events: list[Event] = []
+        append, last_id = events.append, self.last_id
+        for block in blocks:
+            if block.startswith(b"data: ") and b"\n" not in block:
+                # the usual shape, one data line: no line splitting
+                append(_new(Event, ("message", block[6:], last_id)))
+            elif block:
+                self._event(block, events)
+                last_id = self.last_id
+        return events
+
+    def _lf(self, chunk: bytes) -> bytes:
+        """CRLF and CR line ends -> LF, a CRLF split across reads included"""
+        if self._cr and chunk[:1] == b"\n":
+            chunk = chunk[1:]
+        self._cr = chunk.endswith(b"\r")
+        return chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+    def _skip_bom(self, chunk: bytes) -> bytes:
+        buf = self._buf
+        buf += chunk
+        if len(buf) < len(BOM) and BOM.startswith(buf):
+            return b""  # could still be the start of one
+        chunk = bytes(buf[len(BOM):] if buf.startswith(BOM) else buf)
+        buf.clear()
+        self._started = True
+        return chunk
+
+    def _event(self, block: bytes, events: list[Event]) -> None:
+        """the general case: any mix of fields, comments and blank lines"""
+        data: list[bytes] = []
+        kind = None
+        for line in block.split(b"\n"):
+            if not line:
+                if data:
+                    events.append(Event(kind or "message", b"\n".join(data), self.last_id))
+                data, kind = [], None
+                continue
+            name, colon, value = line.partition(b":")
+            if not name:
+                continue  # ":" starts a comment (keep-alives)
+            if colon and value[:1] == b" ":
+                value = value[1:]
+            if name == b"data":
+                data.append(value)  # "data" without a colon is an empty line of data
+            elif name == b"event":
+                kind = value.decode("utf-8", "replace")
+            elif name == b"id":
+                if b"\0" not in value:
+                    self.last_id = value.decode("utf-8", "replace")
+            elif name == b"retry":
+                if value.isdigit():
+                    self.retry = int(value)
+            # any other field is ignored
+        if data:
+            events.append(Event(kind or "message", b"\n".join(data), self.last_id))
+
+DONE = b"[DONE]"
+
+class Chunk(NamedTuple):
+    content: str | None
+    finish_reason: str | None
+    usage: dict | None
+    model: str | None
+    error: Any
+
+# a delta that is only content, of the only choice, in a chunk that
+# carries nothing else of interest: the string is decoded on its own
+CONTENT_AT = re.compile(r'"delta"\s*:\s*\{\s*"content"\s*:\s*"')
+DELTA_END  = re.compile(r'\s*\}')
+
+def _plain(text: str) -> bool:
+    """
+    no finish_reason, usage or error to pick up; a key spelled any other
+    way just means a full parse (none of these can match inside a string,
+    where every quote is escaped)
+    """
+    return (('"finish_reason":null' in text or '"finish_reason": null' in text or '"finish_reason"' not in text)
+            and ('"usage"' not in text or '"usage":null' in text or '"usage": null' in text)
+            and '"error"' not in text)
+
+def chunk(data: bytes) -> Chunk | None:
+    """
+    one chat.completion.chunk, None for data that isn't a JSON object
+    (a provider's own keep-alive or status frame)
+
+    model is only filled in for chunks parsed in full: it doesn't change
+    within a stream, and the role delta that opens a stream and the one
+    with the finish_reason always are
+    """
+    text = data.decode("utf-8")  # json.loads would sniff the encoding of bytes first
+    if text[:1] != "{":
+        text = text.strip()
+        if text[:1] != "{":
+            return None
+    m = CONTENT_AT.search(text)
+    if m and text.count('"delta"') == 1 and _plain(text):
+        content, end = scanstring(text, m.end())
+        if DELTA_END.match(text, end):
+            return _new(Chunk, (content, None, None, None, None))
+    obj = json.loads(text)
+    choices = obj.get("choices")
+    first = choices[0] if choices else None
+    delta = first.get("delta") if first else None
+    return Chunk(
+        delta.get("content") if delta else None,
+        first.get("finish_reason") if first else None,
+        obj.get("usage"),
+        obj.get("model"),
+        obj.get("error"),
+    )
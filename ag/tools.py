@@ -0,0 +1,141 @@
+"""
+local tools the model can call (ask / re --tools, see ag.agent)
+
+a tool is a function (args, timeout, max_bytes) -> text plus the JSON
+schema of its arguments; @tool registers one under a name:
+
+  @tool("now", "the local time", {"type": "object", "properties": {}})
+  def now(args, timeout, max_bytes):
+      return time.ctime()
+
+<timeout> and <max_bytes> are the tool's own limits: a tool should stop
+on its own within them (sh kills its command), ag.agent also stops
+waiting for it after <timeout> and cuts its result to <max_bytes>
+
+built in:
+  sh         a shell command; runs whatever the model asks, so it is
+             only there when named (--tools sh)
+  read_file  a text file, or a range of its lines
+  list_dir   the entries of a directory
+"""
+from pathlib import Path
+from typing import Any, Callable, Dict, NamedTuple
+import os, signal, subprocess, threading
+from .config import TOOL_TIMEOUT, TOOL_MAX_BYTES
+
+class Tool(NamedTuple):
+    name: str
+    description: str
+    parameters: Dict[str, Any]  # JSON schema of the arguments
+    fn: Callable[[Dict[str, Any], float, int], str]
+    timeout: float              # seconds
+    max_bytes: int              # of the result, UTF-8
+
+    def schema(self) -> Dict[str, Any]:
+        return {"type": "function",
+                "function": {"name": self.name, "description": self.description, "parameters": self.parameters}}
+
+TOOLS: Dict[str, Tool] = {}
+
+def tool(name: str, description: str, parameters: Dict[str, Any],
+         timeout: float = TOOL_TIMEOUT, max_bytes: int = TOOL_MAX_BYTES):
+    """register the decorated function as tool <name>"""
+    def register(fn):
+        TOOLS[name] = Tool(name, description, parameters, fn, timeout, max_bytes)
+        return fn
+    return register
+
+def select(names: str) -> Dict[str, Tool]:
+    """"read_file,list_dir" -> those tools; "all": every registered one"""
+    wanted = [n.strip() for n in names.split(",") if n.strip()]
+    if wanted == ["all"]:
+        return dict(TOOLS)
+    unknown = [n for n in wanted if n not in TOOLS]
+    if unknown:
+        raise KeyError(f"no tool named {', '.join(unknown)} (there are: {', '.join(TOOLS)})")
+    return {n: TOOLS[n] for n in wanted}
+
+def cut(text: str, max_bytes: int) -> str:
+    """<text> in at most ~<max_bytes> UTF-8 bytes, saying so when it was cut"""
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    return data[:max_bytes].decode("utf-8", "ignore") + f"\n[cut: {len(data) - max_bytes} more bytes]"
+
+# -- built in ------------------------------------------------------------
+
+def _kill(proc: subprocess.Popen) -> None:
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)  # the shell and whatever it started
+    except ProcessLookupError:
+        pass
+
+@tool("sh", "Run a shell command in the current directory; returns its output (stdout and stderr) and exit status.",
+      {"type": "object",
+       "properties": {"command": {"type": "string", "description": "the command line, run with /bin/sh -c"}},
+       "required": ["command"]})
+def sh(args: Dict[str, Any], timeout: float, max_bytes: int) -> str:
+    proc = subprocess.Popen(args["command"], shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, start_new_session=True)
+    expired = threading.Event()
+    def expire() -> None:
+        expired.set()
+        _kill(proc)
+    timer = threading.Timer(timeout, expire)
+    timer.start()
+    out = bytearray()
+    try:
+        # read at most a little past the cap: a command that goes on
+        # printing is stopped instead of filling memory
+        while len(out) <= max_bytes:
+            data = proc.stdout.read1(64 * 1024)
+            if not data:
+                break
+            out += data
+        if len(out) > max_bytes:
+            _kill(proc)
+        status = proc.wait()
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+    text = out[:max_bytes].decode("utf-8", "replace")
+    if expired.is_set():
+        return f"{text}\n[killed after {timeout:g} s]"
+    if len(out) > max_bytes:
+        return f"{text}\n[stopped: more than {max_bytes} bytes of output]"
+    return f"{text}\n[exit {status}]"
+
+@tool("read_file", "Read a text file, optionally only some of its lines.",
+      {"type": "object",
+       "properties": {"path":   {"type": "string"},
+                      "offset": {"type": "integer", "description": "first line, from 1 (default 1)"},
+                      "limit":  {"type": "integer", "description": "number of lines (default: to the end)"}},
+       "required": ["path"]},
+      timeout=10)
+def read_file(args: Dict[str, Any], timeout: float, max_bytes: int) -> str:
+    first = max(1, int(args.get("offset") or 1))
+    limit = args.get("limit")
+    lines, size = [], 0
+    with open(Path(args["path"]).expanduser(), encoding="utf-8", errors="replace") as f:
+        for n, line in enumerate(f, 1):
+            if n < first:
+                continue
+            if (limit is not None and len(lines) >= int(limit)) or size > max_bytes:
+                break  # enough: the rest would be cut anyway
+            lines.append(line)
+            size += len(line)
+    return "".join(lines)
+
+@tool("list_dir", "List a directory: one entry per line, directories end with /.",
+      {"type": "object",
+       "properties": {"path": {"type": "string", "description": "default: the current directory"}}},
+      timeout=10)
+def list_dir(args: Dict[str, Any], timeout: float, max_bytes: int) -> str:
+    out, size = [], 0
+    with os.scandir(Path(args.get("path") or ".").expanduser()) as entries:
+        for e in entries:
+            out.append(e.name + ("/" if e.is_dir() else ""))
+            size += len(out[-1]) + 1
+            if size > max_bytes:
+                break
+    return "\n".join(sorted(out))
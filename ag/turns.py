@@ -0,0 +1,246 @@
+"""
+turn parser and byte-offset index for chat markdown files
+
+    # Chat: NAME
+    ## Instructions:       -> system
+    ## Conversation
+    ### User               -> user (free text typed after a reply is user too)
+    ### Assistant
+    ```reply               -> assistant
+    ```
+
+the index (~/.ag/index/NAME.json) keeps the byte spans of every turn up
+to the end of the last closed reply block, so reading the last N turns
+or picking up an append only parses the bytes written since
+"""
+from pathlib import Path
+import hashlib, json, re
+
+INDEX_DIR = Path.home() / ".ag" / "index"
+TAIL_LEN  = 64  # bytes before parsed_to that must match for the index to be reused
+PARTIAL   = b"partial"  # flag on the fence of a reply still being streamed
+ABORTED   = b"aborted"  # same length: the flag is rewritten in place
+
+FENCE   = re.compile(rb"^(`{3,})[ \t]*([^`\s]*)[ \t]*([^`]*?)[ \t]*$")  # fence, info, flags
+HEADING = re.compile(rb"^(#{1,3}) (.*?)\s*$")
+
+Span = tuple[str, int, int]  # role, start, end (content bytes, unstripped)
+
+def parse(data: bytes, base: int = 0, in_conv: bool = False) -> dict:
+    """
+    parse <data> (which starts at file offset <base>)
+
+    in_conv: data starts inside ## Conversation, between turns
+    return {"system": [s, e] | None, "turns": [...closed turns...],
+            "open": [...turns after parsed_to...], "parsed_to": offset,
+            "partial": [fence length, flag offset] | None}
+
+    partial is set when the data ends inside a reply block opened as
+    "```reply partial" (a streamed reply that never finished)
+    """
+    system: list[int] | None = None
+    turns: list[Span] = []
+    section = "conv" if in_conv else "head"
+    parsed_to = base if in_conv else 0
+    role: str | None = "user" if in_conv else None  # turn being collected
+    start = base
+    fence = 0                    # backticks of the open reply fence, 0: not in a reply block
+    depth = 0                    # nested fences inside the reply
+    want_fence = False           # just saw ### Assistant
+    flag_at = -1                 # offset of the "partial" flag of the open reply
+
+    def close(end: int) -> None:
+        nonlocal role
+        if role and data[start - base:end - base].strip():
+            turns.append((role, start, end))
+        role = None
+
+    pos = base
+    for line in data.splitlines(keepends=True):
+        end = pos + len(line)
+        text = line.rstrip(b"\r\n")
+
+        if fence:
+            m = FENCE.match(text)
+            if m and len(m.group(1)) >= fence and not m.group(2) and not m.group(3) and depth == 0:
+                turns.append(("assistant", start, pos))
+                fence = 0
+                parsed_to = end
+                role, start = "user", end
+            elif fence == 3 and m and m.group(2):
+                # legacy ```reply blocks: balance code fences nested in the reply
+                depth += 1
+            elif fence == 3 and m and depth:
+                depth -= 1
+            pos = end
+            continue
+
+        if want_fence:
+            m = FENCE.match(text)
+            if m and m.group(2) == b"reply":
+                fence, depth = len(m.group(1)), 0
+                flag_at = pos + m.start(3) if m.group(3) == PARTIAL else -1
+                role, start = "assistant", end
+                want_fence = False
+                pos = end
+                continue
+            if text.strip():
+                # no reply fence (hand-written turn): plain text until the next heading
+                want_fence = False
+                role, start = "assistant", pos
+
+        h = HEADING.match(text)
+        if h and section == "head":
+            title = h.group(2).rstrip(b":").strip().lower()
+            if title == b"instructions":
+                section, start = "insn", end
+            elif title == b"conversation":
+                section, role, start = "conv", "user", end
+                parsed_to = end
+        elif h and section == "insn" and h.group(2).strip().lower() == b"conversation":
+            if data[start - base:pos - base].strip():
+                system = [start, pos]
+            section, role, start = "conv", "user", end
+            parsed_to = end
+        elif h and section == "conv" and len(h.group(1)) == 3:
+            title = h.group(2).strip().lower()
+            if title == b"user":
+                close(pos)
+                role, start = "user", end
+            elif title == b"assistant":
+                close(pos)
+                want_fence = True
+                start = end
+        pos = end
+
+    partial = None
+    if fence:
+        # unterminated reply block: still in progress, keep it out of the index
+        turns.append(("assistant", start, pos))
+        if flag_at >= 0:
+            partial = [fence, flag_at]
+    else:
+        close(pos)
+    if section == "insn" and data[start - base:pos - base].strip():
+        system = [start, pos]
+
+    closed = [t for t in turns if t[2] <= parsed_to]
+    return {
+        "system": system,
+        "turns": closed,
+        "open": turns[len(closed):],
+        "parsed_to": parsed_to,
+        "partial": partial,
+    }
+
+def index_path(name: str) -> Path:
+    return INDEX_DIR / f"{name}.json"
+
+def live_path(name: str) -> Path:
+    """where a streamed reply records how far its bytes reached, until it closes"""
+    return INDEX_DIR / f"{name}.live"
+
+def _tail_digest(f, parsed_to: int) -> str:
+    start = max(0, parsed_to - TAIL_LEN)
+    f.seek(start)
+    return hashlib.sha1(f.read(parsed_to - start)).hexdigest()
+
+def load_index(name: str, path: Path) -> dict:
+    """
+    return the up-to-date index of chat <path>, incrementally
+
+    reuses the stored index when the file still holds the same bytes just
+    before parsed_to and parses only what follows; otherwise reparses
+    """
+    ipath = index_path(name)
+    try:
+        idx = json.loads(ipath.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        idx = None
+
+    with path.open("rb") as f:
+        size = f.seek(0, 2)
+        if idx and idx["size"] <= size and idx["parsed_to"] <= size \
+                and _tail_digest(f, idx["parsed_to"]) == idx["tail"]:
+            base = idx["parsed_to"]
+            f.seek(base)
+            res = parse(f.read(), base=base, in_conv=idx["in_conv"])
+            system = idx["system"] or res["system"]
+            turns = [tuple(t) for t in idx["turns"]] + res["turns"]
+        else:
+            f.seek(0)
+            res = parse(f.read())
+            system = res["system"]
+            turns = res["turns"]
+        parsed_to = res["parsed_to"]
+        tail = _tail_digest(f, parsed_to)
+
+    new = {
+        "size": size,
+        "parsed_to": parsed_to,
+        "in_conv": parsed_to > 0,
+        "tail": tail,
+        "system": system,
+        "turns": turns,
+    }
+    if idx is None or idx["parsed_to"] != parsed_to or idx["size"] != size:
+        INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = ipath.with_suffix(".tmp")
+        tmp.write_text(json.dumps(new), encoding="utf-8")
+        tmp.replace(ipath)
+    new["open"] = res["open"]
+    new["partial"] = res["partial"]
+    return new
+
+def count_turns(name: str, path: Path) -> int:
+    idx = load_index(name, path)
+    return len(idx["turns"]) + len(idx["open"])
+
+def drop_index(name: str) -> None:
+    index_path(name).unlink(missing_ok=True)
+
+def move_index(old: str, new: str) -> None:
+    for path in (index_path, live_path):
+        try:
+            path(old).replace(path(new))
+        except FileNotFoundError:
+            pass
+
+def read_turns(name: str, path: Path, last: int | None = None) -> tuple[str | None, list[dict[str, str]]]:
+    """
+    return (instructions, [{"role", "content"}...]) of chat <path>
+
+    last: only the last N turns, read by seeking to their offsets
+    """
+    idx = load_index(name, path)
+    spans = [tuple(t) for t in idx["turns"]] + [tuple(t) for t in idx["open"]]
+    if last is not None:
+        spans = spans[-last:] if last > 0 else []
+    system = None
+    turns: list[dict[str, str]] = []
+    with path.open("rb") as f:
+        if idx["system"]:
+            s, e = idx["system"]
+            f.seek(s)
+            system = f.read(e - s).decode("utf-8", errors="replace").strip() or None
+        if spans:
+            lo = spans[0][1]
+            f.seek(lo)
+            blob = f.read(spans[-1][2] - lo)
+            for role, s, e in spans:
+                content = blob[s - lo:e - lo].decode("utf-8", errors="replace").strip()
+                turns.append({"role": role, "content": content})
+    return system, turns
+
+def read_turns_from(data: bytes, last: int | None = None) -> tuple[str | None, list[dict[str, str]]]:
+    """read_turns for a chat held in memory (an archived session), no index"""
+    res = parse(data)
+    spans = res["turns"] + res["open"]
+    if last is not None:
+        spans = spans[-last:] if last > 0 else []
+
+    def text(s: int, e: int) -> str:
+        return data[s:e].decode("utf-8", errors="replace").strip()
+
+    system = text(*res["system"]) or None if res["system"] else None
+    return system, [{"role": role, "content": text(s, e)} for role, s, e in spans]
@@ -0,0 +1,239 @@
+"""
+content-addressed turn store: sessions that share turns, sharing bytes
+
+a stored session is a manifest, ~/.ag/chats/.turns/sessions/NAME.turns:
+  {"head": hash, "turns": [hash, ...], "size": bytes of the view}
+and every hash names an object, ~/.ag/chats/.turns/objects/ab/cdef...,
+the exact markdown bytes of one piece of the session file: the head (up
+to the ## Conversation line), then one piece per turn (its heading, its
+text, the closing fence of a reply). head + pieces, concatenated, are
+the .md file byte for byte, rendered when it is read
+
+`ag fork` moves the source session in here and writes a manifest with
+the first N of its hashes: a fork costs a few hundred bytes whatever the
+length of the conversation, and the turns it shares are on disk once.
+appending adds objects for the new turns only. objects are immutable; a
+removed manifest releases the ones nothing else refers to
+
+the store lives inside the chat dir, so git tracks it like the sessions
+"""
+from pathlib import Path
+from contextlib import contextmanager
+import fcntl, hashlib, json, os
+from . import turns
+
+STORE_DIR = Path.home() / ".ag" / "chats" / ".turns"
+OBJECTS   = STORE_DIR / "objects"
+SESSIONS  = STORE_DIR / "sessions"
+LOCK      = Path.home() / ".ag" / "turns.lock"
+SUFFIX    = ".turns"
+
+@contextmanager
+def _locked():
+    """writers take turns: a manifest is read, changed and replaced under it"""
+    LOCK.parent.mkdir(parents=True, exist_ok=True)
+    with LOCK.open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _conv_end(data: bytes) -> int:
+    """offset just past the ## Conversation heading, len(data) if there is none"""
+    pos = 0
+    for line in data.splitlines(keepends=True):
+        pos += len(line)
+        h = turns.HEADING.match(line.rstrip(b"\r\n"))
+        if h and h.group(2).rstrip(b":").strip().lower() == b"conversation":
+            return pos
+    return pos
+
+def _turn_end(data: bytes, role: str, end: int) -> int:
+    """where a turn's piece ends: past the closing fence of a reply"""
+    if role == "assistant":
+        nl = data.find(b"\n", end)
+        line = data[end:] if nl < 0 else data[end:nl + 1]
+        m = turns.FENCE.match(line.rstrip(b"\r\n"))
+        if m and not m.group(2) and not m.group(3):
+            return end + len(line)
+    return end
+
+def split(data: bytes, in_conv: bool = False) -> tuple[bytes, list[bytes]]:
+    """
+    (head, one piece per turn) of session bytes; head + pieces == data
+    in_conv: data starts inside ## Conversation, between turns (head is b"")
+    bytes after the last turn stay with it
+    """
+    res = turns.parse(data, in_conv=in_conv)
+    head_end = 0 if in_conv else _conv_end(data)
+    ends = [_turn_end(data, role, e) for role, _, e in res["turns"] + res["open"]]
+    ends = [e for e in ends if e > head_end]
+    if not ends:
+        return data, []
+    edges = [head_end] + ends[:-1] + [len(data)]
+    return data[:head_end], [data[a:b] for a, b in zip(edges, edges[1:])]
+
+def _object(h: str) -> Path:
+    return OBJECTS / h[:2] / h[2:]
+
+def _put(data: bytes) -> tuple[str, Path | None]:
+    """store <data>, return (hash, path written) - no path when it was there already"""
+    h = hashlib.sha256(data).hexdigest()
+    path = _object(h)
+    if path.exists():
+        return h, None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return h, path
+
+def manifest_path(name: str) -> Path:
+    return SESSIONS / f"{name}{SUFFIX}"
+
+def manifest(name: str) -> dict | None:
+    try:
+        return json.loads(manifest_path(name).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+def has(name: str) -> bool:
+    return manifest_path(name).exists()
+
+def scan() -> dict[str, Path]:
+    """name -> manifest path of every stored session"""
+    if not SESSIONS.is_dir():
+        return {}
+    with os.scandir(SESSIONS) as it:
+        return {e.name[:-len(SUFFIX)]: Path(e.path) for e in it if e.name.endswith(SUFFIX)}
+
+def view_stat(path: Path) -> tuple[int, float]:
+    """(size of the .md view, mtime) of a stored session, by its manifest path"""
+    m = json.loads(path.read_text(encoding="utf-8"))
+    return m["size"], path.stat().st_mtime
+
+def count_turns(path: Path) -> int:
+    return len(json.loads(path.read_text(encoding="utf-8"))["turns"])
+
+def render(name: str) -> bytes | None:
+    """the session's .md bytes, None if it isn't stored"""
+    for _ in range(3):  # a concurrent write may release an object between the two reads
+        m = manifest(name)
+        if m is None:
+            return None
+        try:
+            return b"".join(_object(h).read_bytes() for h in [m["head"], *m["turns"]])
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(f"Chat '{name}' is missing turns in {OBJECTS}")
+
+def _write(name: str, m: dict, mtime: float | None = None) -> Path:
+    path = manifest_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(m, separators=(",", ":")) + "\n", encoding="utf-8")
+    if mtime is not None:
+        os.utime(tmp, (mtime, mtime))
+    os.replace(tmp, path)
+    return path
+
+def _release(hashes: set[str]) -> list[Path]:
+    """delete the objects among <hashes> no manifest refers to, return their paths"""
+    for path in scan().values():
+        try:
+            m = json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            continue
+        hashes -= {m["head"], *m["turns"]}
+        if not hashes:
+            return []
+    gone = []
+    for h in hashes:
+        path = _object(h)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            continue
+        gone.append(path)
+    return gone
+
+def put(name: str, data: bytes, mtime: float | None = None) -> list[Path]:
+    """store session <name> with content <data>, return the paths written"""
+    head, pieces = split(data)
+    with _locked():
+        written = [_put(p) for p in [head, *pieces]]
+        old = manifest(name)
+        m = {"head": written[0][0], "turns": [h for h, _ in written[1:]], "size": len(data)}
+        touched = [p for _, p in written if p] + [_write(name, m, mtime)]
+        if old:
+            touched += _release({old["head"], *old["turns"]} - {m["head"], *m["turns"]})
+    return touched
+
+def fork(src: str, new: str, at: int | None = None) -> tuple[int, list[Path]]:
+    """
+    stored session <new> made of the head and first <at> turns of stored <src>
+    (default: all); its title names <new>. return (turns kept, paths written)
+    """
+    with _locked():
+        m = manifest(src)
+        if m is None:
+            raise FileNotFoundError(f"Chat '{src}' isn't in the turn store")
+        if has(new):
+            raise FileExistsError(f"Chat '{new}' already exists")
+        at = len(m["turns"]) if at is None else at
+        if not 0 <= at <= len(m["turns"]):
+            raise ValueError(f"Chat '{src}' has {len(m['turns'])} turns, can't fork at {at}")
+        head = _object(m["head"]).read_bytes()
+        title = f"# Chat: {src}\n".encode("utf-8")
+        if head.startswith(title):
+            head = f"# Chat: {new}\n".encode("utf-8") + head[len(title):]
+        h, written = _put(head)
+        kept = m["turns"][:at]
+        size = len(head) + sum(_object(k).stat().st_size for k in kept)
+        touched = [written] if written else []
+        touched.append(_write(new, {"head": h, "turns": kept, "size": size}))
+    return at, touched
+
+def append(name: str, data: bytes) -> list[Path]:
+    """
+    append <data> (whole turns, as chat_fs writes them) to stored <name>
+    only the new turns are written, and the last one when <data> changes
+    how it splits (bytes that trailed it)
+    """
+    with _locked():
+        m = manifest(name)
+        if m is None:
+            raise FileNotFoundError(f"Chat '{name}' isn't in the turn store")
+        if m["turns"]:
+            last = m["turns"][-1]
+            _, pieces = split(_object(last).read_bytes() + data, in_conv=True)
+            written = [_put(p) for p in pieces]
+            hashes = m["turns"][:-1] + [h for h, _ in written]
+        else:
+            last = m["head"]
+            head, pieces = split(_object(last).read_bytes() + data)
+            written = [_put(p) for p in [head, *pieces]]
+            m["head"], hashes = written[0][0], [h for h, _ in written[1:]]
+        m["turns"] = hashes
+        m["size"] += len(data)
+        touched = [p for _, p in written if p] + [_write(name, m)]
+        if last not in hashes and last != m["head"]:
+            touched += _release({last})
+    return touched
+
+def rename(old: str, new: str) -> list[Path]:
+    with _locked():
+        if has(new):
+            raise FileExistsError(f"Chat '{new}' already exists")
+        os.rename(manifest_path(old), manifest_path(new))
+    return [manifest_path(old), manifest_path(new)]
+
+def remove(name: str) -> list[Path]:
+    """drop stored <name> and the objects only it used, return the paths removed"""
+    with _locked():
+        m = manifest(name)
+        if m is None:
+            return []
+        manifest_path(name).unlink()
+        return [manifest_path(name)] + _release({m["head"], *m["turns"]})
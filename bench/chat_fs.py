@@ -0,0 +1,93 @@
+"""
+chat_fs operations on a large chat dir
+
+seeds <sessions> session files in a throwaway $HOME (git off) and times
+the operations every command is built from (fork forks one session over
+and over, the first time moving it into the turn store); "sync" and
+"search index" are one-off costs after files changed behind ag's back,
+everything else is the median of <repeat> runs; --layout flat seeds an old-style chat
+dir and adds the time `ag migrate` takes to shard it
+
+  python bench/chat_fs.py [--sessions 10000] [--turns 20] [--repeat 20] [--layout sharded|flat] [--json]
+"""
+import argparse, json, os, statistics, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+def seed(chats: Path, sessions: int, turns: int, sharded: bool) -> None:
+    from ag import layout
+    chats.mkdir(parents=True)
+    if sharded:
+        layout.set_state(chats, layout.SHARDED)
+    body = "".join(f"\n### User\nquestion {i} about topic {i % 7}\n\n\n### Assistant\n````reply\nanswer {i}\n````\n"
+                   for i in range(turns))
+    for i in range(sessions):
+        name = f"s{i:05d}"
+        path = layout.path(chats, name)
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(
+            f"# Chat: {name}\n\n## Instructions:\nbe brief\n\n## Conversation\n{body}", encoding="utf-8")
+
+def timed(fn, repeat: int = 1) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, default=10000)
+    ap.add_argument("--turns", type=int, default=20, help="turns per seeded session")
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--layout", choices=["sharded", "flat"], default="sharded", help="chat dir layout to seed")
+    ap.add_argument("--json", action="store_true", help="machine-readable output")
+    opts = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # chat_fs and friends resolve ~ at import time
+        os.environ["HOME"] = tmp
+        os.environ["AG_GIT"] = "off"
+        from ag import chat_fs, search
+
+        seed(chat_fs.CHAT_DIR, opts.sessions, opts.turns, opts.layout == "sharded")
+        r = opts.repeat
+        created = [f"new{k}" for k in range(r)]
+        moved = [(f"s{k:05d}", f"moved{k}") for k in range(r)]
+        fresh, to_move, to_delete = iter(created), iter(moved), iter(created)
+        forks = iter(f"fork{k}" for k in range(r))
+        results = {
+            "sync":            timed(lambda: chat_fs.list_sessions()),
+            "ls":              timed(lambda: chat_fs.list_sessions(), r),
+            "ls frecency":     timed(lambda: chat_fs.list_sessions("frecency"), r),
+            "list_chats":      timed(chat_fs.list_chats, r),
+            "new":             timed(lambda: chat_fs.new_chat(next(fresh)), r),
+            "append turn":     timed(lambda: chat_fs.append_user_and_reply(f"s{opts.sessions - 1:05d}", "q", "a", "bench"), r),
+            "read_messages":   timed(lambda: chat_fs.read_messages(f"s{opts.sessions - 2:05d}"), r),
+            "read last 4":     timed(lambda: chat_fs.read_messages(f"s{opts.sessions - 3:05d}", last=4), r),
+            "sw":              timed(lambda: chat_fs.set_default_chat(f"s{opts.sessions - 4:05d}"), r),
+            "mv":              timed(lambda: chat_fs.rename_chat(*next(to_move)), r),
+            "rm":              timed(lambda: chat_fs.delete_chat(next(to_delete)), r),
+            "fork":            timed(lambda: chat_fs.fork_chat(f"s{opts.sessions - 5:05d}", next(forks)), r),
+            "read fork":       timed(lambda: chat_fs.read_messages("fork0"), r),
+            "append fork":     timed(lambda: chat_fs.append_user_and_reply("fork1", "q", "a", "bench"), r),
+        }
+        results["search index"] = timed(lambda: search.update(chat_fs.CHAT_DIR, chat_fs.INSN_DIR))
+        results["search"] = timed(lambda: search.search("topic 3"), r)
+        if opts.layout == "flat":
+            results["migrate"] = timed(chat_fs.migrate_chats)
+
+    rows = [{"name": k, "ms": round(v, 3)} for k, v in results.items()]
+    if opts.json:
+        print(json.dumps({"bench": "chat_fs", "sessions": opts.sessions, "layout": opts.layout, "results": rows}, indent=2))
+    else:
+        print(f"{opts.sessions} sessions x {opts.turns} turns ({opts.layout}), median of {opts.repeat}")
+        for row in rows:
+            print(f"  {row['name']:<14} {row['ms']:10.3f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
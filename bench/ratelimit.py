@@ -0,0 +1,86 @@
+"""
+many ag processes against a rate-limited endpoint
+
+the mock server allows <quota> requests per second and answers the rest
+with 429 + Retry-After; <procs> worker processes send <requests> each,
+back to back, the way a shell loop of `ag ask ... &` would. per mode:
+  no retries  AG_RETRIES=0: every 429 is a failed job (ag before ag.ratelimit)
+  retries     Retry-After and jittered backoff, nothing shared up front
+  limited     retries plus AG_RPM just under the quota, shared by all workers
+each mode gets a fresh HOME, so the limiter state starts empty
+
+  python bench/ratelimit.py [--quota 20] [--procs 8] [--requests 10] [--json]
+"""
+import argparse, json, os, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from ag.mock_server import spawn
+
+# (label, environment)
+MODES = [
+    ("no retries", {"AG_RETRIES": "0"}),
+    ("retries",    {"AG_RETRIES": "8"}),
+    ("limited",    {"AG_RETRIES": "8", "AG_RPM": None}),  # AG_RPM: 95% of the quota
+]
+
+WORKER = """
+import sys
+from ag.api_client import get_client, APIError
+ok = failed = 0
+for i in range(int(sys.argv[1])):
+    try:
+        get_client().chat([{"role": "user", "content": f"bench {i}"}], use_cache=False)
+        ok += 1
+    except APIError:
+        failed += 1
+print(ok, failed)
+"""
+
+def run(url: str, env: dict, procs: int, requests: int) -> dict:
+    with tempfile.TemporaryDirectory() as home:
+        env = {**os.environ, "HOME": home, "API_KEY": "bench", "BASE_URL": url,
+               "AG_CACHE": "0", "AG_NO_DAEMON": "1", **env}
+        t0 = time.perf_counter()
+        workers = [subprocess.Popen([sys.executable, "-c", WORKER, str(requests)], cwd=ROOT, env=env,
+                                    stdout=subprocess.PIPE, text=True) for _ in range(procs)]
+        counts = [tuple(map(int, w.communicate()[0].split())) for w in workers]
+        secs = time.perf_counter() - t0
+        records = [json.loads(line) for line in (Path(home) / ".ag" / "metrics.jsonl").read_text().splitlines()]
+    ok = sum(c[0] for c in counts)
+    return {"ok": ok, "failed": sum(c[1] for c in counts),
+            "throttled": sum(r.get("retries", 0) for r in records) + sum(r.get("status") == 429 for r in records),
+            "secs": round(secs, 2), "ok_per_s": round(ok / secs, 2)}
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--quota", type=float, default=20, help="requests per second the server allows")
+    ap.add_argument("--procs", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=10, help="per process")
+    ap.add_argument("--json", action="store_true", help="machine-readable output")
+    opts = ap.parse_args()
+
+    proc, url = spawn(quota=opts.quota, latency=0.02, tokens=16)
+    results = []
+    try:
+        for label, env in MODES:
+            env = {k: v or str(int(opts.quota * 60 * 0.95)) for k, v in env.items()}
+            results.append({"name": label, **run(url, env, opts.procs, opts.requests)})
+            time.sleep(1.5)  # let the server's bucket fill up again
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    if opts.json:
+        print(json.dumps({"bench": "ratelimit", "quota": opts.quota, "results": results}, indent=2))
+    else:
+        print(f"{opts.procs} processes x {opts.requests} requests, server quota {opts.quota:g}/s")
+        for r in results:
+            print(f"  {r['name']:<11} ok {r['ok']:>4}  failed {r['failed']:>4}  429s {r['throttled']:>4}"
+                  f"  {r['secs']:6.2f} s  {r['ok_per_s']:6.2f} ok/s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+REPL turn latency against the bundled mock server
+
+drives `ag re` through a pipe and times each turn from the question
+being written to the next prompt; "fresh" journals every turn,
+"resume" appends every turn to an existing session with <history>
+turns, so a per-turn cost that grows with the conversation shows up as
+the last turns being slower than the first
+
+  python bench/repl.py [--turns 50] [--history 1000] [--json]
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from ag.mock_server import spawn
+
+PROMPT = b">>> "
+
+def seed_session(home: Path, name: str, turns: int) -> None:
+    chats = home / ".ag" / "chats"
+    chats.mkdir(parents=True, exist_ok=True)
+    body = "".join(f"\n### User\nquestion {i}\n\n\n### Assistant\n````reply\nanswer {i}\n````\n" for i in range(turns))
+    (chats / f"{name}.md").write_text(f"# Chat: {name}\n\n## Instructions:\nbe brief\n\n## Conversation\n{body}",
+                                      encoding="utf-8")
+
+def read_until_prompt(fd: int) -> None:
+    buf = b""
+    while not buf.endswith(PROMPT):
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            raise RuntimeError("ag re exited early")
+        buf += chunk
+
+def drive(args: list[str], turns: int, env: dict) -> list[float]:
+    proc = subprocess.Popen([sys.executable, "-m", "ag.cli", "re", *args], cwd=ROOT, env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    fd = proc.stdout.fileno()
+    times = []
+    try:
+        read_until_prompt(fd)
+        for i in range(turns):
+            t0 = time.perf_counter()
+            proc.stdin.write(f"turn {i}\n".encode())
+            proc.stdin.flush()
+            read_until_prompt(fd)
+            times.append((time.perf_counter() - t0) * 1000)
+        proc.stdin.write(b"/exit\n")
+        proc.stdin.close()
+        proc.wait(timeout=30)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    return times
+
+def summary(label: str, times: list[float]) -> dict:
+    q = statistics.quantiles(times, n=20)
+    k = max(1, len(times) // 5)
+    return {"name": label, "p50_ms": round(statistics.median(times), 2), "p95_ms": round(q[-1], 2),
+            "first_ms": round(statistics.median(times[:k]), 2), "last_ms": round(statistics.median(times[-k:]), 2)}
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--turns", type=int, default=50)
+    ap.add_argument("--history", type=int, default=1000, help="turns in the resumed session")
+    ap.add_argument("--latency", type=float, default=0.0, help="mock server latency in seconds")
+    ap.add_argument("--json", action="store_true", help="machine-readable output")
+    opts = ap.parse_args()
+
+    proc, url = spawn(latency=opts.latency, tokens=32)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            home = Path(tmp)
+            seed_session(home, "bench", opts.history)
+            env = {**os.environ, "HOME": str(home), "PYTHONPATH": str(ROOT), "BASE_URL": url,
+                   "API_KEY": "bench", "AG_CACHE": "0", "AG_GIT": "off"}
+            for label, args in (("fresh", []), (f"resume {opts.history}", ["--resume", "bench"])):
+                results.append(summary(label, drive(args, opts.turns, env)))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    if opts.json:
+        print(json.dumps({"bench": "repl", "turns": opts.turns, "results": results}, indent=2))
+    else:
+        print(f"{opts.turns} turns, mock latency {opts.latency * 1000:.0f} ms")
+        for r in results:
+            print(f"  {r['name']:<12} p50 {r['p50_ms']:6.2f} ms  p95 {r['p95_ms']:6.2f} ms"
+                  f"  first {r['first_ms']:6.2f} ms  last {r['last_ms']:6.2f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
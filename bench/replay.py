@@ -0,0 +1,80 @@
+"""
+cassette replay (ag.cassette): how faithful, how cheap
+
+<requests> streaming replies are recorded from a paced mock server
+(latency, ttft, tokens/s), then replayed: at speed 1 the ttft and total
+of each reply should match the recording; at speed 0 what is left is
+ag's own cost per request, with no server and no sockets
+
+  python bench/replay.py [--requests 20] [--tokens 200] [--json]
+"""
+import argparse, json, os, statistics, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("API_KEY", "bench")
+
+from ag.mock_server import spawn
+from ag.api_client import Client, TimedAdapter
+from ag import cassette
+
+SERVER = {"latency": 0.02, "ttft": 0.05, "rate": 2000}
+
+def measure(url: str, path: Path, mode: str, speed: float, requests: int) -> list[dict]:
+    transport = cassette.adapter(TimedAdapter(), str(path), mode, speed)
+    runs = []
+    with Client(base_url=url, api_key="bench", cache=None, transport=transport) as client:
+        for i in range(requests):
+            t0 = time.perf_counter()
+            first = None
+            for _ in client.stream([{"role": "user", "content": f"bench {i}"}], use_cache=False):
+                first = first or time.perf_counter()
+            runs.append({"ttft_ms": (first - t0) * 1000, "total_ms": (time.perf_counter() - t0) * 1000})
+    return runs
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--requests", type=int, default=20)
+    ap.add_argument("--tokens", type=int, default=200)
+    ap.add_argument("--json", action="store_true", help="machine-readable output")
+    opts = ap.parse_args()
+
+    proc, url = spawn(tokens=opts.tokens, **SERVER)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.jsonl"
+        try:
+            live = measure(url, path, "record", 1, opts.requests)
+        finally:
+            proc.terminate()
+            proc.wait()
+        cassette._cassettes.clear()  # replay from the file, as a new process would
+        modes = [("live (recording)", live),
+                 ("replay x1", measure(url, path, "replay", 1, opts.requests)),
+                 ("replay x10", measure(url, path, "replay", 10, opts.requests)),
+                 ("replay x0", measure(url, path, "replay", 0, opts.requests))]
+
+    results = []
+    for label, runs in modes:
+        r = {"name": label, **{k: round(statistics.median(x[k] for x in runs), 3) for k in runs[0]}}
+        r["requests_per_s"] = round(len(runs) / sum(x["total_ms"] for x in runs) * 1000, 1)
+        # how far each replayed reply is off its recording, at its speed
+        speed = {"replay x1": 1, "replay x10": 10}.get(label)
+        if speed:
+            r["drift_ms"] = round(statistics.median(abs(x["total_ms"] - l["total_ms"] / speed)
+                                                    for x, l in zip(runs, live)), 3)
+        results.append(r)
+
+    if opts.json:
+        print(json.dumps({"bench": "replay", "requests": opts.requests, "tokens": opts.tokens,
+                          "results": results}, indent=2))
+    else:
+        print(f"{opts.requests} streamed replies of {opts.tokens} tokens, median per request")
+        for r in results:
+            drift = f"  drift {r['drift_ms']:6.2f} ms" if "drift_ms" in r else ""
+            print(f"  {r['name']:<16} ttft {r['ttft_ms']:8.2f} ms  total {r['total_ms']:8.2f} ms"
+                  f"  {r['requests_per_s']:8.1f} req/s{drift}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+run every benchmark, write one JSON report, compare with an earlier one
+
+each bench runs in its own interpreter with --json; the report carries
+the git revision, python and platform so runs can be told apart.
+with --compare, every metric is checked against the baseline: *_ms
+should not grow, *_per_s should not shrink, by more than --threshold
+percent; any regression makes the exit status 1
+
+  python bench/run.py [-o report.json] [--compare baseline.json] [--threshold 10] [--quick]
+"""
+import argparse, json, platform, subprocess, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# (bench, args, quick args)
+BENCHES = [
+    ("startup", [],  ["--repeat", "5"]),
+    ("stream",  [],  ["--tokens", "5000", "--repeat", "3"]),
+    ("sse",     [],  ["--tokens", "20000", "--repeat", "3"]),
+    ("replay",  [],  ["--requests", "10"]),
+    ("repl",    [],  ["--turns", "20", "--history", "200"]),
+    ("chat_fs", [],  ["--sessions", "2000", "--repeat", "5"]),
+]
+
+def run(name: str, args: list[str]) -> dict:
+    proc = subprocess.run([sys.executable, str(ROOT / "bench" / f"{name}.py"), "--json", *args],
+                          cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode not in (0, 1) or not proc.stdout.strip():
+        return {"bench": name, "error": proc.stderr.strip().splitlines()[-1:] or ["no output"]}
+    report = json.loads(proc.stdout)
+    report["bench"] = name
+    return report
+
+def metrics(report: dict) -> dict[str, float]:
+    """flatten to "bench/result/metric" -> value"""
+    out = {}
+    for bench in report["benches"]:
+        for r in bench.get("results", []):
+            label = r.get("name") or r.get("command")
+            for key, value in r.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    out[f"{bench['bench']}/{label}/{key}"] = value
+    return out
+
+def compare(old: dict, new: dict, threshold: float) -> list[str]:
+    before, after = metrics(old), metrics(new)
+    regressions = []
+    for key in sorted(before.keys() & after.keys()):
+        a, b = before[key], after[key]
+        if key.endswith("_ms") or key.endswith("/ms"):
+            worse = b > a * (1 + threshold / 100) and b - a > 0.5
+        elif key.endswith("_per_s"):
+            worse = b < a * (1 - threshold / 100)
+        else:
+            continue
+        change = (b - a) / a * 100 if a else 0.0
+        line = f"{'REGRESSED' if worse else 'ok       '} {key:<48} {a:10.2f} -> {b:10.2f}  ({change:+.1f}%)"
+        print(line)
+        if worse:
+            regressions.append(key)
+    return regressions
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-o", "--output", default=None, help="write the report here (default: stdout)")
+    ap.add_argument("--compare", default=None, help="baseline report to compare with")
+    ap.add_argument("--threshold", type=float, default=10.0, help="percent change that counts as a regression")
+    ap.add_argument("--quick", action="store_true", help="smaller workloads")
+    ap.add_argument("--only", action="append", default=None, help="run just this bench (repeatable)")
+    opts = ap.parse_args()
+
+    rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": rev.stdout.strip() or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": opts.quick,
+        "benches": [],
+    }
+    for name, args, quick in BENCHES:
+        if opts.only and name not in opts.only:
+            continue
+        print(f"running {name} ...", file=sys.stderr)
+        report["benches"].append(run(name, quick if opts.quick else args))
+
+    text = json.dumps(report, indent=2)
+    if opts.output:
+        Path(opts.output).write_text(text + "\n", encoding="utf-8")
+    elif not opts.compare:
+        print(text)
+
+    failed = [b["bench"] for b in report["benches"] if "error" in b]
+    for name in failed:
+        print(f"{name} failed", file=sys.stderr)
+    if opts.compare:
+        baseline = json.loads(Path(opts.compare).read_text(encoding="utf-8"))
+        if compare(baseline, report, opts.threshold):
+            return 1
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+SSE parsing cost per delta, without a network
+
+a recorded-style stream of <tokens> chat.completion.chunk events is
+parsed from memory, cut into reads of the given sizes, by
+  lines    the loop ag used before ag.sse: requests' iter_lines(),
+           decode, strip "data: ", json.loads every line
+  decoder  ag.sse.Decoder + ag.sse.chunk, as ag.api_client uses them
+so the numbers are pure parsing throughput at token rates far above any
+real model's. the two run interleaved and the best of <repeat> runs
+counts, which keeps a noisy machine from deciding the comparison
+
+  python bench/sse.py [--tokens 200000] [--repeat 5] [--json]
+"""
+import argparse, io, json, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import requests
+from ag import sse
+
+# (label, read size in bytes, line ending)
+SCENARIOS = [
+    ("reads 64K",       65536, b"\n"),
+    ("reads 1460",      1460,  b"\n"),
+    ("reads 7",         7,     b"\n"),
+    ("crlf reads 1460", 1460,  b"\r\n"),
+]
+
+def make_stream(tokens: int, eol: bytes) -> bytes:
+    words = ["lorem", "ipsum", "dolor", "sit", "amet", "é", "日本"]
+    out = [b": keep-alive" + eol + eol]
+    first = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1700000000, "model": "mock",
+             "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+    out.append(b"data: " + json.dumps(first).encode() + eol + eol)
+    for i in range(tokens):
+        obj = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 1700000000,
+               "model": "mock", "choices": [{"index": 0, "delta": {"content": f" {words[i % len(words)]}"},
+                                             "finish_reason": None}]}
+        out.append(b"data: " + json.dumps(obj).encode() + eol + eol)
+    out.append(b"data: " + json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}).encode() + eol + eol)
+    out.append(b"data: [DONE]" + eol + eol)
+    return b"".join(out)
+
+def split(data: bytes, size: int) -> list[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def lines_loop(reads: list[bytes]) -> int:
+    """the pre-ag.sse loop, on a requests.Response fed the same reads"""
+    resp = requests.Response()
+    resp.raw = io.BytesIO(b"".join(reads))
+    size = len(reads[0])
+    n = 0
+    for line in resp.iter_lines(chunk_size=size):
+        if not line or line.startswith(b"data: [DONE]"):
+            continue
+        chunk = line.decode().removeprefix("data: ")
+        if chunk.startswith(":"):
+            continue  # the old loop crashed here: json.loads(": keep-alive")
+        data = json.loads(chunk)
+        if not data.get("choices"):
+            continue
+        if data["choices"][0]["delta"].get("content"):
+            n += 1
+    return n
+
+def decoder_loop(reads: list[bytes]) -> int:
+    decoder = sse.Decoder()
+    n = 0
+    for data in reads:
+        for event in decoder.feed(data):
+            if event.data == sse.DONE:
+                return n
+            c = sse.chunk(event.data)
+            if c and c.content:
+                n += 1
+    return n
+
+IMPLS = {"lines": lines_loop, "decoder": decoder_loop}
+
+def timed(reads: list[bytes], repeat: int) -> dict[str, tuple[float, int]]:
+    """impl -> (best seconds, deltas)"""
+    best = {impl: (float("inf"), 0) for impl in IMPLS}
+    for _ in range(repeat):
+        for impl, fn in IMPLS.items():
+            t0 = time.perf_counter()
+            n = fn(reads)
+            best[impl] = (min(best[impl][0], time.perf_counter() - t0), n)
+    return best
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--tokens", type=int, default=200000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--json", action="store_true", help="machine-readable output")
+    opts = ap.parse_args()
+
+    results = []
+    for label, size, eol in SCENARIOS:
+        reads = split(make_stream(opts.tokens, eol), size)
+        row = {"name": label}
+        for impl, (secs, n) in timed(reads, opts.repeat).items():
+            if n != opts.tokens:
+                print(f"{label} {impl}: {n} deltas, expected {opts.tokens}", file=sys.stderr)
+                return 1
+            row[f"{impl}_ms"] = round(secs * 1000, 3)
+            row[f"{impl}_deltas_per_s"] = round(n / secs)
+        row["speedup"] = round(row["lines_ms"] / row["decoder_ms"], 2)
+        results.append(row)
+
+    if opts.json:
+        print(json.dumps({"bench": "sse", "tokens": opts.tokens, "results": results}, indent=2))
+    else:
+        print(f"{opts.tokens} deltas per stream, best of {opts.repeat}")
+        for r in results:
+            print(f"  {r['name']:<16} lines {r['lines_deltas_per_s']:>9} deltas/s  "
+                  f"decoder {r['decoder_deltas_per_s']:>9} deltas/s  x{r['speedup']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+cold-start benchmark for ag subcommands
+
+every command runs in a fresh interpreter against a throwaway $HOME;
+the check fails when a command's median start-up overhead (wall time
+minus a bare `python -c pass`) exceeds the budget, or when a local-only
+command imports the network stack or loads .env
+
+  python bench/startup.py [--repeat 15] [--budget 50] [--absolute] [--json]
+"""
+import argparse, json, os, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# (label, argv, local-only)
+COMMANDS = [
+    ("--help",      ["--help"],                 True),
+    ("ls",          ["ls"],                     True),
+    ("cat",         ["cat", "bench"],           True),
+    ("sw",          ["sw", "bench"],            True),
+    ("insn ls",     ["insn", "ls"],             True),
+    ("insn cat",    ["insn", "cat", "bench"],   True),
+    ("ask --help",  ["ask", "--help"],          True),
+    ("re --help",   ["re", "--help"],           True),
+]
+
+HEAVY = ("requests", "urllib3", "charset_normalizer", "dotenv", "ag.config", "ag.api_client")
+
+PROBE = """
+import sys
+from ag.cli import cli
+try:
+    cli(sys.argv[1:], prog_name="ag")
+except SystemExit:
+    pass
+print("\\n" + " ".join(m for m in %r if m in sys.modules), file=sys.stderr)
+""" % (HEAVY,)
+
+def seed_home(home: Path) -> None:
+    chats = home / ".ag" / "chats"
+    insn = home / ".ag" / "insn"
+    chats.mkdir(parents=True)
+    insn.mkdir(parents=True)
+    (chats / "bench.md").write_text("# Chat: bench\n\n## Instructions:\n\n\n## Conversation\n\nhi\n", encoding="utf-8")
+    (insn / "bench.md").write_text("be brief\n", encoding="utf-8")
+
+def run(argv: list[str], env: dict) -> float:
+    t0 = time.perf_counter()
+    subprocess.run(argv, env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - t0) * 1000
+
+def heavy_modules(args: list[str], env: dict) -> list[str]:
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE, *args], env=env, cwd=ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    return proc.stderr.strip().splitlines()[-1].split() if proc.stderr.strip() else []
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=15)
+    ap.add_argument("--budget", type=float, default=50.0, help="ms per command")
+    ap.add_argument("--absolute", action="store_true", help="apply the budget to wall time, not overhead")
+    ap.add_argument("--json", action="store_true", help="machine-readable output")
+    opts = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        home = Path(tmp)
+        seed_home(home)
+        env = {**os.environ, "HOME": str(home), "PYTHONPATH": str(ROOT)}
+        env.pop("API_KEY", None)
+
+        base = statistics.median(run([sys.executable, "-c", "pass"], env) for _ in range(opts.repeat))
+        results = []
+        for label, args, local in COMMANDS:
+            times = [run([sys.executable, "-m", "ag.cli", *args], env) for _ in range(opts.repeat)]
+            median = statistics.median(times)
+            loaded = heavy_modules(args, env) if local else []
+            cost = median if opts.absolute else median - base
+            results.append({
+                "command": label,
+                "median_ms": round(median, 2),
+                "min_ms": round(min(times), 2),
+                "overhead_ms": round(median - base, 2),
+                "heavy_imports": loaded,
+                "ok": cost <= opts.budget and not loaded,
+            })
+
+    failed = [r for r in results if not r["ok"]]
+    if opts.json:
+        print(json.dumps({"interpreter_ms": round(base, 2), "budget_ms": opts.budget,
+                          "absolute": opts.absolute, "results": results}, indent=2))
+    else:
+        print(f"interpreter: {base:.1f} ms   budget: {opts.budget:.0f} ms {'wall' if opts.absolute else 'overhead'}")
+        for r in results:
+            flag = "ok  " if r["ok"] else "FAIL"
+            extra = f"  imports: {', '.join(r['heavy_imports'])}" if r["heavy_imports"] else ""
+            print(f"  {flag} {r['command']:<12} median {r['median_ms']:7.1f} ms  overhead {r['overhead_ms']:6.1f} ms{extra}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+streaming throughput against the bundled mock server
+
+the server runs in a child process and sends replies as fast as it can,
+so the numbers are ag's own cost per delta: request set-up, SSE parsing
+and the sinks; the ttft scenario checks that nothing adds latency in
+front of the first token
+
+  python bench/stream.py [--tokens 20000] [--repeat 5] [--json]
+"""
+import argparse, io, json, os, statistics, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("API_KEY", "bench")
+
+from ag.mock_server import spawn
+from ag.api_client import Client
+from ag.sinks import TerminalSink, consume
+
+# (label, server options, sink)
+SCENARIOS = [
+    ("deltas",          {},                  None),
+    ("deltas x16",      {"chunk": 16},       None),
+    ("split 7 bytes",   {"split": 7},        None),
+    ("terminal sink",   {},                  "terminal"),
+    ("ttft 50ms",       {"ttft": 0.05},      None),
+    # no chunked encoding, 50 tok/s: is each delta handed on as it arrives?
+    ("unchunked paced", {"framing": "close", "rate": 50, "tokens": 25}, None),
+]
+
+def measure(url: str, sink: str | None) -> dict:
+    with Client(base_url=url, api_key="bench", cache=None) as client:
+        t0 = time.perf_counter()
+        first = None
+        n = size = 0
+        deltas = client.stream([{"role": "user", "content": "bench"}], use_cache=False)
+        if sink == "terminal":
+            out = io.StringIO()
+            def counted():
+                nonlocal first, n, size
+                for d in deltas:
+                    first = first or time.perf_counter()
+                    n += 1
+                    size += len(d)
+                    yield d
+            consume(counted(), TerminalSink(out), keep=False)
+        else:
+            for d in deltas:
+                first = first or time.perf_counter()
+                n += 1
+                size += len(d)
+        total = time.perf_counter() - t0
+    return {"ttft_ms": (first - t0) * 1000, "total_ms": total * 1000,
+            "deltas_per_s": n / total, "mb_per_s": size / total / 1e6}
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--tokens", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--json", action="store_true", help="machine-readable output")
+    opts = ap.parse_args()
+
+    results = []
+    for label, server_opts, sink in SCENARIOS:
+        proc, url = spawn(**{"tokens": opts.tokens, **server_opts})
+        try:
+            runs = [measure(url, sink) for _ in range(opts.repeat)]
+        finally:
+            proc.terminate()
+            proc.wait()
+        results.append({"name": label, **{k: round(statistics.median(r[k] for r in runs), 3) for k in runs[0]}})
+
+    if opts.json:
+        print(json.dumps({"bench": "stream", "tokens": opts.tokens, "results": results}, indent=2))
+    else:
+        print(f"{opts.tokens} tokens per reply, median of {opts.repeat}")
+        for r in results:
+            print(f"  {r['name']:<15} ttft {r['ttft_ms']:7.2f} ms  total {r['total_ms']:8.1f} ms"
+                  f"  {r['deltas_per_s']:9.0f} deltas/s  {r['mb_per_s']:6.2f} MB/s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,9 +9,12 @@ setup(
         "requests",
         "python-dotenv",
     ],
+    extras_require={
+        "recall": ["numpy"],  # faster similarity search for ask/re --recall
+    },
     entry_points={
         "console_scripts": [
-            "ag = ag.cli:cli",
+            "ag = ag.daemon:main",
         ],
     },
 )
@@ -0,0 +1,58 @@
+"""
+repair of a live reply cut off by a crash
+
+ag resolves ~/.ag when it is imported, so each case runs in a fresh
+interpreter with HOME pointing at a temporary directory
+"""
+from pathlib import Path
+import json, os, subprocess, sys
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def run(home: Path, code: str) -> dict:
+    env = {**os.environ, "HOME": str(home), "AG_GIT": "off"}
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out)
+
+CRASH = """
+from ag.chat_fs import new_chat, ReplySink
+new_chat("s")
+sink = ReplySink("s", question="first question", model="m")
+sink.write("half a rep")
+sink.write("ly")
+sink.abort()
+"""
+
+def test_repair_keeps_the_question_typed_after_a_partial_reply(tmp_path):
+    res = run(tmp_path, CRASH + """
+import json
+from ag.chat_fs import chat_path, repair_chat, read_messages, unfinished_reply
+with chat_path("s").open("a") as f:
+    f.write("\\n### User\\nsecond question\\n")
+print(json.dumps({"repaired": repair_chat("s"), "partial": unfinished_reply("s"),
+                  "messages": read_messages("s"), "text": chat_path("s").read_text()}))
+""")
+    assert res["repaired"] and res["partial"] is None
+    assert "`````reply aborted\nhalf a reply\n`````\n" in res["text"]
+    assert [m["role"] for m in res["messages"]] == ["user", "assistant", "user"]
+    assert res["messages"][1]["content"].strip() == "half a reply"
+    assert res["messages"][2]["content"].strip() == "second question"
+    assert not (tmp_path / ".ag" / "index" / "s.live").exists()
+
+def test_repair_refuses_when_the_end_of_the_reply_is_unknown(tmp_path):
+    res = run(tmp_path, CRASH + """
+import json
+from ag.chat_fs import chat_path, repair_chat
+from ag.turns import live_path
+live_path("s").unlink()
+before = chat_path("s").read_text()
+try:
+    repair_chat("s")
+    error = None
+except ValueError as e:
+    error = str(e)
+print(json.dumps({"error": error, "unchanged": chat_path("s").read_text() == before}))
+""")
+    assert res["error"] and "ag ed s" in res["error"]
+    assert res["unchanged"]